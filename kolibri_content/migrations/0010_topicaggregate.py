@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 04:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0009_contentnode_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicAggregate',
+            fields=[
+                ('contentnode', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregate', serialize=False, to='content.ContentNode')),
+                ('resource_count', models.IntegerField(default=0)),
+                ('total_file_size', models.IntegerField(default=0)),
+                ('kind_counts', jsonfield.fields.JSONField(default={})),
+            ],
+        ),
+    ]
@@ -1,8 +1,13 @@
 from __future__ import unicode_literals
 
+import os
 import uuid
 
+from django.conf import settings
+from django.db import connections
 from django.db import models
+from django.db import router
+from django.db import transaction
 from django.utils.encoding import python_2_unicode_compatible
 from jsonfield import JSONField
 from le_utils.constants import content_kinds
@@ -13,6 +18,15 @@ from mptt.models import MPTTModel
 from mptt.models import TreeForeignKey
 
 
+# Range of lft values whose nodes are deleted in each transaction when a channel is
+# deleted; each node takes two values of its tree's range.
+DELETE_CHUNK_SIZE = 10000
+
+
+def get_content_storage_file_path(filename):
+    return os.path.join(settings.STORAGE_ROOT, filename[0], filename[1], filename)
+
+
 class License(models.Model):
     license_name = models.CharField(max_length=50)
     license_description = models.CharField(max_length=400, null=True, blank=True)
@@ -201,7 +215,20 @@ class LocalFileManager(models.Manager):
         return self.filter(files__isnull=True)
 
     def delete_orphan_file_objects(self):
-        return self.get_orphan_files().delete()
+        """
+        Deletes the local files that no file refers to with a single NOT EXISTS
+        statement, rather than loading them for the ORM to delete. Returns the
+        number deleted and the numbers by model, as QuerySet.delete does.
+        """
+        local_file_table = self.model._meta.db_table
+        with connections[router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {local_file} WHERE NOT EXISTS "
+                "(SELECT 1 FROM {file} f WHERE f.local_file_id = {local_file}.id)".format(
+                    local_file=local_file_table, file=File._meta.db_table)
+            )
+            count = cursor.rowcount
+        return count, {self.model._meta.label: count}
 
 
 @python_2_unicode_compatible
@@ -223,6 +250,12 @@ class LocalFile(models.Model):
     class Admin:
         pass
 
+    def get_filename(self):
+        return "{checksum}.{extension}".format(checksum=self.id, extension=self.extension)
+
+    def get_file_on_disk(self):
+        return get_content_storage_file_path(self.get_filename())
+
 
 class AssessmentMetaData(models.Model):
     """
@@ -247,6 +280,21 @@ class AssessmentMetaData(models.Model):
     is_manipulable = models.BooleanField(default=False)
 
 
+class TopicAggregate(models.Model):
+    """
+    Totals of the resources under a topic, computed when its channel is published so
+    that topics can be listed with them without a query over their descendants.
+    """
+
+    contentnode = models.OneToOneField(ContentNode, primary_key=True, related_name="aggregate")
+    # Number of the nodes under the topic that are not topics themselves.
+    resource_count = models.IntegerField(default=0)
+    # Size on disk of the files of the topic and the nodes under it, counting each LocalFile once.
+    total_file_size = models.IntegerField(default=0)
+    # A JSON blob of the number of the resources under the topic of each kind.
+    kind_counts = JSONField(default={})
+
+
 @python_2_unicode_compatible
 class ChannelMetadata(models.Model):
     """
@@ -274,6 +322,44 @@ class ChannelMetadata(models.Model):
     def __str__(self):
         return self.name
 
-    def delete_content_tree_and_files(self):
-        # Use Django ORM to ensure cascading delete:
-        self.root.delete()
+    def delete_content_tree_and_files(self, chunk_size=DELETE_CHUNK_SIZE):
+        """
+        Deletes the channel's nodes, with their files, tags, prerequisites, assessment
+        metadata and aggregates, and then the channel itself, using set-based statements
+        rather than loading everything for the ORM to cascade.
+
+        Nodes are deleted by ranges of `chunk_size` lft values, each in its own
+        transaction, from the end of the tree so that nodes go before their ancestors.
+        The channel is deleted with the range holding the root, so a deletion that
+        fails part way can be run again. Local files are left for
+        LocalFile.objects.delete_orphan_file_objects.
+        """
+        alias = router.db_for_write(ChannelMetadata, instance=self)
+        node_table = ContentNode._meta.db_table
+        tree_id, lft, rght = ContentNode.objects.using(alias).values_list(
+            "tree_id", "lft", "rght").get(pk=self.root_id)
+        references = [
+            (model._meta.db_table, field.column)
+            for model in (
+                File,
+                AssessmentMetaData,
+                TopicAggregate,
+                ContentNode.tags.through,
+                ContentNode.has_prerequisite.through,
+                ContentNode.related.through,
+            )
+            for field in model._meta.concrete_fields
+            if field.is_relation and field.related_model is ContentNode
+        ]
+        with connections[alias].cursor() as cursor:
+            for start in reversed(range(lft, rght + 1, chunk_size)):
+                nodes = "SELECT id FROM {} WHERE tree_id = %s AND lft BETWEEN %s AND %s".format(node_table)
+                params = [tree_id, start, start + chunk_size - 1]
+                with transaction.atomic(using=alias):
+                    for table, column in references:
+                        cursor.execute("DELETE FROM {} WHERE {} IN ({})".format(table, column, nodes), params)
+                    if start == lft:
+                        cursor.execute(
+                            "DELETE FROM {} WHERE id = %s".format(ChannelMetadata._meta.db_table), [self.pk])
+                    cursor.execute(
+                        "DELETE FROM {} WHERE tree_id = %s AND lft BETWEEN %s AND %s".format(node_table), params)
@@ -0,0 +1,5 @@
+"""
+Benchmarks for the indexing, search and publishing tools. Each module can be
+run with ``python -m kolibri_content_tools.benchmarks.<name>`` and prints its
+results as JSON so they can be compared between releases.
+"""
@@ -0,0 +1,140 @@
+"""
+Measures deleting a published synthetic channel from its content database
+with ChannelMetadata.delete_content_tree_and_files, against deleting its root
+node through the ORM, which cascades to everything referring to the nodes.
+
+Both run on copies of the same database, with some prerequisite and related
+links added, and the orphaned local files are deleted after each. The row
+counts the two leave in every content table are compared.
+
+    python -m kolibri_content_tools.benchmarks.channel_delete_suite --nodes 100000
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+
+from kolibri_content_tools.benchmarks import source_tree
+from kolibri_content_tools.benchmarks.publish_suite import configure_django
+from kolibri_content_tools.benchmarks.utils import write_results
+
+LINKS = 1000
+# The ORM collects each level of the tree in a nested call, and large
+# synthetic trees are hundreds of levels deep.
+RECURSION_LIMIT = 20000
+
+
+def count_rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        tables = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'content_%' ORDER BY name"
+        ).fetchall()
+        return {
+            table: connection.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+            for (table,) in tables
+        }
+    finally:
+        connection.close()
+
+
+def add_links(path, count=LINKS):
+    """
+    Links pairs of the first 2 * `count` nodes as prerequisites and as related.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            ids = [row[0] for row in connection.execute(
+                "SELECT id FROM content_contentnode ORDER BY lft LIMIT ?", [2 * count])]
+            pairs = list(zip(ids[:count], ids[count:]))
+            for table in ("content_contentnode_has_prerequisite", "content_contentnode_related"):
+                connection.executemany(
+                    "INSERT INTO {} (from_contentnode_id, to_contentnode_id) VALUES (?, ?)".format(table), pairs)
+    finally:
+        connection.close()
+
+
+def run(num_nodes=100000, num_exercises=100, chunk_size=None, seed=0):
+    root = tempfile.mkdtemp()
+    configure_django(root)
+    for name in ("CONTENT_DATABASE_DIR", "STORAGE_ROOT", "DB_ROOT"):
+        os.makedirs(getattr(settings, name), exist_ok=True)
+
+    # Imported once Django is configured, as publish loads the content models.
+    from kolibri_content import models as kolibrimodels
+    from kolibri_content.router import using_content_database
+    from kolibri_content_tools.kolibri_db import publish
+
+    if chunk_size is None:
+        chunk_size = kolibrimodels.DELETE_CHUNK_SIZE
+    channel = source_tree.generate_source_channel(num_nodes=num_nodes, num_exercises=num_exercises, seed=seed)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            tempdb, _ = publish.create_content_database(channel, True, None, False, workers=1, writer="sqlite")
+        path = os.path.join(root, "channel.sqlite3")
+        shutil.move(tempdb, path)
+        add_links(path)
+
+        results = {
+            "config": {
+                "nodes": num_nodes,
+                "exercises": num_exercises,
+                "chunk_size": chunk_size,
+                "seed": seed,
+            },
+            "rows_before": count_rows(path),
+        }
+        for method in ("orm_cascade", "delete_content_tree_and_files"):
+            copy = os.path.join(root, "{}.sqlite3".format(method))
+            shutil.copyfile(path, copy)
+            with using_content_database(copy):
+                channel_metadata = kolibrimodels.ChannelMetadata.objects.get()
+                start = time.perf_counter()
+                if method == "orm_cascade":
+                    recursion_limit = sys.getrecursionlimit()
+                    sys.setrecursionlimit(max(recursion_limit, RECURSION_LIMIT))
+                    try:
+                        channel_metadata.root.delete()
+                    finally:
+                        sys.setrecursionlimit(recursion_limit)
+                else:
+                    channel_metadata.delete_content_tree_and_files(chunk_size=chunk_size)
+                seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                orphans, _ = kolibrimodels.LocalFile.objects.delete_orphan_file_objects()
+                orphan_seconds = time.perf_counter() - start
+            results[method] = {
+                "seconds": seconds,
+                "orphan_file_objects_seconds": orphan_seconds,
+                "orphan_file_objects": orphans,
+                "rows_after": count_rows(copy),
+            }
+        results["identical"] = (
+            results["orm_cascade"]["rows_after"] == results["delete_content_tree_and_files"]["rows_after"]
+        )
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--exercises", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, help="lft values deleted per transaction")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(run(args.nodes, args.exercises, args.chunk_size, args.seed), args.output)
+
+
+if __name__ == "__main__":
+    main()
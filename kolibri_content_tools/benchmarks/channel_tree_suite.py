@@ -0,0 +1,132 @@
+"""
+Measures computing the size and resource counts by kind of every topic of a
+published synthetic channel with kolibri_db.channel_tree.ChannelTree, against
+an MPTT range query per topic with the ORM.
+
+The range queries are run for a sample of the topics, and their total for all
+topics is estimated from the sample. The tree's results for the sample are
+checked against theirs.
+
+    python -m kolibri_content_tools.benchmarks.channel_tree_suite --nodes 100000 --branching 10
+"""
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models import Sum
+from le_utils.constants import content_kinds
+
+from kolibri_content_tools.benchmarks import source_tree
+from kolibri_content_tools.benchmarks.publish_suite import configure_django
+from kolibri_content_tools.benchmarks.utils import write_results
+
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def query_topic_stats(node):
+    """
+    The stats of the topic `node` from range queries over its descendants.
+    """
+    from kolibri_content import models as kolibrimodels
+
+    subtree = kolibrimodels.ContentNode.objects.filter(tree_id=node.tree_id, lft__gte=node.lft, lft__lte=node.rght)
+    kind_counts = dict(
+        subtree.exclude(kind=content_kinds.TOPIC).values_list("kind").annotate(count=Count("id")).order_by()
+    )
+    return {
+        "size": kolibrimodels.File.objects.filter(contentnode__in=subtree).aggregate(size=Sum("file_size"))["size"] or 0,
+        "resource_count": sum(kind_counts.values()),
+        "kind_counts": kind_counts,
+    }
+
+
+def run(num_nodes=100000, branching=10, sample_topics=200, seed=0):
+    root = tempfile.mkdtemp()
+    configure_django(root)
+    for name in ("CONTENT_DATABASE_DIR", "STORAGE_ROOT", "DB_ROOT"):
+        os.makedirs(getattr(settings, name), exist_ok=True)
+
+    # Imported once Django is configured, as publish loads the content models.
+    from kolibri_content import models as kolibrimodels
+    from kolibri_content.router import using_content_database
+    from kolibri_content_tools.kolibri_db import channel_tree
+    from kolibri_content_tools.kolibri_db import publish
+
+    channel = source_tree.generate_source_channel(
+        num_nodes=num_nodes, num_exercises=0, branching=branching, seed=seed
+    )
+    tempdb = None
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            tempdb, _ = publish.create_content_database(
+                channel, True, None, False, workers=1, writer="sqlite"
+            )
+
+        results = {
+            "config": {
+                "nodes": num_nodes,
+                "branching": branching,
+                "sample_topics": sample_topics,
+                "seed": seed,
+                "numpy": channel_tree.numpy is not None,
+            },
+            "tree": {},
+        }
+        modes = [False, True] if channel_tree.numpy is not None else [False]
+        for use_numpy in modes:
+            tree, build_seconds = time_call(channel_tree.ChannelTree.from_database, tempdb, use_numpy=use_numpy)
+            stats, stats_seconds = time_call(tree.get_topic_stats)
+            results["tree"]["numpy" if use_numpy else "array"] = {
+                "build_seconds": build_seconds,
+                "topic_stats_seconds": stats_seconds,
+            }
+
+        with using_content_database(tempdb):
+            topics = list(kolibrimodels.ContentNode.objects.filter(kind=content_kinds.TOPIC))
+            sample = random.Random(seed).sample(topics, min(sample_topics, len(topics)))
+            start = time.perf_counter()
+            mismatches = sum(query_topic_stats(node) != stats[node.id] for node in sample)
+            query_seconds = time.perf_counter() - start
+        results.update({
+            "topics": len(topics),
+            "range_queries": {
+                "sampled_topics": len(sample),
+                "seconds": query_seconds,
+                "estimated_seconds_all_topics": query_seconds * len(topics) / max(len(sample), 1),
+            },
+            "mismatches": mismatches,
+        })
+        return results
+    finally:
+        if tempdb and os.path.exists(tempdb):
+            os.remove(tempdb)
+        shutil.rmtree(root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--branching", type=int, default=10, help="Maximum children per topic")
+    parser.add_argument(
+        "--sample-topics", type=int, default=200, help="Run range queries for this many topics"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(run(args.nodes, args.branching, args.sample_topics, args.seed), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compares HTML text extraction for HTML5 app and EPUB zips against the previous
+BeautifulSoup-based implementation.
+
+    python -m kolibri_content_tools.benchmarks.html_extraction path/to/*.zip
+"""
+import argparse
+import os
+import time
+import zipfile
+
+from kolibri_content_tools.benchmarks.utils import write_results
+from kolibri_content_tools.search import converters
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def legacy_get_text_from_zip(filename):
+    text = ""
+    zip = zipfile.ZipFile(filename)
+    files = zip.namelist()
+    for afile in files:
+        name_parts = os.path.splitext(afile)
+        if len(name_parts) > 1 and name_parts[1].startswith(".htm"):
+            content = zip.read(afile)
+            text += BeautifulSoup(content).get_text()
+
+    return text
+
+
+def extract(filename):
+    if filename.endswith(".epub"):
+        return converters.get_text_from_epub(filename)
+    return converters.get_text_from_zip(filename)
+
+
+def time_extraction(func, filename, repeat):
+    timings = []
+    text = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = func(filename)
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(text)
+
+
+def run(filenames, repeat=3):
+    implementations = {"current": extract}
+    if BeautifulSoup is not None:
+        implementations["legacy"] = legacy_get_text_from_zip
+
+    results = {
+        "parser": "lxml" if converters.etree is not None else "html.parser",
+        "files": [],
+        "totals": {name: 0.0 for name in implementations},
+    }
+    for filename in filenames:
+        entry = {"file": filename, "size": os.path.getsize(filename)}
+        for name, func in implementations.items():
+            elapsed, chars = time_extraction(func, filename, repeat)
+            entry[name] = {"seconds": elapsed, "chars": chars}
+            results["totals"][name] += elapsed
+        results["files"].append(entry)
+
+    if "legacy" in results["totals"] and results["totals"]["current"]:
+        results["speedup"] = results["totals"]["legacy"] / results["totals"]["current"]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+", help="HTML5 app zips or EPUB files")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(run(args.files, repeat=args.repeat), args.output)
+
+
+if __name__ == "__main__":
+    main()
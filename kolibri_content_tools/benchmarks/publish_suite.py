@@ -0,0 +1,151 @@
+"""
+Publishes a synthetic channel built from the in-memory source tree with
+kolibri_db.publish.create_content_database, reporting the time, queries and
+bytes written of each stage of the export. Stage figures include those of the
+stages nested in them: "map_nodes" covers "children", "nodes", "exercises",
+"files" and "tags", and "files" covers "thumbnails". With --workers, the
+per-node stages are summed over the worker processes, and "merge" is the time
+spent merging their databases. With --writer sqlite, rows are inserted with
+the sqlite3 module rather than the ORM; compare the two runs' "map_nodes" stage.
+
+    python -m kolibri_content_tools.benchmarks.publish_suite --nodes 2000 --exercises 200
+    python -m kolibri_content_tools.benchmarks.publish_suite --nodes 2000 --exercises 200 --writer sqlite
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+
+import django
+from django.conf import settings
+
+from kolibri_content_tools.benchmarks import source_tree
+from kolibri_content_tools.benchmarks.utils import write_results
+
+
+def configure_django(root):
+    """
+    Sets up the minimal Django settings publishing needs, storing everything
+    under `root`. Does nothing if Django is already configured.
+    """
+    if settings.configured:
+        return
+    settings.configure(
+        INSTALLED_APPS=["kolibri_content"],
+        USE_I18N=False,
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(root, "default.sqlite3"),
+            }
+        },
+        DATABASE_ROUTERS=["kolibri_content.router.ContentDBRouter"],
+        CONTENT_DATABASE_DIR=os.path.join(root, "databases"),
+        STORAGE_ROOT=os.path.join(root, "storage"),
+        DB_ROOT=os.path.join(root, "databases"),
+        MEDIA_ROOT=root,
+        TEMPLATES=[
+            {
+                "BACKEND": "django.template.backends.django.DjangoTemplates",
+                "APP_DIRS": True,
+            }
+        ],
+    )
+    django.setup()
+
+
+def run(
+    num_nodes=2000,
+    num_exercises=200,
+    files_per_node=1,
+    items_per_exercise=5,
+    seed=0,
+    profile_path=None,
+    workers=1,
+    writer="orm",
+):
+    root = tempfile.mkdtemp()
+    configure_django(root)
+    for name in ("CONTENT_DATABASE_DIR", "STORAGE_ROOT", "DB_ROOT"):
+        os.makedirs(getattr(settings, name), exist_ok=True)
+
+    # Imported once Django is configured, as publish loads the content models.
+    from kolibri_content_tools.kolibri_db import publish
+    from kolibri_content_tools.kolibri_db.instrumentation import PublishInstrumentation
+
+    channel = source_tree.generate_source_channel(
+        num_nodes=num_nodes,
+        num_exercises=num_exercises,
+        files_per_node=files_per_node,
+        items_per_exercise=items_per_exercise,
+        seed=seed,
+    )
+    instrumentation = PublishInstrumentation(channel.id, profile_path=profile_path)
+    tempdb = None
+    try:
+        # The migrate command prints its progress; keep stdout for the results.
+        with contextlib.redirect_stdout(sys.stderr):
+            tempdb, stats = publish.create_content_database(
+                channel, True, None, False, instrumentation=instrumentation, workers=workers, writer=writer
+            )
+        database_bytes = os.path.getsize(tempdb)
+    finally:
+        if tempdb and os.path.exists(tempdb):
+            os.remove(tempdb)
+        shutil.rmtree(root)
+
+    report = instrumentation.report()
+    return {
+        "config": {
+            "nodes": num_nodes,
+            "exercises": num_exercises,
+            "files_per_node": files_per_node,
+            "items_per_exercise": items_per_exercise,
+            "seed": seed,
+            "workers": workers,
+            "writer": writer,
+        },
+        "seconds": report["seconds"],
+        "nodes_per_second": num_nodes / report["seconds"],
+        "queries": report["queries"],
+        "database_bytes": database_bytes,
+        "stages": report["stages"],
+        "timings": report["timings"],
+        "published": stats.as_dict(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--exercises", type=int, default=200)
+    parser.add_argument("--files-per-node", type=int, default=1)
+    parser.add_argument("--items-per-exercise", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Publish in this many processes")
+    parser.add_argument(
+        "--writer", choices=["orm", "sqlite"], default="orm", help="Write the export database's rows with this"
+    )
+    parser.add_argument("--profile", help="Write a cProfile dump of the publish here")
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(
+        run(
+            args.nodes,
+            args.exercises,
+            args.files_per_node,
+            args.items_per_exercise,
+            args.seed,
+            args.profile,
+            args.workers,
+            args.writer,
+        ),
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
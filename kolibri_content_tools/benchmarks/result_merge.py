@@ -0,0 +1,107 @@
+"""
+Times merging and deduplicating cross-channel search hits with
+searchers.merge_results, against the list-based merge it replaced.
+
+    python -m kolibri_content_tools.benchmarks.result_merge --hits 200000
+"""
+import argparse
+import copy
+import random
+import time
+
+from kolibri_content_tools.benchmarks import synthetic
+from kolibri_content_tools.benchmarks.utils import write_results
+from kolibri_content_tools.search.searchers import merge_results
+
+# The list-based merge is quadratic, so it is only run up to this many hits.
+LEGACY_MAX_HITS = 20000
+
+
+def legacy_merge(result_lists):
+    all_results = []
+    all_nodes = []
+    for results in result_lists:
+        for result in results:
+            if "node_id" in result:
+                if result["node_id"] in all_nodes:
+                    continue
+                all_nodes.append(result["node_id"])
+
+            all_results.append(result)
+
+    return sorted(all_results, key=lambda x: -x["score"])
+
+
+def generate_hits(num_hits, num_channels, duplicate_rate=0.2, seed=0):
+    """
+    Returns one best-first list of hits per channel. About `duplicate_rate` of
+    the hits are copies of content that also appears in another channel.
+    """
+    rng = random.Random(seed)
+    channel_ids = [synthetic.make_id(rng) for _ in range(num_channels)]
+    content_ids = []
+    result_lists = [[] for _ in channel_ids]
+    for _ in range(num_hits):
+        if content_ids and rng.random() < duplicate_rate:
+            content_id = rng.choice(content_ids)
+        else:
+            content_id = synthetic.make_id(rng)
+            content_ids.append(content_id)
+        channel = rng.randrange(num_channels)
+        result_lists[channel].append(
+            {
+                "node_id": synthetic.make_id(rng),
+                "content_id": content_id,
+                "channel_id": channel_ids[channel],
+                "score": rng.random() * 10,
+            }
+        )
+    for results in result_lists:
+        results.sort(key=lambda x: -x["score"])
+    return result_lists
+
+
+def time_merge(func, result_lists):
+    # Merging adds a locations list to each hit, so work on a fresh copy.
+    result_lists = copy.deepcopy(result_lists)
+    start = time.perf_counter()
+    merged = func(result_lists)
+    return time.perf_counter() - start, len(merged)
+
+
+def run(num_hits=200000, num_channels=100, limit=20, seed=0):
+    result_lists = generate_hits(num_hits, num_channels, seed=seed)
+    results = {"hits": num_hits, "channels": num_channels}
+    for name, func in [
+        ("node_id", lambda lists: merge_results(lists, dedup_by="node_id")),
+        ("content_id", lambda lists: merge_results(lists, dedup_by="content_id")),
+        (
+            "content_id_page",
+            lambda lists: merge_results(lists, limit=limit, dedup_by="content_id"),
+        ),
+    ]:
+        elapsed, count = time_merge(func, result_lists)
+        results[name] = {"seconds": elapsed, "results": count}
+
+    if num_hits <= LEGACY_MAX_HITS:
+        elapsed, count = time_merge(legacy_merge, result_lists)
+        results["legacy"] = {"seconds": elapsed, "results": count}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hits", type=int, default=200000)
+    parser.add_argument("--channels", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(
+        run(args.hits, args.channels, args.limit, args.seed), args.output
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures single-channel query latency with IndexSearcher, comparing the cached
+searchers against opening the index and building a parser for every query.
+
+    python -m kolibri_content_tools.benchmarks.search_latency --nodes 5000
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+import whoosh.index
+from whoosh.qparser import MultifieldParser
+
+from kolibri_content_tools.benchmarks import synthetic
+from kolibri_content_tools.benchmarks.utils import summarize_timings
+from kolibri_content_tools.benchmarks.utils import write_results
+from kolibri_content_tools.search.searchers import DEFAULT_SEARCH_FIELDS
+from kolibri_content_tools.search.searchers import IndexSearcher
+
+
+def uncached_search(index_root, index_name, query):
+    index = whoosh.index.open_dir(index_root, indexname=index_name)
+    with index.searcher() as searcher:
+        parser = MultifieldParser(DEFAULT_SEARCH_FIELDS, index.schema)
+        results = searcher.search(parser.parse(query), terms=True, limit=None)
+        return [dict(result, score=result.score) for result in results]
+
+
+def time_queries(func, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(num_nodes=5000, num_queries=200, seed=0):
+    index_root = tempfile.mkdtemp()
+    try:
+        channel_id = synthetic.make_id(random.Random(seed))
+        index_name = "channel_{}".format(channel_id)
+        synthetic.build_channel_index(index_root, channel_id, num_nodes, seed=seed)
+        queries = synthetic.make_queries(num_queries, seed=seed)
+
+        uncached = time_queries(
+            lambda query: uncached_search(index_root, index_name, query), queries
+        )
+        with IndexSearcher(index_root) as searcher:
+            cached = time_queries(
+                lambda query: searcher.search_index(query, index_name), queries
+            )
+    finally:
+        shutil.rmtree(index_root)
+
+    return {
+        "nodes": num_nodes,
+        "queries": num_queries,
+        "uncached": summarize_timings(uncached),
+        "cached": summarize_timings(cached),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(run(args.nodes, args.queries, args.seed), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Indexes synthetic channels with ChannelIndexer, including text extracted from
+generated PDFs and HTML5 app zips, then measures indexing throughput, index
+size on disk, and single- and cross-channel query latency and throughput with
+IndexSearcher.
+
+    python -m kolibri_content_tools.benchmarks.search_suite --channels 5 --nodes 2000
+"""
+import argparse
+import collections
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kolibri_content_tools.benchmarks import synthetic
+from kolibri_content_tools.benchmarks.utils import summarize_timings
+from kolibri_content_tools.benchmarks.utils import write_results
+from kolibri_content_tools.search.indexers import ChannelIndexer
+from kolibri_content_tools.search.searchers import IndexSearcher
+
+# The indexer only reads the id and name of the channel it is given.
+Channel = collections.namedtuple("Channel", ["id", "name"])
+
+
+def get_index_size(index_root, index_name):
+    """
+    Returns the bytes on disk used by the index: its TOC files and segments.
+    """
+    prefixes = ("_{}_".format(index_name), "{}_".format(index_name))
+    return sum(
+        entry.stat().st_size
+        for entry in os.scandir(index_root)
+        if entry.is_file() and entry.name.startswith(prefixes)
+    )
+
+
+def index_channels(index_root, files_dir, channel_ids, num_nodes, pages, seed):
+    results = []
+    for channel_id in channel_ids:
+        # Files are generated up front so only indexing, including text
+        # extraction, is timed.
+        rows = list(
+            synthetic.generate_channel_nodes(
+                channel_id, num_nodes, files_dir, seed=seed, pages=pages
+            )
+        )
+        channel = Channel(channel_id, "Channel {}".format(channel_id))
+        start = time.perf_counter()
+        count = ChannelIndexer(channel, index_root).index_rows(rows)
+        elapsed = time.perf_counter() - start
+        results.append(
+            {
+                "channel_id": channel_id,
+                "docs": count,
+                "seconds": elapsed,
+                "docs_per_second": count / elapsed,
+                "index_bytes": get_index_size(
+                    index_root, "channel_{}".format(channel_id)
+                ),
+            }
+        )
+    return results
+
+
+def time_queries(func, queries, clients=1):
+    """
+    Runs `func` on each of `queries` from `clients` threads at once. Returns the
+    latency summary and the queries per second over the whole run.
+    """
+
+    def timed(query):
+        start = time.perf_counter()
+        func(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if clients > 1:
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            timings = list(executor.map(timed, queries))
+    else:
+        timings = [timed(query) for query in queries]
+    elapsed = time.perf_counter() - start
+
+    summary = summarize_timings(timings)
+    summary["queries_per_second"] = len(queries) / elapsed
+    return summary
+
+
+def run(
+    num_channels=5,
+    num_nodes=2000,
+    num_queries=200,
+    pages=3,
+    limit=20,
+    clients=1,
+    seed=0,
+):
+    rng = random.Random(seed)
+    channel_ids = [synthetic.make_id(rng) for _ in range(num_channels)]
+    queries = synthetic.make_queries(num_queries, seed=seed)
+    query_channels = [rng.choice(channel_ids) for _ in queries]
+    index_root = tempfile.mkdtemp()
+    files_dir = tempfile.mkdtemp()
+    try:
+        channels = index_channels(
+            index_root, files_dir, channel_ids, num_nodes, pages, seed
+        )
+        total_docs = sum(channel["docs"] for channel in channels)
+        total_seconds = sum(channel["seconds"] for channel in channels)
+
+        with IndexSearcher(index_root) as searcher:
+            searcher.warm_up()
+            single = time_queries(
+                lambda item: searcher.search_channel(item[0], item[1], limit=limit),
+                list(zip(queries, query_channels)),
+                clients,
+            )
+            cross = time_queries(
+                lambda query: searcher.search(query, limit=limit), queries, clients
+            )
+    finally:
+        shutil.rmtree(index_root)
+        shutil.rmtree(files_dir)
+
+    return {
+        "config": {
+            "channels": num_channels,
+            "nodes_per_channel": num_nodes,
+            "pages_per_file": pages,
+            "queries": num_queries,
+            "limit": limit,
+            "clients": clients,
+            "seed": seed,
+        },
+        "indexing": {
+            "docs": total_docs,
+            "seconds": total_seconds,
+            "docs_per_second": total_docs / total_seconds,
+            "index_bytes": sum(channel["index_bytes"] for channel in channels),
+            "channels": channels,
+        },
+        "single_channel": single,
+        "cross_channel": cross,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--nodes", type=int, default=2000, help="Nodes per channel")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--pages", type=int, default=3, help="Pages per generated PDF or zip"
+    )
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument(
+        "--clients", type=int, default=1, help="Threads issuing queries at once"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(
+        run(
+            args.channels,
+            args.nodes,
+            args.queries,
+            args.pages,
+            args.limit,
+            args.clients,
+            args.seed,
+        ),
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
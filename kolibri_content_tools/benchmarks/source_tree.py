@@ -0,0 +1,398 @@
+"""
+In-memory stand-ins for the Studio channel, node, file and assessment item
+objects that kolibri_db.publish reads, so channels can be published without a
+Studio database. Only the attributes and methods publish uses are provided.
+"""
+import bisect
+import collections
+import copy
+import operator
+import random
+
+from le_utils.constants import content_kinds
+from le_utils.constants import exercises
+from le_utils.constants import file_formats
+from le_utils.constants import format_presets
+from le_utils.constants import licenses
+from le_utils.constants import roles
+
+from kolibri_content_tools.benchmarks import synthetic
+
+PRESETS = {preset.id: preset for preset in format_presets.PRESETLIST}
+# The main file preset and extension for each kind of generated resource.
+RESOURCE_FILES = {
+    content_kinds.VIDEO: (format_presets.VIDEO_HIGH_RES, file_formats.MP4),
+    content_kinds.AUDIO: (format_presets.AUDIO, file_formats.MP3),
+    content_kinds.DOCUMENT: (format_presets.DOCUMENT, file_formats.PDF),
+    content_kinds.HTML5: (format_presets.HTML5_ZIP, file_formats.HTML5),
+}
+# Files beyond the first on a node are subtitles, in one of these languages.
+SUBTITLE_LANGUAGES = ["en", "es", "fr", "sw"]
+QUESTION_TYPES = [exercises.SINGLE_SELECTION, exercises.MULTIPLE_SELECTION]
+
+
+class SourceLicense:
+    def __init__(self, license_name, license_description="", is_custom=False):
+        self.license_name = license_name
+        self.license_description = license_description
+        self.is_custom = is_custom
+
+
+class SourceLanguage:
+    def __init__(self, id):
+        self.id = id
+
+
+class SourceFileFormat:
+    def __init__(self, extension):
+        self.extension = extension
+
+
+class SourceFile:
+    def __init__(self, id, checksum, file_size, preset_id, extension, language_id=None):
+        self.id = id
+        self.checksum = checksum
+        self.file_size = file_size
+        self.preset = PRESETS[preset_id]
+        self.preset_id = preset_id
+        self.file_format = SourceFileFormat(extension)
+        self.file_format_id = extension
+        self.language_id = language_id
+        self.language = SourceLanguage(language_id) if language_id else None
+        self.original_filename = "{}.{}".format(checksum, extension)
+        self.uploaded_by = None
+
+    def __str__(self):
+        return self.original_filename
+
+
+class SourceAssessmentItem:
+    def __init__(self, assessment_id, type, question, answers, hints, order):
+        self.assessment_id = assessment_id
+        self.type = type
+        self.question = question
+        self.answers = answers
+        self.hints = hints
+        self.order = order
+        self.raw_data = ""
+        self.randomize = True
+        self.files = []
+
+
+class SourceQuerySet:
+    """
+    The few queryset methods publish uses to read the tree, over the nodes of
+    a SourceNodeManager. Like the ORM, it returns new node instances.
+    """
+
+    def __init__(self, manager, lookups=None, ordering=None, fields=None, limit=None):
+        self.manager = manager
+        self.lookups = lookups or {}
+        self.ordering = ordering
+        self.fields = fields
+        self.limit = limit
+
+    def _clone(self, **changes):
+        options = dict(
+            lookups=self.lookups,
+            ordering=self.ordering,
+            fields=self.fields,
+            limit=self.limit,
+        )
+        options.update(changes)
+        return SourceQuerySet(self.manager, **options)
+
+    def filter(self, **lookups):
+        return self._clone(lookups=dict(self.lookups, **lookups))
+
+    def order_by(self, field):
+        return self._clone(ordering=field)
+
+    def values_list(self, *fields, **kwargs):
+        return self._clone(fields=(fields, kwargs.get("flat", False)))
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.start or key.step:
+            raise TypeError("Only [:limit] slices are supported")
+        return self._clone(limit=key.stop)
+
+    def __iter__(self):
+        lookups = dict(self.lookups)
+        after_lft = lookups.pop("lft__gt", None)
+        if "parent_id" in lookups:
+            nodes, lfts = self.manager.get_children(lookups.pop("parent_id"))
+            # Children are kept in lft order, like the index on lft.
+            if after_lft is not None:
+                nodes = nodes[bisect.bisect_right(lfts, after_lft):]
+        else:
+            nodes = list(self.manager.nodes.values())
+            if after_lft is not None:
+                nodes = [node for node in nodes if node.lft > after_lft]
+        for name, value in lookups.items():
+            nodes = [node for node in nodes if getattr(node, name) == value]
+        if self.ordering:
+            nodes = sorted(nodes, key=operator.attrgetter(self.ordering))
+        if self.limit is not None:
+            nodes = nodes[:self.limit]
+        if self.fields is None:
+            return iter([copy.copy(node) for node in nodes])
+        fields, flat = self.fields
+        if flat:
+            return iter([getattr(node, fields[0]) for node in nodes])
+        return iter([tuple(getattr(node, name) for name in fields) for node in nodes])
+
+
+class SourceNodeManager:
+    """
+    Holds the nodes of generated trees by id, like a table of Studio nodes.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.children = {}
+
+    def add_tree(self, root):
+        """
+        Numbers the tree under `root` in MPTT order and adds its nodes.
+        """
+        counter = 1
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                node.rght = counter
+            else:
+                node.lft = counter
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
+            counter += 1
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self.nodes[node.id] = node
+            self.children[node.id] = (list(node.children), [child.lft for child in node.children])
+            stack.extend(node.children)
+
+    def get_children(self, parent_id):
+        return self.children.get(parent_id, ([], []))
+
+    def filter(self, **lookups):
+        return SourceQuerySet(self).filter(**lookups)
+
+    def in_bulk(self, ids):
+        return {pk: copy.copy(self.nodes[pk]) for pk in ids}
+
+
+class SourceNode:
+    objects = SourceNodeManager()
+
+    def __init__(self, node_id, content_id, kind, title, parent=None, **fields):
+        self.id = node_id
+        self.node_id = node_id
+        self.content_id = content_id
+        self.kind = kind
+        self.title = title
+        self.parent = parent
+        self.description = fields.get("description", "")
+        self.author = fields.get("author", "")
+        self.copyright_holder = fields.get("copyright_holder", "")
+        self.sort_order = fields.get("sort_order", 0.0)
+        self.license = fields.get("license")
+        self.license_description = None
+        self.language_id = fields.get("language_id")
+        self.language = SourceLanguage(self.language_id) if self.language_id else None
+        self.role_visibility = fields.get("role_visibility", roles.LEARNER)
+        self.extra_fields = fields.get("extra_fields", {})
+        self.thumbnail_encoding = None
+        self.complete = True
+        self.changed = True
+        self.files = []
+        self.tags = []
+        self.assessment_items = []
+        self.exercise_files = []
+        self.children = []
+        self.lft = None
+        self.rght = None
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def parent_id(self):
+        return self.parent.id if self.parent is not None else None
+
+    def get_kind(self):
+        return self.kind
+
+    def get_children(self):
+        return list(SourceNode.objects.filter(parent_id=self.id).order_by("lft"))
+
+    def get_descendant_count(self):
+        return (self.rght - self.lft - 1) // 2
+
+    def is_empty_topic(self):
+        return self.kind == content_kinds.TOPIC and not self.children
+
+    def get_tags(self):
+        return list(self.tags)
+
+    def get_assessment_items(self, order_by=None):
+        if order_by:
+            return sorted(
+                self.assessment_items, key=lambda item: getattr(item, order_by)
+            )
+        return list(self.assessment_items)
+
+    def has_perseus_exercise(self):
+        return bool(self.exercise_files)
+
+    def add_exercise_file(self, path):
+        # Studio stores the generated .perseus file; only its size is kept.
+        with open(path, "rb") as f:
+            self.exercise_files.append(len(f.read()))
+
+
+class SourceChannel:
+    def __init__(self, id, name, root, language=None):
+        self.id = id
+        self.name = name
+        self.description = "Synthetic channel {}".format(id)
+        self.tagline = None
+        self.version = 0
+        self.icon_encoding = ""
+        self.language = language
+        self.root = root
+
+    def get_root_node(self):
+        return self.root
+
+    def has_changed_nodes(self):
+        return True
+
+
+def make_assessment_items(rng, vocabulary, count, answers=4):
+    items = []
+    for order in range(count):
+        correct = rng.randrange(answers)
+        items.append(
+            SourceAssessmentItem(
+                assessment_id=synthetic.make_id(rng),
+                type=rng.choice(QUESTION_TYPES),
+                question=synthetic.make_text(rng, vocabulary, 20),
+                answers=[
+                    {
+                        "answer": synthetic.make_text(rng, vocabulary, 3),
+                        "correct": i == correct,
+                        "order": i,
+                    }
+                    for i in range(answers)
+                ],
+                hints=[
+                    {"hint": synthetic.make_text(rng, vocabulary, 10), "order": 1}
+                ],
+                order=order,
+            )
+        )
+    return items
+
+
+def generate_source_channel(
+    num_nodes=1000,
+    num_exercises=100,
+    files_per_node=1,
+    items_per_exercise=5,
+    branching=10,
+    duplicate_file_rate=0.1,
+    seed=0,
+):
+    """
+    Returns a SourceChannel whose tree has `num_nodes` nodes including the
+    root, where topics have up to `branching` children. `num_exercises` of the
+    resources are exercises with `items_per_exercise` questions each; every
+    other resource has `files_per_node` files, a main file plus subtitles.
+    About `duplicate_file_rate` of the files reuse the checksum of an earlier
+    file, as the same file is often used by several nodes. The nodes are
+    added to SourceNode.objects, so publish can query them.
+    """
+    rng = random.Random(seed)
+    vocabulary = synthetic.make_vocabulary(random.Random(seed))
+    channel_id = synthetic.make_id(rng)
+    license = SourceLicense(licenses.CC_BY, "Attribution")
+
+    def make_node(kind, parent):
+        return SourceNode(
+            node_id=synthetic.make_id(rng),
+            content_id=synthetic.make_id(rng),
+            kind=kind,
+            title=synthetic.make_text(rng, vocabulary, rng.randint(2, 8))[:200],
+            parent=parent,
+            description=synthetic.make_text(
+                rng, vocabulary, rng.randint(5, 30)
+            )[:400],
+            author="Synthetic",
+            copyright_holder="Synthetic",
+            sort_order=float(len(parent.children)) if parent else 0.0,
+            license=license,
+            language_id=rng.choice(synthetic.LANGUAGES),
+            role_visibility=roles.COACH if rng.random() < 0.1 else roles.LEARNER,
+        )
+
+    root = make_node(content_kinds.TOPIC, None)
+    # Lay the tree out breadth first: each topic takes `branching` children,
+    # about one in `branching` of which are topics themselves.
+    open_topics = [root]
+    resources = []
+    for _ in range(num_nodes - 1):
+        parent = open_topics[0]
+        if len(open_topics) == 1 or rng.random() < 1.0 / branching:
+            open_topics.append(make_node(content_kinds.TOPIC, parent))
+        else:
+            resources.append(make_node(None, parent))
+        if len(parent.children) >= branching:
+            open_topics.pop(0)
+
+    exercise_nodes = set(
+        rng.sample(range(len(resources)), min(num_exercises, len(resources)))
+    )
+    checksums = collections.defaultdict(list)
+    file_sizes = {}
+    for i, node in enumerate(resources):
+        node.tags = rng.sample(synthetic.COMMON_WORDS, rng.randint(0, 3))
+        if i in exercise_nodes:
+            node.kind = content_kinds.EXERCISE
+            node.extra_fields = {"mastery_model": exercises.M_OF_N, "m": 3, "n": 5}
+            node.assessment_items = make_assessment_items(
+                rng, vocabulary, items_per_exercise
+            )
+            continue
+
+        node.kind = rng.choice(sorted(RESOURCE_FILES))
+        for j in range(files_per_node):
+            if j == 0:
+                preset_id, extension = RESOURCE_FILES[node.kind]
+                language_id = None
+            else:
+                preset_id, extension = format_presets.VIDEO_SUBTITLE, file_formats.VTT
+                language_id = SUBTITLE_LANGUAGES[(j - 1) % len(SUBTITLE_LANGUAGES)]
+            if checksums[extension] and rng.random() < duplicate_file_rate:
+                checksum = rng.choice(checksums[extension])
+            else:
+                checksum = synthetic.make_id(rng)
+                checksums[extension].append(checksum)
+                file_sizes[checksum] = rng.randint(1000, 50000000)
+            node.files.append(
+                SourceFile(
+                    id=synthetic.make_id(rng),
+                    checksum=checksum,
+                    file_size=file_sizes[checksum],
+                    preset_id=preset_id,
+                    extension=extension,
+                    language_id=language_id,
+                )
+            )
+
+    SourceNode.objects.add_tree(root)
+    return SourceChannel(channel_id, "Synthetic channel", root, language="en")
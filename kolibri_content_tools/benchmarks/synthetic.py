@@ -0,0 +1,187 @@
+"""
+Generators for synthetic channel data used by the benchmarks. Everything is
+driven by a seeded random.Random so runs are reproducible.
+"""
+import os
+import random
+import uuid
+import zipfile
+
+import whoosh.index
+from le_utils.constants import content_kinds
+
+from kolibri_content_tools.search.indexers import IndexNode
+from kolibri_content_tools.search.indexers import node_schema
+
+COMMON_WORDS = [
+    "fractions", "photosynthesis", "algebra", "geometry", "reading", "history",
+    "science", "energy", "water", "numbers", "addition", "planets", "cells",
+    "grammar", "music", "health", "climate", "animals", "plants", "maps",
+]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "pe", "zu", "da", "qi"]
+CONTENT_KINDS = ["video", "document", "html5", "exercise", "audio"]
+LANGUAGES = ["en", "es", "fr", "sw", "hi"]
+# Words per page of the generated PDFs and per page of the HTML5 app zips.
+WORDS_PER_PAGE = 300
+
+
+def make_vocabulary(rng, size=5000):
+    words = set(COMMON_WORDS)
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_text(rng, vocabulary, num_words):
+    # Skew word choice so a few words are common, as in real text.
+    return " ".join(
+        vocabulary[min(int(rng.expovariate(1.0 / 200)), len(vocabulary) - 1)]
+        for _ in range(num_words)
+    )
+
+
+def make_id(rng):
+    return uuid.UUID(int=rng.getrandbits(128)).hex
+
+
+def generate_documents(channel_id, num_nodes, seed=0, content_words=200):
+    """
+    Yields whoosh documents in the shape ChannelIndexer writes, for a channel of
+    `num_nodes` nodes.
+    """
+    vocabulary = make_vocabulary(random.Random(seed))
+    rng = random.Random("{}-{}".format(seed, channel_id))
+    root_id = make_id(rng)
+    for i in range(num_nodes):
+        title = make_text(rng, vocabulary, rng.randint(2, 8))
+        tags = rng.sample(COMMON_WORDS, 3)
+        yield {
+            "node_id": root_id if i == 0 else make_id(rng),
+            "channel_id": channel_id,
+            "content_id": make_id(rng),
+            "parent_id": None if i == 0 else root_id,
+            "kind": "topic" if i == 0 else rng.choice(CONTENT_KINDS),
+            "coach_content": rng.random() < 0.1,
+            "title": title,
+            "description": make_text(rng, vocabulary, rng.randint(5, 30)),
+            "tags": ",".join(tags),
+            "languages": rng.choice(LANGUAGES),
+            "content": make_text(rng, vocabulary, content_words),
+            "completion": " ".join([title] + tags),
+        }
+
+
+def build_channel_index(index_root, channel_id, num_nodes, seed=0):
+    index = whoosh.index.create_in(
+        index_root, node_schema, indexname="channel_{}".format(channel_id)
+    )
+    writer = index.writer()
+    for document in generate_documents(channel_id, num_nodes, seed=seed):
+        writer.add_document(**document)
+    writer.commit()
+    return index
+
+
+def write_pdf(path, pages):
+    """
+    Writes a minimal PDF with one page of plain text per item of `pages`.
+    """
+    # Objects are numbered from 1 in list order; the page tree is filled in
+    # once the pages are known.
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for text in pages:
+        stream = "BT /F1 10 Tf 20 800 Td ({}) Tj ET".format(
+            text.replace("\\", "").replace("(", "").replace(")", "")
+        )
+        objects.append(
+            "<< /Length {} >>\nstream\n{}\nendstream".format(len(stream), stream)
+        )
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            "/Resources << /Font << /F1 3 0 R >> >> /Contents {} 0 R >>".format(
+                len(objects)
+            )
+        )
+        page_refs.append("{} 0 R".format(len(objects)))
+    objects[1] = "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+        " ".join(page_refs), len(page_refs)
+    )
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += "{} 0 obj\n{}\nendobj\n".format(number, body).encode("latin-1")
+    xref = len(data)
+    data += "xref\n0 {}\n0000000000 65535 f \n".format(len(objects) + 1).encode("latin-1")
+    for offset in offsets:
+        data += "{:010d} 00000 n \n".format(offset).encode("latin-1")
+    data += "trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(
+        len(objects) + 1, xref
+    ).encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_html5_zip(path, pages):
+    """
+    Writes an HTML5 app zip with one HTML page per item of `pages`, plus the
+    script and stylesheet such apps usually bundle.
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i, text in enumerate(pages):
+            zf.writestr(
+                "page{}.html".format(i),
+                "<html><head><title>Page {}</title><script>var page = {};</script>"
+                "</head><body><h1>Page {}</h1><p>{}</p></body></html>".format(i, i, i, text),
+            )
+        zf.writestr("js/app.js", "function start() { return 0; }\n" * 200)
+        zf.writestr("css/app.css", "body { margin: 0; }\n" * 200)
+
+
+def generate_channel_nodes(channel_id, num_nodes, files_dir, seed=0, pages=3):
+    """
+    Yields (node, tag_names, filenames) rows in the shape iter_channel_nodes
+    returns, for a channel of `num_nodes` nodes under one root topic. Document
+    and HTML5 nodes get a generated PDF or HTML5 app zip of `pages` pages,
+    written to `files_dir`.
+    """
+    vocabulary = make_vocabulary(random.Random(seed))
+    rng = random.Random("{}-{}".format(seed, channel_id))
+    root_id = make_id(rng)
+    for i in range(num_nodes):
+        kind = content_kinds.TOPIC if i == 0 else rng.choice(CONTENT_KINDS)
+        node = IndexNode(
+            id=root_id if i == 0 else make_id(rng),
+            tree_id=1,
+            lft=i + 1,
+            parent_id=None if i == 0 else root_id,
+            content_id=make_id(rng),
+            kind=kind,
+            title=make_text(rng, vocabulary, rng.randint(2, 8)),
+            description=make_text(rng, vocabulary, rng.randint(5, 30)),
+            lang_id=rng.choice(LANGUAGES),
+            coach_content=rng.random() < 0.1,
+        )
+        filenames = []
+        if kind in (content_kinds.DOCUMENT, content_kinds.HTML5):
+            texts = [make_text(rng, vocabulary, WORDS_PER_PAGE) for _ in range(pages)]
+            if kind == content_kinds.DOCUMENT:
+                filename = os.path.join(files_dir, "{}.pdf".format(node.id))
+                write_pdf(filename, texts)
+            else:
+                filename = os.path.join(files_dir, "{}.zip".format(node.id))
+                write_html5_zip(filename, texts)
+            filenames.append(filename)
+        yield node, rng.sample(COMMON_WORDS, 3), filenames
+
+
+def make_queries(num_queries, seed=0):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(random.Random(seed))
+    return [make_text(rng, vocabulary, rng.randint(1, 3)) for _ in range(num_queries)]
@@ -0,0 +1,96 @@
+"""
+Measures the memory and time publish needs to walk a synthetic source tree,
+comparing the breadth-first queue of node instances publish used to keep with
+the chunked depth-first streaming of kolibri_db.tree.iter_source_nodes.
+
+Memory is the peak traced by tracemalloc during the walk, so it excludes the
+generated tree itself and covers the node instances the walk loads.
+
+    python -m kolibri_content_tools.benchmarks.tree_suite --nodes 200000 --branching 10 1000
+"""
+import argparse
+import collections
+import time
+import tracemalloc
+
+from kolibri_content_tools.benchmarks import source_tree
+from kolibri_content_tools.benchmarks.utils import write_results
+from kolibri_content_tools.kolibri_db.tree import iter_source_nodes
+from kolibri_content_tools.kolibri_db.tree import should_export_node
+from kolibri_content_tools.kolibri_db.tree import TREE_CHUNK_SIZE
+
+
+def iter_breadth_first(root_node):
+    """
+    The walk map_content_nodes used to do: a queue of all the instances
+    returned by get_children of every exported node.
+    """
+    node_queue = collections.deque([root_node])
+    while node_queue:
+        node = node_queue.popleft()
+        yield node
+        if should_export_node(node):
+            node_queue.extend(node.get_children())
+
+
+def measure(iter_nodes, root_node):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for _ in iter_nodes(root_node):
+        count += 1
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "nodes": count,
+        "seconds": seconds,
+        "nodes_per_second": count / seconds,
+        "peak_bytes": peak,
+    }
+
+
+def run(num_nodes=200000, branching_values=(10, 1000), chunk_size=TREE_CHUNK_SIZE, seed=0):
+    results = {
+        "config": {
+            "nodes": num_nodes,
+            "branching": list(branching_values),
+            "chunk_size": chunk_size,
+            "seed": seed,
+        },
+        "shapes": {},
+    }
+    for branching in branching_values:
+        channel = source_tree.generate_source_channel(
+            num_nodes=num_nodes, num_exercises=0, branching=branching, seed=seed
+        )
+        root_node = channel.get_root_node()
+        results["shapes"][str(branching)] = {
+            "breadth_first": measure(iter_breadth_first, root_node),
+            "streaming": measure(
+                lambda node: iter_source_nodes(node, chunk_size=chunk_size), root_node
+            ),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=200000)
+    parser.add_argument(
+        "--branching",
+        type=int,
+        nargs="+",
+        default=[10, 1000],
+        help="Maximum children per topic of each tree shape to measure",
+    )
+    parser.add_argument("--chunk-size", type=int, default=TREE_CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path")
+    args = parser.parse_args(argv)
+
+    write_results(run(args.nodes, args.branching, args.chunk_size, args.seed), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import json
+import sys
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize_timings(timings):
+    """
+    Summarizes a list of timings in seconds as milliseconds percentiles.
+    """
+    values = sorted(timings)
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else None,
+        "p50_ms": 1000 * percentile(values, 0.50) if values else None,
+        "p95_ms": 1000 * percentile(values, 0.95) if values else None,
+        "p99_ms": 1000 * percentile(values, 0.99) if values else None,
+    }
+
+
+def write_results(results, output=None):
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as f:
+            f.write(data + "\n")
+    else:
+        sys.stdout.write(data + "\n")
@@ -0,0 +1,116 @@
+"""
+Totals of the resources under each topic of an export database, stored as
+TopicAggregate rows so that topics can be listed with them without a range
+query over their descendants.
+
+The totals of all topics are computed in one pass over the nodes in tree
+order, keeping the totals of the topics whose subtrees are still being read
+on a stack. When a topic's subtree ends, its totals are merged into its
+parent's. Sizes count each local file once per topic, so each topic keeps
+the sizes of its distinct local files, and when merging the smaller set is
+added to the larger.
+"""
+import collections
+import logging
+
+from django.db import connections
+from django.db import transaction
+from le_utils.constants import content_kinds
+
+from kolibri_content import models as kolibrimodels
+from kolibri_content.router import get_active_content_database
+
+from .reader import ChannelDatabaseReader
+
+logger = logging.getLogger(__name__)
+
+AGGREGATE_BATCH_SIZE = 500
+
+
+class TopicTotals:
+    __slots__ = ("node_id", "tree_id", "rght", "resource_count", "kind_counts", "file_sizes", "total_file_size")
+
+    def __init__(self, node_id, tree_id, rght):
+        self.node_id = node_id
+        self.tree_id = tree_id
+        self.rght = rght
+        self.resource_count = 0
+        self.kind_counts = collections.Counter()
+        # Size of each distinct local file, by checksum.
+        self.file_sizes = {}
+        self.total_file_size = 0
+
+    def contains(self, tree_id, lft):
+        return tree_id == self.tree_id and lft < self.rght
+
+    def add_files(self, files):
+        for checksum, file_size in files:
+            if checksum not in self.file_sizes:
+                self.file_sizes[checksum] = file_size or 0
+                self.total_file_size += file_size or 0
+
+    def add_resource(self, kind, files):
+        self.resource_count += 1
+        self.kind_counts[kind] += 1
+        self.add_files(files)
+
+    def merge(self, child):
+        self.resource_count += child.resource_count
+        self.kind_counts.update(child.kind_counts)
+        if len(child.file_sizes) > len(self.file_sizes):
+            self.file_sizes, child.file_sizes = child.file_sizes, self.file_sizes
+            self.total_file_size, child.total_file_size = child.total_file_size, self.total_file_size
+        self.add_files(child.file_sizes.items())
+
+
+def iter_topic_aggregates(reader):
+    """
+    Yields an unsaved TopicAggregate for every topic of the database read by
+    `reader`, each after those of the topics under it.
+    """
+    files = collections.defaultdict(list)
+    for node_id, checksum, file_size in reader.iter_node_local_files():
+        files[node_id].append((checksum, file_size))
+
+    def close(totals):
+        aggregate = kolibrimodels.TopicAggregate(
+            contentnode_id=totals.node_id,
+            resource_count=totals.resource_count,
+            total_file_size=totals.total_file_size,
+            kind_counts=dict(totals.kind_counts),
+        )
+        # Merging may leave the totals' file sizes in the parent.
+        if stack:
+            stack[-1].merge(totals)
+        return aggregate
+
+    stack = []
+    for node_id, tree_id, lft, rght, kind in reader.iter_node_values(("id", "tree_id", "lft", "rght", "kind")):
+        while stack and not stack[-1].contains(tree_id, lft):
+            yield close(stack.pop())
+        if kind == content_kinds.TOPIC:
+            totals = TopicTotals(node_id, tree_id, rght)
+            totals.add_files(files.get(node_id, ()))
+            stack.append(totals)
+        elif stack:
+            # Resources are counted in the topic they are in, and its ancestors once it is merged.
+            stack[-1].add_resource(kind, files.get(node_id, ()))
+    while stack:
+        yield close(stack.pop())
+
+
+def write_topic_aggregates(batch_size=AGGREGATE_BATCH_SIZE):
+    """
+    Replaces the TopicAggregates of the active export database with those of
+    its topics as they are now. Returns the number of topics.
+    """
+    alias = get_active_content_database()
+    # Read before writing, as the reader's connection holds a read lock on
+    # the database while its nodes are being read.
+    with ChannelDatabaseReader(connections[alias].settings_dict["NAME"]) as reader:
+        aggregates = list(iter_topic_aggregates(reader))
+    with transaction.atomic(using=alias):
+        kolibrimodels.TopicAggregate.objects.all().delete()
+        kolibrimodels.TopicAggregate.objects.bulk_create(aggregates, batch_size=batch_size)
+    logger.debug("Wrote the aggregates of {} topics".format(len(aggregates)))
+    return len(aggregates)
@@ -0,0 +1,160 @@
+"""
+Availability stamping of the active content database: which of its local
+files are in content storage, and so which files and nodes can be used.
+
+Storage paths are checked in batches in a thread pool, through a cache of
+the results so that databases sharing files only check them once. The
+results are then written with a few set-based statements: local files in
+chunks of ids, files from their local files, resources from their files,
+and topics a level at a time from their children, deepest first.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db import transaction
+from le_utils.constants import content_kinds
+
+from kolibri_content import models as kolibrimodels
+from kolibri_content.router import get_active_content_database
+
+logger = logging.getLogger(__name__)
+
+# Checking paths waits on the file system, which releases the GIL.
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+STAT_BATCH_SIZE = 1000
+# Kept below SQLite's default limit of 999 variables per query, as each chunk
+# of ids is passed as the parameters of an IN clause.
+UPDATE_CHUNK_SIZE = 500
+
+
+class StorageStatCache:
+    """
+    Remembers whether paths exist, for `max_age` seconds or, by default, for
+    the lifetime of the cache.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_missing(self, paths):
+        """
+        Returns the subset of `paths` with no cached result.
+        """
+        now = time.monotonic()
+        missing = []
+        for path in paths:
+            entry = self._entries.get(path)
+            if entry is None or (self.max_age is not None and now - entry[1] > self.max_age):
+                missing.append(path)
+        self.misses += len(missing)
+        self.hits += len(paths) - len(missing)
+        return missing
+
+    def put_many(self, path_exists):
+        now = time.monotonic()
+        for path, exists in path_exists:
+            self._entries[path] = (exists, now)
+
+    def exists(self, path):
+        return self._entries[path][0]
+
+
+def stat_paths(paths):
+    return [(path, os.path.exists(path)) for path in paths]
+
+
+def check_paths(paths, cache=None, max_workers=DEFAULT_WORKERS, batch_size=STAT_BATCH_SIZE):
+    """
+    Returns the set of `paths` that exist, checking those not in `cache`
+    in batches of `batch_size`, `max_workers` at a time.
+    """
+    if cache is None:
+        cache = StorageStatCache()
+    missing = cache.get_missing(paths)
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    if len(batches) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for results in executor.map(stat_paths, batches):
+                cache.put_many(results)
+    else:
+        for batch in batches:
+            cache.put_many(stat_paths(batch))
+    return {path for path in paths if cache.exists(path)}
+
+
+def chunks(values, size=UPDATE_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def stamp_availability(storage_dir=None, cache=None, max_workers=DEFAULT_WORKERS):
+    """
+    Sets `available` on every local file, file and node of the active content
+    database from whether its local files are in `storage_dir`, by default
+    the STORAGE_ROOT setting. Returns the numbers of local files and
+    nodes available and not.
+
+    A resource is available when one of its files that are not supplementary
+    is, and a topic when one of its children is.
+    """
+    if storage_dir is None:
+        storage_dir = settings.STORAGE_ROOT
+    alias = get_active_content_database()
+    local_file_table = kolibrimodels.LocalFile._meta.db_table
+    file_table = kolibrimodels.File._meta.db_table
+    node_table = kolibrimodels.ContentNode._meta.db_table
+
+    paths = {}
+    for checksum, extension in kolibrimodels.LocalFile.objects.values_list("id", "extension"):
+        filename = "{}.{}".format(checksum, extension)
+        paths[os.path.join(storage_dir, filename[0], filename[1], filename)] = checksum
+    existing = check_paths(list(paths), cache=cache, max_workers=max_workers)
+    available_checksums = [paths[path] for path in existing]
+
+    with transaction.atomic(using=alias):
+        cursor = connections[alias].cursor()
+        cursor.execute("UPDATE {} SET available = 0".format(local_file_table))
+        for chunk in chunks(available_checksums):
+            cursor.execute(
+                "UPDATE {} SET available = 1 WHERE id IN ({})".format(local_file_table, ", ".join("%s" for _ in chunk)),
+                chunk,
+            )
+        cursor.execute(
+            "UPDATE {file} SET available = "
+            "(SELECT l.available FROM {local_file} l WHERE l.id = {file}.local_file_id)".format(
+                file=file_table, local_file=local_file_table)
+        )
+        cursor.execute(
+            "UPDATE {node} SET available = EXISTS (SELECT 1 FROM {file} f WHERE f.contentnode_id = {node}.id "
+            "AND f.available = 1 AND f.supplementary = 0) WHERE kind != %s".format(node=node_table, file=file_table),
+            [content_kinds.TOPIC],
+        )
+        cursor.execute("SELECT MAX(level) FROM {} WHERE kind = %s".format(node_table), [content_kinds.TOPIC])
+        max_level = cursor.fetchone()[0]
+        if max_level is not None:
+            # Children are a level below their parents, so each level's topics
+            # are stamped after all their children.
+            for level in range(max_level, -1, -1):
+                cursor.execute(
+                    "UPDATE {node} SET available = EXISTS (SELECT 1 FROM {node} c WHERE c.parent_id = {node}.id "
+                    "AND c.available = 1) WHERE kind = %s AND level = %s".format(node=node_table),
+                    [content_kinds.TOPIC, level],
+                )
+        cursor.execute("SELECT available, COUNT(*) FROM {} GROUP BY available".format(node_table))
+        node_counts = dict(cursor.fetchall())
+
+    counts = {
+        "local_files_available": len(available_checksums),
+        "local_files_missing": len(paths) - len(available_checksums),
+        "nodes_available": node_counts.get(1, 0),
+        "nodes_unavailable": node_counts.get(0, 0),
+    }
+    logger.info("Stamped availability: {}".format(counts))
+    return counts
@@ -0,0 +1,216 @@
+"""
+A compact in-memory tree of a channel database, for statistics of every
+topic's subtree at once rather than an MPTT range query per topic.
+
+ChannelTree holds the nodes in tree order as parallel arrays of their parent's
+index, MPTT lft and rght, kind code and the total size of their own files,
+read in one pass over the database. In tree order every subtree is the
+contiguous range from its root to the end of its descendants, so summing a
+value over the subtrees of all nodes takes one prefix sum and a difference
+per node. Where each range ends is found from the lft and rght values, by
+binary search, so the numbering may have gaps.
+
+The arrays are NumPy arrays when NumPy is installed, and array.array
+otherwise, which gives the same results more slowly.
+"""
+import array
+import bisect
+import itertools
+
+from le_utils.constants import content_kinds
+
+from .reader import ChannelDatabaseReader
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ChannelTree:
+    """
+    The nodes of a channel database in tree order. Nodes are referred to by
+    their index in that order; `ids` holds their ids, and `index` gives the
+    index of an id.
+
+    The per-node results of the get_ methods are arrays in the same order,
+    and count each node in its own subtree.
+    """
+
+    def __init__(self, ids, parents, lfts, rghts, kinds, sizes, kind_names, use_numpy=None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.use_numpy = use_numpy
+        self.ids = ids
+        self.kind_names = kind_names
+        self._indexes = None
+        if use_numpy:
+            self.parents = numpy.frombuffer(parents, dtype=numpy.int64)
+            self.lfts = numpy.frombuffer(lfts, dtype=numpy.int64)
+            self.rghts = numpy.frombuffer(rghts, dtype=numpy.int64)
+            self.kinds = numpy.frombuffer(kinds, dtype=numpy.uint8)
+            self.sizes = numpy.frombuffer(sizes, dtype=numpy.int64)
+        else:
+            self.parents, self.lfts, self.rghts, self.kinds, self.sizes = parents, lfts, rghts, kinds, sizes
+        self.ends = self._get_ends()
+
+    @classmethod
+    def from_database(cls, path, use_numpy=None):
+        """
+        Reads the tree of the channel database at `path`.
+        """
+        with ChannelDatabaseReader(path) as reader:
+            return cls.from_reader(reader, use_numpy=use_numpy)
+
+    @classmethod
+    def from_reader(cls, reader, use_numpy=None):
+        ids = []
+        indexes = {}
+        parents = array.array("q")
+        lfts = array.array("q")
+        rghts = array.array("q")
+        kinds = array.array("B")
+        kind_codes = {}
+        for node_id, parent_id, lft, rght, kind in reader.iter_node_values(("id", "parent_id", "lft", "rght", "kind")):
+            indexes[node_id] = len(ids)
+            ids.append(node_id)
+            # Parents come before their children in tree order.
+            parents.append(indexes.get(parent_id, -1))
+            lfts.append(lft)
+            rghts.append(rght)
+            kinds.append(kind_codes.setdefault(kind, len(kind_codes)))
+        file_sizes = reader.get_file_sizes()
+        sizes = array.array("q", (file_sizes.get(node_id) or 0 for node_id in ids))
+        tree = cls(ids, parents, lfts, rghts, kinds, sizes, list(kind_codes), use_numpy=use_numpy)
+        tree._indexes = indexes
+        return tree
+
+    def _get_ends(self):
+        """
+        Returns the index after the last descendant of each node: that of the
+        first node whose lft is past the node's rght. Each tree is numbered
+        from 1, so the trees' numbers are offset by the rght of the roots
+        before them, to keep them increasing across all the nodes.
+        """
+        if self.use_numpy:
+            roots = self.parents < 0
+            widths = numpy.where(roots, self.rghts + 1, 0)
+            offsets = numpy.maximum.accumulate(numpy.where(roots, numpy.cumsum(widths) - widths, 0))
+            return numpy.searchsorted(self.lfts + offsets, self.rghts + offsets, side="right")
+        lfts = []
+        rghts = []
+        offset = next_offset = 0
+        for parent, lft, rght in zip(self.parents, self.lfts, self.rghts):
+            if parent < 0:
+                offset = next_offset
+                next_offset = offset + rght + 1
+            lfts.append(lft + offset)
+            rghts.append(rght + offset)
+        return array.array("q", (bisect.bisect_right(lfts, rght) for rght in rghts))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, node_id):
+        if self._indexes is None:
+            self._indexes = {node_id: index for index, node_id in enumerate(self.ids)}
+        return self._indexes[node_id]
+
+    def iter_ancestors(self, index):
+        """
+        Yields the indexes of the ancestors of the node at `index`, from its
+        parent up.
+        """
+        parent = int(self.parents[index])
+        while parent >= 0:
+            yield parent
+            parent = int(self.parents[parent])
+
+    def get_subtree_sums(self, values):
+        """
+        Returns the sum of `values`, one per node, over each node's subtree.
+        """
+        if self.use_numpy:
+            prefix = numpy.zeros(len(self.ids) + 1, dtype=numpy.int64)
+            numpy.cumsum(values, out=prefix[1:])
+            return prefix[self.ends] - prefix[:-1]
+        prefix = array.array("q", [0])
+        prefix.extend(itertools.accumulate(values))
+        return array.array("q", (prefix[end] - prefix[start] for start, end in enumerate(self.ends)))
+
+    def get_sizes(self):
+        """
+        Returns the total size of the files of each node's subtree. Files
+        of several nodes are counted for each of them.
+        """
+        return self.get_subtree_sums(self.sizes)
+
+    def get_kind_counts(self, kind):
+        """
+        Returns the number of nodes of `kind` in each node's subtree.
+        """
+        if kind not in self.kind_names:
+            return self.get_subtree_sums(self._zeros())
+        return self.get_subtree_sums(self._kind_mask(self.kind_names.index(kind)))
+
+    def get_resource_counts(self):
+        """
+        Returns the number of nodes other than topics in each node's subtree.
+        """
+        counts = self.get_subtree_sums(self._ones())
+        if content_kinds.TOPIC not in self.kind_names:
+            return counts
+        topics = self.get_kind_counts(content_kinds.TOPIC)
+        if self.use_numpy:
+            return counts - topics
+        return array.array("q", (count - topic for count, topic in zip(counts, topics)))
+
+    def get_topic_stats(self):
+        """
+        Returns a dict of the size, resource count and resource counts by
+        kind of each topic's subtree, by topic id.
+        """
+        if content_kinds.TOPIC not in self.kind_names:
+            return {}
+        topic_code = self.kind_names.index(content_kinds.TOPIC)
+        if self.use_numpy:
+            topics = numpy.flatnonzero(self.kinds == topic_code)
+        else:
+            topics = [index for index, code in enumerate(self.kinds) if code == topic_code]
+        sizes = self._take(self.get_sizes(), topics)
+        resource_counts = self._take(self.get_resource_counts(), topics)
+        kind_counts = {
+            kind: self._take(self.get_subtree_sums(self._kind_mask(code)), topics)
+            for code, kind in enumerate(self.kind_names) if code != topic_code
+        }
+        return {
+            self.ids[index]: {
+                "size": sizes[position],
+                "resource_count": resource_counts[position],
+                "kind_counts": {kind: counts[position] for kind, counts in kind_counts.items() if counts[position]},
+            }
+            for position, index in enumerate(topics)
+        }
+
+    def _kind_mask(self, code):
+        if self.use_numpy:
+            return (self.kinds == code).astype(numpy.int64)
+        return array.array("q", (kind == code for kind in self.kinds))
+
+    def _ones(self):
+        if self.use_numpy:
+            return numpy.ones(len(self.ids), dtype=numpy.int64)
+        return array.array("q", [1]) * len(self.ids)
+
+    def _zeros(self):
+        if self.use_numpy:
+            return numpy.zeros(len(self.ids), dtype=numpy.int64)
+        return array.array("q", [0]) * len(self.ids)
+
+    def _take(self, values, indexes):
+        """
+        Returns `values` at `indexes` as a list of ints.
+        """
+        if self.use_numpy:
+            return values[indexes].tolist()
+        return [values[index] for index in indexes]
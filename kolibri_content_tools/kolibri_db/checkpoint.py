@@ -0,0 +1,144 @@
+"""
+Checkpoints of a publish in progress, so that a publish which fails part way
+through mapping its nodes can be retried from where it stopped.
+
+A checkpointed publish writes its export database to a fixed path for the
+channel version being published, and keeps the ids of the source nodes it has
+exported in a checkpoint database beside it. Nodes are exported in batches,
+and each batch is committed in one transaction together with its node ids, by
+attaching the checkpoint database to the export database's connection. After
+a failure the export database holds exactly the nodes the checkpoint lists.
+"""
+import contextlib
+import logging
+import os
+import sqlite3
+import sys
+
+from django.db import connections
+from django.db import transaction
+from django.db.models import Max
+
+from kolibri_content import models as kolibrimodels
+from kolibri_content.router import get_active_content_database
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_BATCH_SIZE = 500
+CHECKPOINT_SCHEMA = "checkpoint"
+CHECKPOINT_TABLE = "publish_checkpoint"
+
+
+def get_checkpoint_database_path(directory, channel_id, version):
+    return os.path.join(directory, "{}-{}.sqlite3".format(channel_id, version))
+
+
+class PublishCheckpoint:
+    """
+    The checkpoint of the export database at `database_path`. Call `start`
+    once the export database has been prepared, or `load` to resume from an
+    existing checkpoint, then export nodes inside `batches`.
+    """
+
+    def __init__(self, database_path, batch_size=CHECKPOINT_BATCH_SIZE):
+        self.database_path = database_path
+        self.path = "{}.checkpoint".format(database_path)
+        self.batch_size = batch_size
+        self.done = set()
+        self.pending = []
+        self._atomic = None
+        self._alias = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def start(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS {} (node_id TEXT PRIMARY KEY)".format(CHECKPOINT_TABLE))
+        finally:
+            connection.close()
+
+    def load(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            self.done = {row[0] for row in connection.execute("SELECT node_id FROM {}".format(CHECKPOINT_TABLE))}
+        finally:
+            connection.close()
+        return len(self.done)
+
+    def remove(self):
+        """
+        Removes the export database and its checkpoint, once published.
+        """
+        for path in (self.database_path, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def is_done(self, node_id):
+        return node_id in self.done
+
+    @contextlib.contextmanager
+    def batches(self, root_id):
+        """
+        Commits the nodes exported in the block to the active export database
+        in batches of the nodes passed to `add`. Nothing exported since the
+        last full batch is kept if the block fails.
+
+        MPTT updates must be disabled in the block: the tree under `root_id`
+        is rebuilt in the last batch's transaction, so the tree is never left
+        without a rebuild once all of its nodes are listed.
+        """
+        self._alias = get_active_content_database()
+        cursor = connections[self._alias].cursor()
+        # SQLite cannot attach a database inside a transaction.
+        cursor.execute("ATTACH DATABASE %s AS {}".format(CHECKPOINT_SCHEMA), [self.path])
+        try:
+            self._begin()
+            try:
+                yield self
+                if self.pending:
+                    self._rebuild_tree(root_id)
+                    self._write_pending()
+            except BaseException:
+                self._atomic.__exit__(*sys.exc_info())
+                raise
+            self._atomic.__exit__(None, None, None)
+        finally:
+            self._atomic = None
+            cursor.execute("DETACH DATABASE {}".format(CHECKPOINT_SCHEMA))
+
+    def add(self, node_id):
+        """
+        Adds the node `node_id` to the batch, before it is exported. Commits
+        the batch before it first if that is full, so the last batch is always
+        committed by `batches` along with the tree rebuild.
+        """
+        if len(self.pending) >= self.batch_size:
+            self._write_pending()
+            self._atomic.__exit__(None, None, None)
+            self._begin()
+        self.pending.append(node_id)
+
+    def _rebuild_tree(self, root_id):
+        nodes = kolibrimodels.ContentNode.objects
+        # Nodes saved with MPTT updates disabled are all put in tree 0.
+        tree_id = (nodes.exclude(tree_id=0).aggregate(Max("tree_id"))["tree_id__max"] or 0) + 1
+        nodes.filter(tree_id=0).update(tree_id=tree_id)
+        for tree_id in nodes.filter(pk=root_id).values_list("tree_id", flat=True):
+            nodes.partial_rebuild(tree_id)
+
+    def _begin(self):
+        self._atomic = transaction.atomic(using=self._alias)
+        self._atomic.__enter__()
+
+    def _write_pending(self):
+        connections[self._alias].cursor().executemany(
+            "INSERT OR IGNORE INTO {}.{} (node_id) VALUES (%s)".format(CHECKPOINT_SCHEMA, CHECKPOINT_TABLE),
+            [(node_id,) for node_id in self.pending],
+        )
+        logger.debug("Checkpointed {} exported nodes".format(len(self.pending)))
+        self.done.update(self.pending)
+        self.pending = []
@@ -0,0 +1,101 @@
+"""
+Removal of the files in content storage that no content database refers to.
+
+Content storage keeps each local file at `<a>/<b>/<checksum>.<extension>`,
+where a and b are the first two characters of the checksum. The sweep walks
+it a directory at a time, collecting batches of files, and makes one pass
+over the databases sharing the storage for each batch: every database is
+opened once, and the checksums it lists are dropped from the batch. Memory
+is bounded by the batch size rather than the number of files, and storage
+holding fewer files than that is swept with a single pass. Only files named
+like local files are considered, so anything else in the storage is left
+alone, and files modified within the grace period are kept, as they may
+belong to a channel still being imported whose database is not among those
+given yet.
+
+Run it after deleting channels and LocalFile.objects.delete_orphan_file_objects,
+as local files stay in the database until then.
+"""
+import logging
+import os
+import re
+import time
+
+from .reader import ChannelDatabaseReader
+
+logger = logging.getLogger(__name__)
+
+# Files checked against the databases in each pass over them.
+SWEEP_BATCH_SIZE = 100000
+# Seconds since their last modification before files can be removed.
+SWEEP_GRACE_PERIOD = 24 * 60 * 60
+LOCAL_FILE_NAME = re.compile(r"^([0-9a-f]{32})\.\w+$")
+
+
+def iter_storage_files(storage_dir, modified_before=None):
+    """
+    Yields (checksum, path) for every file in `storage_dir` named like a
+    local file, in the directory it belongs in, and last modified before the
+    timestamp `modified_before` if given.
+    """
+    for first in sorted(os.listdir(storage_dir)):
+        first_dir = os.path.join(storage_dir, first)
+        if len(first) != 1 or not os.path.isdir(first_dir):
+            continue
+        for second in sorted(os.listdir(first_dir)):
+            second_dir = os.path.join(first_dir, second)
+            if len(second) != 1 or not os.path.isdir(second_dir):
+                continue
+            with os.scandir(second_dir) as entries:
+                for entry in entries:
+                    match = LOCAL_FILE_NAME.match(entry.name)
+                    if not (match and entry.name.startswith(first + second) and entry.is_file()):
+                        continue
+                    if modified_before is not None and entry.stat().st_mtime >= modified_before:
+                        continue
+                    yield match.group(1), entry.path
+
+
+def sweep_orphan_files(storage_dir, database_paths, dry_run=False, batch_size=SWEEP_BATCH_SIZE,
+                       grace_period=SWEEP_GRACE_PERIOD):
+    """
+    Removes the files in `storage_dir` that are not local files of any of the
+    content databases at `database_paths`, which must be all of those whose
+    files are kept there. Files modified in the last `grace_period` seconds
+    are kept. With `dry_run`, only counts them. Returns the number of files
+    and bytes removed.
+
+    Each database is opened once per `batch_size` files, and only one at a
+    time.
+    """
+    database_paths = list(database_paths)
+    if not database_paths:
+        raise ValueError("Sweeping needs the databases whose files are in {}".format(storage_dir))
+    modified_before = time.time() - grace_period
+    removed = 0
+    removed_bytes = 0
+
+    def sweep(batch):
+        nonlocal removed, removed_bytes
+        orphans = {checksum for checksum, _ in batch}
+        for path in database_paths:
+            if not orphans:
+                return
+            with ChannelDatabaseReader(path) as reader:
+                orphans -= reader.get_local_file_ids(orphans)
+        for checksum, path in batch:
+            if checksum in orphans:
+                removed_bytes += os.path.getsize(path)
+                removed += 1
+                if not dry_run:
+                    os.remove(path)
+
+    batch = []
+    for checksum, path in iter_storage_files(storage_dir, modified_before):
+        batch.append((checksum, path))
+        if len(batch) >= batch_size:
+            sweep(batch)
+            batch = []
+    sweep(batch)
+    logger.info("{} {} orphan files of {} bytes".format("Found" if dry_run else "Removed", removed, removed_bytes))
+    return removed, removed_bytes
@@ -0,0 +1,382 @@
+"""
+Timing, query counts and sizes for each stage of a channel publish.
+
+Publish code marks its stages with the module-level helpers, which record into
+whichever PublishInstrumentation is active on the current thread, in the same
+way `using_content_database` selects the content database:
+
+    with PublishInstrumentation(channel.id, sinks=[StatsdSink("localhost")]):
+        with instrumentation.stage("files"):
+            ...
+
+When no instrumentation is active the helpers do nothing. Stages may be
+nested, and a stage's time, queries and bytes include those of the stages
+nested in it.
+"""
+import collections
+import contextlib
+import cProfile
+import functools
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+THREAD_LOCAL = threading.local()
+
+# The methods Django connections make their cursor wrappers with.
+CURSOR_FACTORIES = ("make_cursor", "make_debug_cursor")
+
+
+def get_active_instrumentation():
+    return getattr(THREAD_LOCAL, "instrumentation", None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Records the time, queries and calls of the block under stage `name`.
+    """
+    active = get_active_instrumentation()
+    if active is None:
+        yield
+    else:
+        with active.stage(name):
+            yield
+
+
+def add_bytes(name, count):
+    """
+    Adds `count` bytes written to stage `name`.
+    """
+    active = get_active_instrumentation()
+    if active is not None:
+        active.add_bytes(name, count)
+
+
+def observe(name, seconds):
+    """
+    Records one timing of an individual operation, like building one exercise
+    zip, so its distribution can be reported.
+    """
+    active = get_active_instrumentation()
+    if active is not None:
+        active.observe(name, seconds)
+
+
+class _CountingCursor:
+    """
+    Passes everything through to a Django cursor wrapper, calling
+    `count_query` for each statement run.
+    """
+
+    def __init__(self, cursor, count_query):
+        self.cursor = cursor
+        self.count_query = count_query
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def callproc(self, *args, **kwargs):
+        self.count_query()
+        return self.cursor.callproc(*args, **kwargs)
+
+    def execute(self, sql, params=None):
+        self.count_query()
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.count_query()
+        return self.cursor.executemany(sql, param_list)
+
+
+class StageStats:
+    __slots__ = ("seconds", "calls", "queries", "bytes")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.queries = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {
+            "seconds": self.seconds,
+            "calls": self.calls,
+            "queries": self.queries,
+            "bytes": self.bytes,
+        }
+
+
+class PublishInstrumentation:
+    """
+    Collects per-stage statistics for one publish. Use it as a context manager
+    around the publish; on exit the report is sent to each of `sinks` and, if
+    `profile_path` is given, a cProfile dump of the publish is written there.
+    `profile_path` may contain "{channel_id}".
+
+    Each of `callbacks` is called as callback(stage_name, seconds, queries)
+    every time a stage finishes, for live progress reporting.
+
+    Queries are counted as the SQL statements run through the cursors of
+    Django connections on the publishing thread, including the content
+    databases, whatever their database vendor; an executemany counts once.
+    Instrumentations may be nested, and the queries of the inner one are
+    counted by both.
+    """
+
+    def __init__(self, channel_id=None, sinks=None, callbacks=None, profile_path=None):
+        self.channel_id = channel_id
+        self.sinks = list(sinks or [])
+        self.callbacks = list(callbacks or [])
+        self.profile_path = profile_path
+        self.stages = collections.OrderedDict()
+        self.timings = collections.defaultdict(list)
+        self.queries = 0
+        self.seconds = None
+        self._start = None
+        self._thread_id = None
+        # The cursor factories of each traced connection before it was traced,
+        # keyed by alias.
+        self._traced = {}
+        self._profiler = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = get_active_instrumentation()
+        THREAD_LOCAL.instrumentation = self
+        self._thread_id = threading.get_ident()
+        connection_created.connect(self._on_connection_created)
+        for connection in connections.all():
+            self._trace(connection)
+        if self.profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            path = self.profile_path.format(channel_id=self.channel_id)
+            self._profiler.dump_stats(path)
+            logger.info("Wrote publish profile to {}".format(path))
+        connection_created.disconnect(self._on_connection_created)
+        for connection, factories in self._traced.values():
+            # Puts back those of an instrumentation this one is nested in.
+            for name, factory in factories.items():
+                if factory is None:
+                    vars(connection).pop(name, None)
+                else:
+                    setattr(connection, name, factory)
+        self._traced = {}
+        THREAD_LOCAL.instrumentation = self._previous
+        self.flush()
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        if threading.get_ident() == self._thread_id:
+            self._trace(connection)
+
+    def _trace(self, connection):
+        if connection.alias in self._traced:
+            return
+        factories = {name: vars(connection).get(name) for name in CURSOR_FACTORIES}
+        self._traced[connection.alias] = (connection, factories)
+        for name in CURSOR_FACTORIES:
+            setattr(
+                connection,
+                name,
+                functools.partial(self._make_counting_cursor, getattr(connection, name)),
+            )
+
+    def _make_counting_cursor(self, make_cursor, cursor):
+        return _CountingCursor(make_cursor(cursor), self._count_query)
+
+    def _count_query(self):
+        self.queries += 1
+
+    def _get_stage(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stats = self._get_stage(name)
+        queries = self.queries
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.seconds += elapsed
+            stats.calls += 1
+            stats.queries += self.queries - queries
+            for callback in self.callbacks:
+                callback(name, elapsed, self.queries - queries)
+
+    def add_bytes(self, name, count):
+        self._get_stage(name).bytes += count
+
+    def add_stages(self, stages):
+        """
+        Adds the stage statistics of another report, such as that of a publish
+        worker process, to this publish's stages. Worker stages run in
+        parallel, so their seconds add up to more than the publish took.
+        """
+        for name, stats in stages.items():
+            totals = self._get_stage(name)
+            for stat in StageStats.__slots__:
+                setattr(totals, stat, getattr(totals, stat) + stats[stat])
+
+    def observe(self, name, seconds):
+        self.timings[name].append(seconds)
+
+    def report(self):
+        timings = {}
+        for name, values in self.timings.items():
+            timings[name] = {
+                "count": len(values),
+                "total_seconds": sum(values),
+                "mean_seconds": sum(values) / len(values),
+                "max_seconds": max(values),
+            }
+        return {
+            "channel_id": self.channel_id,
+            "seconds": self.seconds,
+            "queries": self.queries,
+            "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+            "timings": timings,
+        }
+
+    def flush(self):
+        report = self.report()
+        for sink in self.sinks:
+            try:
+                sink.emit(report)
+            except Exception as e:
+                # Metrics must never fail a publish.
+                logger.error("Unable to send publish metrics to {}: {}".format(sink, e))
+
+
+class StatsdSink:
+    """
+    Sends stage metrics to a statsd server over UDP: timers in milliseconds
+    and counters for calls, queries and bytes, named `{prefix}.{stage}.{stat}`.
+    """
+
+    MAX_PACKET_SIZE = 512
+
+    def __init__(self, host="localhost", port=8125, prefix="kolibri.publish"):
+        self.address = (host, port)
+        self.prefix = prefix
+
+    def get_lines(self, report):
+        lines = ["{}.seconds:{:.3f}|ms".format(self.prefix, 1000 * report["seconds"])]
+        lines.append("{}.queries:{}|c".format(self.prefix, report["queries"]))
+        for name, stats in report["stages"].items():
+            metric = "{}.{}".format(self.prefix, name)
+            lines.append("{}.seconds:{:.3f}|ms".format(metric, 1000 * stats["seconds"]))
+            for stat in ("calls", "queries", "bytes"):
+                lines.append("{}.{}:{}|c".format(metric, stat, stats[stat]))
+        for name, timing in report["timings"].items():
+            metric = "{}.{}".format(self.prefix, name)
+            for stat in ("mean", "max"):
+                lines.append(
+                    "{}.{}:{:.3f}|ms".format(
+                        metric, stat, 1000 * timing["{}_seconds".format(stat)]
+                    )
+                )
+        return lines
+
+    def emit(self, report):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            packet = ""
+            for line in self.get_lines(report):
+                if packet and len(packet) + len(line) + 1 > self.MAX_PACKET_SIZE:
+                    sock.sendto(packet.encode("utf-8"), self.address)
+                    packet = ""
+                packet = "{}\n{}".format(packet, line) if packet else line
+            if packet:
+                sock.sendto(packet.encode("utf-8"), self.address)
+        finally:
+            sock.close()
+
+
+class PrometheusTextfileSink:
+    """
+    Writes the metrics of the last publish in the Prometheus text format, for
+    the node_exporter textfile collector. The file is replaced atomically so
+    the collector never reads a partial file.
+    """
+
+    def __init__(self, path, prefix="kolibri_publish"):
+        self.path = path
+        self.prefix = prefix
+
+    def get_text(self, report):
+        channel_label = 'channel_id="{}"'.format(report["channel_id"] or "")
+        lines = []
+
+        def add(name, help_text, samples):
+            lines.append("# HELP {}_{} {}".format(self.prefix, name, help_text))
+            lines.append("# TYPE {}_{} gauge".format(self.prefix, name))
+            for labels, value in samples:
+                lines.append("{}_{}{{{}}} {}".format(self.prefix, name, labels, value))
+
+        add(
+            "seconds",
+            "Duration of the last publish.",
+            [(channel_label, report["seconds"])],
+        )
+        add(
+            "queries",
+            "SQL statements run by the last publish.",
+            [(channel_label, report["queries"])],
+        )
+        stages = report["stages"]
+        for stat, help_text in [
+            ("seconds", "Time spent in each publish stage."),
+            ("calls", "Times each publish stage ran."),
+            ("queries", "SQL statements run in each publish stage."),
+            ("bytes", "Bytes written by each publish stage."),
+        ]:
+            add(
+                "stage_{}".format(stat),
+                help_text,
+                [
+                    ('{},stage="{}"'.format(channel_label, name), stats[stat])
+                    for name, stats in stages.items()
+                ],
+            )
+        return "\n".join(lines) + "\n"
+
+    def emit(self, report):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.get_text(report))
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
@@ -0,0 +1,148 @@
+"""
+Merges content databases exported separately for parts of one channel into
+the channel's export database, using SQLite's ATTACH and INSERT ... SELECT so
+rows are copied without going through the ORM.
+
+Each part database must have been copied from the export database after the
+channel's root node was exported, and then had one subtree of the root
+exported into it. Parts are merged in the order their subtrees should appear
+under the root.
+"""
+import logging
+
+from django.db import connections
+from django.db import transaction
+
+from kolibri_content import models as kolibrimodels
+
+logger = logging.getLogger(__name__)
+
+SHARD_SCHEMA = "shard"
+
+
+def get_columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+class ContentDatabaseMerger:
+    """
+    Copies the nodes exported into part databases into the export database
+    `alias`, under its root node `root_id`.
+
+    Nodes are renumbered to follow those already merged, as their subtrees
+    are laid out independently in each part. Licenses and tags are matched by
+    value, as each part numbers its own, and languages and local files that
+    several parts share are only stored once.
+    """
+
+    def __init__(self, alias, root_id):
+        self.alias = alias
+        self.root_id = root_id
+        cursor = connections[alias].cursor()
+        cursor.execute(
+            "SELECT lft, tree_id FROM {} WHERE id = %s".format(kolibrimodels.ContentNode._meta.db_table),
+            [root_id],
+        )
+        root_lft, self.tree_id = cursor.fetchone()
+        self.next_lft = root_lft + 1
+
+    def merge(self, path):
+        """
+        Merges the part database at `path`. Returns the number of nodes copied.
+        """
+        cursor = connections[self.alias].cursor()
+        # SQLite cannot attach a database inside a transaction.
+        cursor.execute("ATTACH DATABASE %s AS {}".format(SHARD_SCHEMA), [path])
+        try:
+            with transaction.atomic(using=self.alias):
+                nodes = self._merge_rows(cursor)
+        finally:
+            cursor.execute("DETACH DATABASE {}".format(SHARD_SCHEMA))
+        logger.debug("Merged {} nodes from {}".format(nodes, path))
+        return nodes
+
+    def finish(self):
+        """
+        Closes the root node's MPTT range around all the merged nodes.
+        """
+        connections[self.alias].cursor().execute(
+            "UPDATE {} SET rght = %s WHERE id = %s".format(kolibrimodels.ContentNode._meta.db_table),
+            [self.next_lft, self.root_id],
+        )
+
+    def _merge_rows(self, cursor):
+        node_table = kolibrimodels.ContentNode._meta.db_table
+        license_table = kolibrimodels.License._meta.db_table
+        tag_table = kolibrimodels.ContentTag._meta.db_table
+        tags_table = kolibrimodels.ContentNode.tags.through._meta.db_table
+
+        cursor.execute(
+            "SELECT MIN(lft), MAX(rght), COUNT(*) FROM {}.{} WHERE id != %s".format(SHARD_SCHEMA, node_table),
+            [self.root_id],
+        )
+        lft, rght, count = cursor.fetchone()
+        if not count:
+            return 0
+        offset = self.next_lft - lft
+        self.next_lft = rght + offset + 1
+
+        for model in (kolibrimodels.Language, kolibrimodels.LocalFile):
+            self._copy(cursor, model, "INSERT OR IGNORE")
+
+        cursor.execute(
+            "INSERT INTO main.{table} (license_name, license_description) "
+            "SELECT DISTINCT s.license_name, s.license_description FROM {shard}.{table} s "
+            "WHERE NOT EXISTS (SELECT 1 FROM main.{table} m WHERE m.license_name = s.license_name "
+            "AND m.license_description IS s.license_description)".format(table=license_table, shard=SHARD_SCHEMA)
+        )
+        cursor.execute(
+            "INSERT OR IGNORE INTO main.{table} (id, tag_name) "
+            "SELECT s.id, s.tag_name FROM {shard}.{table} s "
+            "WHERE NOT EXISTS (SELECT 1 FROM main.{table} m WHERE m.tag_name = s.tag_name)".format(
+                table=tag_table, shard=SHARD_SCHEMA)
+        )
+
+        columns = get_columns(kolibrimodels.ContentNode)
+        expressions = {
+            "lft": "n.lft + %s",
+            "rght": "n.rght + %s",
+            "tree_id": "%s",
+            "license_id": (
+                "(SELECT m.id FROM main.{table} m JOIN {shard}.{table} s "
+                "ON m.license_name = s.license_name AND m.license_description IS s.license_description "
+                "WHERE s.id = n.license_id)".format(table=license_table, shard=SHARD_SCHEMA)
+            ),
+        }
+        params = {"lft": [offset], "rght": [offset], "tree_id": [self.tree_id]}
+        cursor.execute(
+            "INSERT INTO main.{table} ({columns}) SELECT {expressions} FROM {shard}.{table} n "
+            "WHERE n.id != %s".format(
+                table=node_table,
+                shard=SHARD_SCHEMA,
+                columns=", ".join(columns),
+                expressions=", ".join(expressions.get(column, "n." + column) for column in columns),
+            ),
+            [param for column in columns for param in params.get(column, [])] + [self.root_id],
+        )
+
+        cursor.execute(
+            "INSERT INTO main.{table} (contentnode_id, contenttag_id) "
+            "SELECT t.contentnode_id, m.id FROM {shard}.{table} t "
+            "JOIN {shard}.{tag_table} s ON s.id = t.contenttag_id "
+            "JOIN main.{tag_table} m ON m.tag_name = s.tag_name "
+            "WHERE t.contentnode_id != %s".format(table=tags_table, tag_table=tag_table, shard=SHARD_SCHEMA),
+            [self.root_id],
+        )
+
+        # The root's own files are already in the export database.
+        for model in (kolibrimodels.File, kolibrimodels.AssessmentMetaData):
+            self._copy(cursor, model, "INSERT", "WHERE contentnode_id != %s", [self.root_id])
+        return count
+
+    def _copy(self, cursor, model, insert, where="", params=None):
+        columns = ", ".join(get_columns(model))
+        cursor.execute(
+            "{insert} INTO main.{table} ({columns}) SELECT {columns} FROM {shard}.{table} {where}".format(
+                insert=insert, table=model._meta.db_table, columns=columns, shard=SHARD_SCHEMA, where=where),
+            params or [],
+        )
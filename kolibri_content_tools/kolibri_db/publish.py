@@ -1,25 +1,36 @@
 from __future__ import division
 
-import collections
+import base64
+import contextlib
+import inspect
+import io
 import itertools
 import json
 import logging as logmodule
 import math
 import os
 import re
+import shutil
 import tempfile
+import time
 import traceback
 import uuid
 import zipfile
 from builtins import str
+from concurrent.futures import ProcessPoolExecutor
 from itertools import chain
+from multiprocessing import get_context
 
 from django.conf import settings
 from django.core.files import File
 from django.core.files.storage import default_storage as storage
 from django.core.management import call_command
+from django.db import connections
 from django.db import transaction
+from django.db.models import Count
+from django.db.models import Sum
 from django.template.loader import render_to_string
+from django.utils import timezone
 
 from kolibri_content import models as kolibrimodels
 from kolibri_content.router import get_active_content_database
@@ -30,10 +41,36 @@ from le_utils.constants import file_formats
 from le_utils.constants import format_presets
 from le_utils.constants import languages
 from le_utils.constants import roles
-from le_utils.parser import extract_value
 from past.builtins import basestring
 from past.utils import old_div
 
+from .aggregates import write_topic_aggregates
+from .availability import stamp_availability
+from .checkpoint import get_checkpoint_database_path
+from .checkpoint import PublishCheckpoint
+from .instrumentation import add_bytes
+from .instrumentation import observe
+from .instrumentation import PublishInstrumentation
+from .instrumentation import stage
+from .merge import ContentDatabaseMerger
+from .stats import PublishStats
+from .thumbnails import DEFAULT_WORKERS as DEFAULT_THUMBNAIL_WORKERS
+from .thumbnails import get_or_create_encoding
+from .thumbnails import pregenerate_thumbnails
+from .thumbnails import ThumbnailCache
+from .tree import iter_source_nodes
+from .tree import should_export_node
+from .writeback import SourceWriteBack
+from .writers import ORM_WRITER
+from .writers import ORMExportWriter
+from .writers import SQLITE_WRITER
+from .writers import SQLiteExportWriter
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 
 logmodule.basicConfig()
 logging = logmodule.getLogger(__name__)
@@ -41,6 +78,9 @@ logging = logmodule.getLogger(__name__)
 PERSEUS_IMG_DIR = exercises.IMG_PLACEHOLDER + "/images"
 THUMBNAIL_DIMENSION = 128
 MIN_SCHEMA_VERSION = "1"
+# Tags are given ids derived from their names, so the same tag gets the same id
+# in every export.
+TAG_ID_NAMESPACE = uuid.UUID("b1c0a1b3-5a8e-4d0b-9d5a-0c6f1f2a7e41")
 
 
 def generate_object_storage_name(checksum, filename, default_ext=''):
@@ -54,35 +94,166 @@ def generate_object_storage_name(checksum, filename, default_ext=''):
     return os.path.join(directory, h + ext.lower())
 
 
-def create_content_database(channel, force, user_id, force_exercises, task_object=None):
+def create_content_database(channel, force, user_id, force_exercises, task_object=None, instrumentation=None,
+                            source_writeback=None, workers=None, checkpoint_dir=None, writer=None,
+                            stamp_available=None):
+    """
+    Exports the channel to a new content database. Returns its path, and the
+    PublishStats of the nodes and files exported for fill_published_fields.
+    This used to return the path alone, so callers written for that must now
+    unpack the pair. Pass a PublishInstrumentation to collect per-stage
+    timings, query counts and sizes and send them to its sinks; by default
+    they are only logged.
+
+    Changes to the source tree are queued on `source_writeback` and written in
+    batches once the export is saved. Pass a SourceWriteBack to add further
+    updates to the same batches and flush it yourself later; it is flushed
+    here only when created here.
+
+    With more than one of `workers` (by default the PUBLISH_WORKERS setting),
+    the subtrees under the root are exported in parallel worker processes and
+    merged; see map_content_nodes_in_shards.
+
+    With a `checkpoint_dir` (by default the PUBLISH_CHECKPOINT_DIR setting),
+    the export database is kept there with a checkpoint of the exported nodes,
+    and a failed publish of the same channel version resumes from it. Remove
+    them with PublishCheckpoint.remove once the publish is complete.
+    Checkpoints are only kept for publishes with a single worker.
+
+    The rows are written with the ORM, unless `writer` (by default the
+    PUBLISH_WRITER setting) is SQLITE_WRITER, when they are inserted with a
+    SQLiteExportWriter instead; see kolibri_db.writers. Checkpointed
+    publishes are always written with the ORM.
+
+    Files and nodes are exported as available, unless `stamp_available` (by
+    default the PUBLISH_STAMP_AVAILABILITY setting) is set, when they are
+    marked available only if their files are in STORAGE_ROOT; see
+    kolibri_db.availability.
+    """
     # increment the channel version
     if not force:
         raise_if_nodes_are_all_unchanged(channel)
-    fh, tempdb = tempfile.mkstemp(suffix=".sqlite3")
+    if workers is None:
+        workers = getattr(settings, "PUBLISH_WORKERS", 1)
+    if checkpoint_dir is None:
+        checkpoint_dir = getattr(settings, "PUBLISH_CHECKPOINT_DIR", None)
+    if writer is None:
+        writer = getattr(settings, "PUBLISH_WRITER", ORM_WRITER)
+    if stamp_available is None:
+        stamp_available = getattr(settings, "PUBLISH_STAMP_AVAILABILITY", False)
+
+    checkpoint = None
+    resuming = False
+    if checkpoint_dir and workers == 1:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        tempdb = get_checkpoint_database_path(checkpoint_dir, channel.id, channel.version + 1)
+        checkpoint = PublishCheckpoint(tempdb)
+        resuming = checkpoint.exists() and os.path.exists(tempdb)
+        if not resuming:
+            open(tempdb, "w").close()
+    else:
+        fh, tempdb = tempfile.mkstemp(suffix=".sqlite3")
 
     logging.info("tempdb = {}".format(tempdb))
 
-    with using_content_database(tempdb):
-        prepare_export_database(tempdb)
+    if instrumentation is None:
+        instrumentation = PublishInstrumentation(channel.id)
+    # Set THUMBNAIL_CACHE_PATH to keep thumbnail encodings between publishes.
+    thumbnail_cache_path = getattr(settings, "THUMBNAIL_CACHE_PATH", None)
+    temp_thumbnail_cache = workers > 1 and not thumbnail_cache_path
+    if temp_thumbnail_cache:
+        # Workers read the encodings generated here, so they need a file.
+        cache_fh, thumbnail_cache_path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(cache_fh)
+    thumbnail_cache = ThumbnailCache(thumbnail_cache_path)
+    stats = PublishStats()
+    flush_writeback = source_writeback is None
+    if flush_writeback:
+        source_writeback = SourceWriteBack()
+
+    # Closes the thumbnail cache before removing its file, if it is temporary.
+    with removing_file(thumbnail_cache_path if temp_thumbnail_cache else None), instrumentation, \
+            using_content_database(tempdb), thumbnail_cache:
+        if resuming:
+            logging.info("Resuming publish from {} exported nodes".format(checkpoint.load()))
+        else:
+            with stage("prepare"):
+                prepare_export_database(tempdb)
         if task_object:
             task_object.update_state(state='STARTED', meta={'progress': 10.0})
-        map_channel_to_kolibri_channel(channel)
-        map_content_nodes(channel.get_root_node(), channel.language, channel.id, channel.name, user_id=user_id,
-                          force_exercises=force_exercises, task_object=task_object, starting_percent=10.0)
+        if not resuming:
+            with stage("channel"):
+                map_channel_to_kolibri_channel(channel)
+            if checkpoint is not None:
+                checkpoint.start()
+        with stage("thumbnail_pregeneration"):
+            pregenerate_thumbnails(
+                channel.get_root_node(),
+                thumbnail_cache,
+                get_thumbnail_encoding,
+                THUMBNAIL_DIMENSION,
+                max_workers=getattr(settings, "THUMBNAIL_WORKERS", DEFAULT_THUMBNAIL_WORKERS),
+            )
+        with stage("map_nodes"):
+            if workers > 1:
+                map_content_nodes_in_shards(
+                    channel.get_root_node(), channel.language, channel.id, channel.name, user_id=user_id,
+                    force_exercises=force_exercises, task_object=task_object, starting_percent=10.0,
+                    thumbnail_cache=thumbnail_cache, source_writeback=source_writeback, stats=stats,
+                    workers=workers, instrumentation=instrumentation, writer=writer)
+            else:
+                map_content_nodes(channel.get_root_node(), channel.language, channel.id, channel.name,
+                                  user_id=user_id, force_exercises=force_exercises, task_object=task_object,
+                                  starting_percent=10.0, thumbnail_cache=thumbnail_cache,
+                                  source_writeback=source_writeback, stats=stats, checkpoint=checkpoint,
+                                  writer=writer)
+        if stamp_available:
+            with stage("availability"):
+                stamp_availability()
+        with stage("aggregates"):
+            write_topic_aggregates()
         # It should be at this percent already, but just in case.
         if task_object:
             task_object.update_state(state='STARTED', meta={'progress': 90.0})
         # map_prerequisites(channel)
-        save_export_database(channel.id)
+        with stage("save"):
+            save_export_database(channel.id)
+        if flush_writeback:
+            with stage("source_writeback"):
+                source_writeback.flush()
 
-    return tempdb
+    for name, stage_stats in instrumentation.stages.items():
+        logging.info("Publish stage {}: {:.2f}s, {} calls, {} queries, {} bytes".format(
+            name, stage_stats.seconds, stage_stats.calls, stage_stats.queries, stage_stats.bytes))
 
+    return tempdb, stats
 
-def create_kolibri_license_object(ccnode):
+
+@contextlib.contextmanager
+def removing_file(path):
+    """
+    Removes the file at `path`, if given, when the block exits, however it exits.
+    """
+    try:
+        yield
+    finally:
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+def get_license_fields(ccnode):
     use_license_description = not ccnode.license.is_custom
+    return (
+        ccnode.license.license_name,
+        ccnode.license.license_description if use_license_description else ccnode.license_description,
+    )
+
+
+def create_kolibri_license_object(ccnode):
+    license_name, license_description = get_license_fields(ccnode)
     return kolibrimodels.License.objects.get_or_create(
-        license_name=ccnode.license.license_name,
-        license_description=ccnode.license.license_description if use_license_description else ccnode.license_description
+        license_name=license_name,
+        license_description=license_description
     )
 
 
@@ -91,53 +262,71 @@ def increment_channel_version(channel):
     channel.save()
 
 
-def assign_license_to_contentcuration_nodes(channel, license):
-    channel.main_tree.get_family().update(license_id=license.pk)
+def assign_license_to_contentcuration_nodes(channel, license, source_writeback=None):
+    if source_writeback is not None:
+        source_writeback.update_family(channel.main_tree, license_id=license.pk)
+    else:
+        channel.main_tree.get_family().update(license_id=license.pk)
 
 
 def map_content_nodes(root_node, default_language, channel_id, channel_name, user_id=None,
-                      force_exercises=False, task_object=None, starting_percent=10.0):
+                      force_exercises=False, task_object=None, starting_percent=10.0, thumbnail_cache=None,
+                      source_writeback=None, stats=None, checkpoint=None, writer=ORM_WRITER):
+    """
+    Exports `root_node` and its descendants into the active export database,
+    with the ORM or, if `writer` is SQLITE_WRITER, with a SQLiteExportWriter.
+    Checkpointed exports always use the ORM.
+    """
 
-    # make sure we process nodes higher up in the tree first, or else when we
+    # iter_source_nodes yields parents before their children, or else when we
     # make mappings the parent nodes might not be there
 
-    node_queue = collections.deque()
-    node_queue.append(root_node)
-
     task_percent_total = 80.0
     total_nodes = root_node.get_descendant_count() + 1  # make sure we include root_node
     percent_per_node = old_div(task_percent_total, total_nodes)
 
     current_node_percent = 0.0
 
-    def queue_get_return_none_when_empty():
-        try:
-            return node_queue.popleft()
-        except IndexError:
-            return None
+    if writer == SQLITE_WRITER and checkpoint is not None:
+        logging.info("Checkpointed publishes are exported with the ORM")
+        writer = ORM_WRITER
 
-    with transaction.atomic():
-        with kolibrimodels.ContentNode.objects.delay_mptt_updates():
-            for node in iter(queue_get_return_none_when_empty, None):
+    batches = contextlib.nullcontext()
+    if writer == SQLITE_WRITER:
+        # The writer numbers the tree and commits its own transaction.
+        export_writer = SQLiteExportWriter()
+        atomic = mptt_updates = contextlib.nullcontext()
+    else:
+        export_writer = ORMExportWriter()
+        atomic = transaction.atomic()
+        if checkpoint is None:
+            mptt_updates = kolibrimodels.ContentNode.objects.delay_mptt_updates()
+        else:
+            # The checkpoint rebuilds the tree when it commits the last batch.
+            mptt_updates = kolibrimodels.ContentNode.objects.disable_mptt_updates()
+            batches = checkpoint.batches(root_node.node_id)
+
+    with atomic:
+        with mptt_updates, batches, export_writer:
+            for node in iter_source_nodes(root_node):
                 logging.debug("Mapping node with id {id}".format(
                     id=node.id))
 
-                if not node.is_empty_topic() and node.complete:
-                    children = (node.get_children())
-                    node_queue.extend(children)
-
-                    kolibrinode = create_bare_contentnode(node, default_language, channel_id, channel_name)
-
-                    if node.get_kind() == content_kinds.EXERCISE:
-                        exercise_data = process_assessment_metadata(node, kolibrinode)
-                        if force_exercises or node.changed or not \
-                                node.has_perseus_exercise():
-                            create_perseus_exercise(node, kolibrinode, exercise_data, user_id=user_id)
-                    # TODO: Figure out why we are creating manifests during publishing?
-                    # elif node.get_kind() == content_kinds.SLIDESHOW:
-                    #     create_slideshow_manifest(node, kolibrinode, user_id=user_id)
-                    create_associated_file_objects(kolibrinode, node)
-                    map_tags_to_node(kolibrinode, node)
+                if should_export_node(node):
+                    if checkpoint is not None and checkpoint.is_done(node.node_id):
+                        # Exported before the publish was resumed, so only counted. The source
+                        # updates queued when it was exported were lost, so they are queued again.
+                        if stats is not None:
+                            stats.add_node(node)
+                            for ccfilemodel in node.files:
+                                stats.add_file(node, ccfilemodel)
+                        requeue_source_updates(node, thumbnail_cache, source_writeback)
+                    else:
+                        if checkpoint is not None:
+                            checkpoint.add(node.node_id)
+                        map_content_node(node, default_language, channel_id, channel_name, user_id=user_id,
+                                         force_exercises=force_exercises, thumbnail_cache=thumbnail_cache,
+                                         source_writeback=source_writeback, stats=stats, writer=export_writer)
 
                 # if we have a large amount of nodes, like, say, 44000, we don't want to update the percent
                 # of the task every node due to the latency involved, so only update in 1 percent increments.
@@ -148,6 +337,181 @@ def map_content_nodes(root_node, default_language, channel_id, channel_name, use
                 current_node_percent = new_node_percent
 
 
+def requeue_source_updates(node, thumbnail_cache=None, source_writeback=None):
+    """
+    Queues the source updates that exporting `node` makes, for a node exported
+    before a checkpointed publish was resumed: the thumbnail encoding it was
+    given, which the thumbnail cache still holds.
+    """
+    for ccfilemodel in node.files:
+        if ccfilemodel.preset.thumbnail:
+            get_node_thumbnail_encoding(node, ccfilemodel, thumbnail_cache, source_writeback)
+
+
+# Set in each worker process by init_shard_worker.
+SHARD_WORKER_CONTEXT = {}
+
+
+def map_content_nodes_in_shards(root_node, default_language, channel_id, channel_name, user_id=None,
+                                force_exercises=False, task_object=None, starting_percent=10.0, thumbnail_cache=None,
+                                source_writeback=None, stats=None, workers=2, instrumentation=None,
+                                writer=ORM_WRITER):
+    """
+    Exports the tree under `root_node` like map_content_nodes, but splits it at
+    the root's children and exports each child's subtree into its own copy of
+    the export database in a pool of `workers` processes. The copies are then
+    merged into the active export database in order.
+
+    Workers are forked, so they share the source tree as it is in memory here.
+    Their source updates, statistics and stage timings are sent back and added
+    to `source_writeback`, `stats` and `instrumentation`.
+    """
+    if not should_export_node(root_node):
+        return
+
+    with transaction.atomic():
+        map_content_node(root_node, default_language, channel_id, channel_name, user_id=user_id,
+                         force_exercises=force_exercises, thumbnail_cache=thumbnail_cache,
+                         source_writeback=source_writeback, stats=stats)
+    children = root_node.get_children()
+
+    export_db = get_active_content_database()
+    # Every shard starts from the export database as it is now, with the
+    # channel and root node, so its subtree has a parent to attach to.
+    fh, template_db = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fh)
+    shutil.copyfile(export_db, template_db)
+
+    merger = ContentDatabaseMerger(export_db, root_node.node_id)
+    task_percent_total = 80.0
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers, len(children) or 1),
+        mp_context=get_context("fork"),
+        initializer=init_shard_worker,
+        initargs=({
+            "children": children,
+            "template_db": template_db,
+            "thumbnail_cache_path": thumbnail_cache and thumbnail_cache.path,
+            "map_kwargs": {
+                "default_language": default_language,
+                "channel_id": channel_id,
+                "channel_name": channel_name,
+                "user_id": user_id,
+                "force_exercises": force_exercises,
+                "writer": writer,
+            },
+        },),
+    )
+    shard_futures = []
+    merged = 0
+    try:
+        shard_futures = [executor.submit(map_shard, index) for index in range(len(children))]
+        for index, future in enumerate(shard_futures):
+            shard_db, shard_stats, node_updates, stages = future.result()
+            merged = index + 1
+            try:
+                with stage("merge"):
+                    merger.merge(shard_db)
+            finally:
+                os.remove(shard_db)
+            if stats is not None:
+                stats.update(shard_stats)
+            if source_writeback is not None:
+                source_writeback.add_updates(node_updates)
+            if instrumentation is not None:
+                instrumentation.add_stages(stages)
+            if task_object:
+                progress_percent = starting_percent + task_percent_total * (index + 1) / len(children)
+                task_object.update_state(state='STARTED', meta={'progress': progress_percent})
+        merger.finish()
+    finally:
+        # After a failure, shards that have not started are dropped, and the
+        # databases of those that finished but were not merged are removed.
+        executor.shutdown(wait=True, cancel_futures=True)
+        remove_shard_databases(shard_futures[merged:])
+        os.remove(template_db)
+
+
+def remove_shard_databases(shard_futures):
+    """
+    Removes the databases of the shards of `shard_futures` that finished.
+    Those that failed have already removed theirs.
+    """
+    for future in shard_futures:
+        if future.cancelled() or future.exception() is not None:
+            continue
+        shard_db = future.result()[0]
+        if os.path.exists(shard_db):
+            os.remove(shard_db)
+
+
+def init_shard_worker(context):
+    # The forked worker must open its own database connections, but not close
+    # those it inherited, as they are still open in the parent.
+    for connection in connections.all():
+        connection.connection = None
+    SHARD_WORKER_CONTEXT.update(context)
+
+
+def map_shard(index):
+    """
+    Exports the subtree of the root's child at `index` in a worker process.
+    Returns the path of its database, and its statistics, queued source updates
+    and stage statistics.
+    """
+    context = SHARD_WORKER_CONTEXT
+    fh, shard_db = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fh)
+    shutil.copyfile(context["template_db"], shard_db)
+
+    stats = PublishStats()
+    source_writeback = SourceWriteBack()
+    instrumentation = PublishInstrumentation()
+    thumbnail_cache = ThumbnailCache(context["thumbnail_cache_path"])
+    try:
+        with instrumentation, using_content_database(shard_db), thumbnail_cache:
+            map_content_nodes(context["children"][index], thumbnail_cache=thumbnail_cache,
+                              source_writeback=source_writeback, stats=stats, **context["map_kwargs"])
+    except Exception:
+        os.remove(shard_db)
+        raise
+    finally:
+        # The connection is only set up once the database is first used.
+        if shard_db in connections.databases:
+            connections[shard_db].close()
+    stages = {name: stage_stats.as_dict() for name, stage_stats in instrumentation.stages.items()}
+    return shard_db, stats, dict(source_writeback.node_updates), stages
+
+
+def map_content_node(node, default_language, channel_id, channel_name, user_id=None, force_exercises=False,
+                     thumbnail_cache=None, source_writeback=None, stats=None, writer=None):
+    """
+    Exports a single node, with its exercise data, files and tags, with
+    `writer` or by default the ORM. Its parent must have been exported already.
+    """
+    if stats is not None:
+        stats.add_node(node)
+
+    with stage("nodes"):
+        kolibrinode = create_bare_contentnode(node, default_language, channel_id, channel_name, writer=writer)
+
+    if node.get_kind() == content_kinds.EXERCISE:
+        with stage("exercises"):
+            exercise_data = process_assessment_metadata(node, kolibrinode, writer=writer)
+            if force_exercises or node.changed or not \
+                    node.has_perseus_exercise():
+                create_perseus_exercise(node, kolibrinode, exercise_data, user_id=user_id)
+    # TODO: Figure out why we are creating manifests during publishing?
+    # elif node.get_kind() == content_kinds.SLIDESHOW:
+    #     create_slideshow_manifest(node, kolibrinode, user_id=user_id)
+    with stage("files"):
+        create_associated_file_objects(kolibrinode, node, thumbnail_cache=thumbnail_cache,
+                                       source_writeback=source_writeback, stats=stats, writer=writer)
+    with stage("tags"):
+        map_tags_to_node(kolibrinode, node, writer=writer)
+    return kolibrinode
+
+
 def create_slideshow_manifest(ccnode, kolibrinode, user_id=None):
     print("Creating slideshow manifest...")
 
@@ -178,78 +542,134 @@ def create_slideshow_manifest(ccnode, kolibrinode, user_id=None):
         temp_manifest.close()
 
 
-def create_bare_contentnode(ccnode, default_language, channel_id, channel_name):
+def create_bare_contentnode(ccnode, default_language, channel_id, channel_name, writer=None):
     logging.debug("Creating a Kolibri contentnode for instance id {}".format(
         ccnode.node_id))
+    if writer is None:
+        writer = ORMExportWriter()
 
-    kolibri_license = None
+    license_id = license_name = license_description = None
     if ccnode.license is not None:
         logging.info("license = {}".format(ccnode.license))
-        kolibri_license = create_kolibri_license_object(ccnode)[0]
+        license_name, license_description = get_license_fields(ccnode)
+        license_id = writer.add_license(license_name, license_description)
 
-    language = None
+    language_id = None
     if ccnode.language or default_language:
-        language, _new = get_or_create_language(ccnode.language_id or default_language)
+        language_id = writer.add_language(get_language_fields(ccnode.language_id or default_language))
 
     options = {}
     if ccnode.extra_fields and 'options' in ccnode.extra_fields:
         options = ccnode.extra_fields['options']
 
-    kolibrinode, is_new = kolibrimodels.ContentNode.objects.update_or_create(
-        pk=ccnode.node_id,
-        defaults={
-            'kind': ccnode.get_kind(),
-            'title': ccnode.title if ccnode.parent else channel_name,
-            'content_id': ccnode.content_id,
-            'channel_id': channel_id,
-            'author': ccnode.author or "",
-            'description': ccnode.description,
-            'sort_order': ccnode.sort_order,
-            'license_owner': ccnode.copyright_holder or "",
-            'license': kolibri_license,
-            'available': not ccnode.is_empty_topic(),  # Hide empty topics
-            'stemmed_metaphone': "",  # Stemmed metaphone is no longer used, and will cause no harm if blank
-            'lang': language,
-            'license_name': kolibri_license.license_name if kolibri_license is not None else None,
-            'license_description': kolibri_license.license_description if kolibri_license is not None else None,
-            'coach_content': ccnode.role_visibility == roles.COACH,
-            'options': json.dumps(options)
-        }
-    )
-
     if ccnode.parent:
         logging.debug("Associating {child} with parent {parent}".format(
-            child=kolibrinode.pk,
+            child=ccnode.node_id,
             parent=ccnode.parent.node_id
         ))
-        kolibrinode.parent = kolibrimodels.ContentNode.objects.get(pk=ccnode.parent.node_id)
 
-    kolibrinode.save()
+    kolibrinode = writer.add_node({
+        'id': ccnode.node_id,
+        'parent_id': ccnode.parent.node_id if ccnode.parent else None,
+        'kind': ccnode.get_kind(),
+        'title': ccnode.title if ccnode.parent else channel_name,
+        'content_id': ccnode.content_id,
+        'channel_id': channel_id,
+        'author': ccnode.author or "",
+        'description': ccnode.description,
+        'sort_order': ccnode.sort_order,
+        'license_owner': ccnode.copyright_holder or "",
+        'license_id': license_id,
+        'available': not ccnode.is_empty_topic(),  # Hide empty topics
+        'stemmed_metaphone': "",  # Stemmed metaphone is no longer used, and will cause no harm if blank
+        'lang_id': language_id,
+        'license_name': license_name,
+        'license_description': license_description,
+        'coach_content': ccnode.role_visibility == roles.COACH,
+        'options': json.dumps(options)
+    })
     logging.debug("Created Kolibri ContentNode with node id {}".format(ccnode.node_id))
-    logging.debug("Kolibri node count: {}".format(kolibrimodels.ContentNode.objects.all().count()))
 
     return kolibrinode
 
 
+def get_language_fields(language_id):
+    language = languages.getlang(language_id) or languages.getlang_by_alpha2(language_id)
+    return {
+        'id': language_id,
+        'lang_code': language.primary_code,
+        'lang_subcode': language.subcode,
+        'lang_name': language.native_name,
+        'lang_direction': languages.getlang_direction(language.primary_code),
+    }
+
+
 def get_or_create_language(language_id):
-    language = languages.getlang_by_alpha2(language_id)
-    return kolibrimodels.Language.objects.get_or_create(
-        id=language_id,
-        lang_code=language.lang_code,
-        lang_subcode=language.lang_subcode,
-        lang_name=language.lang_name if hasattr(language, 'lang_name') else language.native_name,
-        lang_direction=language.lang_direction
+    return kolibrimodels.Language.objects.get_or_create(**get_language_fields(language_id))
+
+
+def load_json_string(json_string):
+    """ Studio stores some JSON fields as strings, and others already parsed """
+    if isinstance(json_string, basestring):
+        return json.loads(json_string)
+    return json_string
+
+
+def get_thumbnail_encoding(filename, dimension=THUMBNAIL_DIMENSION):
+    """
+        Generates a base64 encoding of an image resized to fit within dimension x dimension
+        Args:
+            filename (str): name of the image in storage, starting with its checksum
+            dimension (int): largest width or height of the thumbnail
+        Returns data URI of the resized image
+    """
+    if filename.startswith("data:image"):
+        return filename
+    if Image is None:
+        raise IOError("Pillow must be installed to generate thumbnails")
+
+    checksum, ext = os.path.splitext(os.path.basename(filename.split("?")[0]))
+    outbuffer = io.BytesIO()
+    with storage.open(generate_object_storage_name(checksum, filename), 'rb') as inbuffer:
+        image = Image.open(inbuffer)
+        image_format = image.format
+        image.thumbnail((dimension, dimension), Image.LANCZOS)
+        image.save(outbuffer, image_format)
+
+    return "data:image/{};base64,{}".format(
+        ext[1:].lower() or image_format.lower(),
+        base64.b64encode(outbuffer.getvalue()).decode('utf-8'),
     )
 
 
-def create_associated_thumbnail(ccnode, ccfilemodel):
+def create_associated_thumbnail(ccnode, ccfilemodel, thumbnail_cache=None, source_writeback=None):
     """
         Gets the appropriate thumbnail for export (uses or generates a base64 encoding)
         Args:
             ccnode (<ContentNode>): node to derive thumbnail from (if encoding is provided)
             ccfilemodel (<File>): file to get thumbnail from if no encoding is available
+            thumbnail_cache (<ThumbnailCache>): cache of encodings by file checksum
+            source_writeback (<SourceWriteBack>): queues the new encoding instead of saving ccnode
         Returns <File> model of encoded, resized thumbnail
     """
+    encoding = get_node_thumbnail_encoding(ccnode, ccfilemodel, thumbnail_cache, source_writeback)
+    if encoding is None:
+        return
+
+    return create_thumbnail_from_base64(
+        encoding,
+        uploaded_by=ccfilemodel.uploaded_by,
+        file_format_id=ccfilemodel.file_format_id,
+        preset_id=ccfilemodel.preset_id
+    )
+
+
+def get_node_thumbnail_encoding(ccnode, ccfilemodel, thumbnail_cache=None, source_writeback=None):
+    """
+        Returns the base64 thumbnail encoding of ccnode, generating it from its thumbnail file ccfilemodel
+        and saving it on ccnode, or queueing it on source_writeback, if the node has none yet.
+        Returns None if the node's encoding is malformed or the file cannot be encoded.
+    """
     encoding = None
     try:
         encoding = ccnode.thumbnail_encoding and load_json_string(ccnode.thumbnail_encoding).get('base64')
@@ -260,60 +680,69 @@ def create_associated_thumbnail(ccnode, ccfilemodel):
     # Save the encoding if it doesn't already have an encoding
     if not encoding:
         try:
-            encoding = get_thumbnail_encoding(str(ccfilemodel))
+            if thumbnail_cache is None:
+                encoding = get_thumbnail_encoding(str(ccfilemodel))
+            else:
+                encoding = get_or_create_encoding(
+                    thumbnail_cache, get_thumbnail_encoding, ccfilemodel, THUMBNAIL_DIMENSION)
         except IOError:
             # ImageMagick may raise an IOError if the file is not a thumbnail. Catch that then just return early.
             logging.error("ERROR: cannot identify the thumbnail ({}: {})".format(ccnode.id, ccnode.thumbnail_encoding))
             return
-        ccnode.thumbnail_encoding = json.dumps({
+        thumbnail_encoding = json.dumps({
             "base64": encoding,
             "points": [],
             "zoom": 0,
         })
-        ccnode.save()
+        if source_writeback is not None:
+            source_writeback.update_node(ccnode, thumbnail_encoding=thumbnail_encoding)
+        else:
+            ccnode.thumbnail_encoding = thumbnail_encoding
+            ccnode.save()
 
-    return create_thumbnail_from_base64(
-        encoding,
-        uploaded_by=ccfilemodel.uploaded_by,
-        file_format_id=ccfilemodel.file_format_id,
-        preset_id=ccfilemodel.preset_id
-    )
+    return encoding
 
 
-def create_associated_file_objects(kolibrinode, ccnode):
-    logging.debug("Creating LocalFile and File objects for Node {}".format(kolibrinode.id))
+def create_associated_file_objects(kolibrinode, ccnode, thumbnail_cache=None, source_writeback=None, stats=None,
+                                   writer=None):
+    logging.debug("Creating LocalFile and File objects for Node {}".format(ccnode.node_id))
+    if writer is None:
+        writer = ORMExportWriter()
     for ccfilemodel in ccnode.files:
+        if stats is not None:
+            stats.add_file(ccnode, ccfilemodel)
         preset = ccfilemodel.preset
         if preset.id in [format_presets.EXERCISE_IMAGE, format_presets.EXERCISE_GRAPHIE]:
             continue
         fformat = ccfilemodel.file_format
         if ccfilemodel.language:
-            get_or_create_language(ccfilemodel.language_id)
+            writer.add_language(get_language_fields(ccfilemodel.language_id))
 
         if preset.thumbnail:
-            ccfilemodel = create_associated_thumbnail(ccnode, ccfilemodel) or ccfilemodel
-
-        kolibrilocalfilemodel, new = kolibrimodels.LocalFile.objects.get_or_create(
-            pk=ccfilemodel.checksum,
-            defaults={
+            with stage("thumbnails"):
+                ccfilemodel = create_associated_thumbnail(
+                    ccnode, ccfilemodel, thumbnail_cache, source_writeback) or ccfilemodel
+
+        writer.add_file(
+            kolibrinode,
+            {
+                'id': ccfilemodel.checksum,
                 'extension': fformat.extension,
                 'file_size': ccfilemodel.file_size,
-            }
-        )
-
-        kolibrimodels.File.objects.create(
-            pk=ccfilemodel.id,
-            checksum=ccfilemodel.checksum,
-            extension=fformat.extension,
-            available=True,  # TODO: Set this to False, once we have availability stamping implemented in Kolibri
-            file_size=ccfilemodel.file_size,
-            contentnode=kolibrinode,
-            preset=preset.id,
-            supplementary=preset.supplementary,
-            lang_id=ccfilemodel.language and ccfilemodel.language.id,
-            thumbnail=preset.thumbnail,
-            priority=preset.order,
-            local_file=kolibrilocalfilemodel,
+            },
+            {
+                'id': ccfilemodel.id,
+                'checksum': ccfilemodel.checksum,
+                'extension': fformat.extension,
+                # Stamped after the export instead with PUBLISH_STAMP_AVAILABILITY.
+                'available': True,
+                'file_size': ccfilemodel.file_size,
+                'preset': preset.id,
+                'supplementary': preset.supplementary,
+                'lang_id': ccfilemodel.language and ccfilemodel.language.id,
+                'thumbnail': preset.thumbnail,
+                'priority': preset.order,
+            },
         )
 
 
@@ -324,8 +753,11 @@ def create_perseus_exercise(ccnode, kolibrinode, exercise_data, user_id=None):
     try:
         with tempfile.NamedTemporaryFile(suffix=".perseus", delete=False) as tempf:
             temppath = tempf.name
+            start = time.perf_counter()
             create_perseus_zip(ccnode, exercise_data, tempf)
+            observe("perseus_zip", time.perf_counter() - start)
             file_size = tempf.tell()
+            add_bytes("exercises", file_size)
             tempf.flush()
 
             ccnode.add_exercise_file(temppath)
@@ -335,7 +767,7 @@ def create_perseus_exercise(ccnode, kolibrinode, exercise_data, user_id=None):
         temppath and os.unlink(temppath)
 
 
-def process_assessment_metadata(ccnode, kolibrinode):
+def process_assessment_metadata(ccnode, kolibrinode, writer=None):
     # Get mastery model information, set to default if none provided
     assessment_items = ccnode.get_assessment_items(order_by='order')
     exercise_data = ccnode.extra_fields if ccnode.extra_fields else {}
@@ -370,15 +802,16 @@ def process_assessment_metadata(ccnode, kolibrinode):
         'assessment_mapping': {a.assessment_id: a.type if a.type != 'true_false' else exercises.SINGLE_SELECTION for a in assessment_items},
     })
 
-    kolibrimodels.AssessmentMetaData.objects.create(
-        id=uuid.uuid4(),
-        contentnode=kolibrinode,
-        assessment_item_ids=json.dumps(assessment_item_ids),
-        number_of_assessments=item_count,
-        mastery_model=json.dumps(mastery_model),
-        randomize=randomize,
-        is_manipulable=ccnode.get_kind() == content_kinds.EXERCISE,
-    )
+    if writer is None:
+        writer = ORMExportWriter()
+    writer.add_assessment_metadata(kolibrinode, {
+        'id': uuid.uuid4(),
+        'assessment_item_ids': json.dumps(assessment_item_ids),
+        'number_of_assessments': item_count,
+        'mastery_model': json.dumps(mastery_model),
+        'randomize': randomize,
+        'is_manipulable': ccnode.get_kind() == content_kinds.EXERCISE,
+    })
 
     return exercise_data
 
@@ -451,6 +884,8 @@ def write_assessment_item(assessment_item, zf):  # noqa C901
         answer_data = json.loads(assessment_item.answers)
     for answer in answer_data:
         if assessment_item.type == exercises.INPUT_QUESTION:
+            # Only needed for input questions, and not part of every le_utils release.
+            from le_utils.parser import extract_value
             answer['answer'] = extract_value(answer['answer'])
         else:
             answer['answer'] = answer['answer'].replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
@@ -578,21 +1013,23 @@ def convert_channel_thumbnail(channel):
     return get_thumbnail_encoding(channel.thumbnail)
 
 
-def map_tags_to_node(kolibrinode, ccnode):
+def get_tag_id(tag_name):
+    # ContentTag has no default id, so tags must be given one; before names
+    # were hashed, get_or_create failed on the empty id of any new tag.
+    return uuid.uuid5(TAG_ID_NAMESPACE, tag_name).hex
+
+
+def map_tags_to_node(kolibrinode, ccnode, writer=None):
     """ map_tags_to_node: assigns tags to nodes (creates fk relationship)
         Args:
-            kolibrinode (kolibri.models.ContentNode): node to map tag to
+            kolibrinode (kolibri.models.ContentNode): node to map tag to, or its id for a SQLiteExportWriter
             ccnode (contentcuration.models.ContentNode): node with tags to map
+            writer (<ORMExportWriter> or <SQLiteExportWriter>): writes the tags, with the ORM by default
         Returns: None
     """
-    tags_to_add = []
-
-    for tag in ccnode.get_tags():
-        t, _new = kolibrimodels.ContentTag.objects.get_or_create(tag_name=tag)
-        tags_to_add.append(t)
-
-    kolibrinode.tags = tags_to_add
-    kolibrinode.save()
+    if writer is None:
+        writer = ORMExportWriter()
+    writer.set_tags(kolibrinode, [(get_tag_id(tag), tag) for tag in ccnode.get_tags()])
 
 
 def prepare_export_database(tempdb):
@@ -618,9 +1055,13 @@ def raise_if_nodes_are_all_unchanged(channel):
     logging.info("Some nodes are changed.")
 
 
-def mark_all_nodes_as_published(channel):
+def mark_all_nodes_as_published(channel, source_writeback=None):
     logging.debug("Marking all nodes as published.")
 
+    if source_writeback is not None:
+        source_writeback.update_family(channel.main_tree, changed=False, published=True)
+        return
+
     channel.main_tree.get_family().update(changed=False, published=True)
 
     logging.info("Marked all nodes as published.")
@@ -633,6 +1074,7 @@ def save_export_database(channel_id):
 
     with open(current_export_db_location, 'rb') as currentf:
         storage.save(target_export_db_location, currentf)
+    add_bytes("save", os.path.getsize(current_export_db_location))
     logging.info("Successfully copied to {}".format(target_export_db_location))
 
 
@@ -642,18 +1084,29 @@ def add_tokens_to_channel(channel):
         channel.make_token()
 
 
-def fill_published_fields(channel, version_notes):
+def fill_published_fields(channel, version_notes, stats=None):
+    """
+    Stores the published resource counts, size and languages on the channel.
+    Uses the PublishStats returned by create_content_database if given, and
+    otherwise queries the published nodes of the source tree for them.
+    """
     channel.last_published = timezone.now()
-    published_nodes = channel.main_tree.get_descendants().filter(published=True).prefetch_related('files')
-    channel.total_resource_count = published_nodes.exclude(kind_id=content_kinds.TOPIC).count()
-    kind_counts = list(published_nodes.values('kind_id').annotate(count=Count('kind_id')).order_by('kind_id'))
+    if stats is not None:
+        channel.total_resource_count = stats.resource_count
+        kind_counts = stats.get_kind_counts()
+        channel.published_size = stats.size
+        language_list = stats.get_languages()
+    else:
+        published_nodes = channel.main_tree.get_descendants().filter(published=True).prefetch_related('files')
+        channel.total_resource_count = published_nodes.exclude(kind_id=content_kinds.TOPIC).count()
+        kind_counts = list(published_nodes.values('kind_id').annotate(count=Count('kind_id')).order_by('kind_id'))
+        channel.published_size = published_nodes.values('files__checksum', 'files__file_size').distinct(
+        ).aggregate(resource_size=Sum('files__file_size'))['resource_size'] or 0
+
+        node_languages = published_nodes.exclude(language=None).values_list('language', flat=True)
+        file_languages = published_nodes.values_list('files__language', flat=True)
+        language_list = list(set(chain(node_languages, file_languages)))
     channel.published_kind_count = json.dumps(kind_counts)
-    channel.published_size = published_nodes.values('files__checksum', 'files__file_size').distinct(
-    ).aggregate(resource_size=Sum('files__file_size'))['resource_size'] or 0
-
-    node_languages = published_nodes.exclude(language=None).values_list('language', flat=True)
-    file_languages = published_nodes.values_list('files__language', flat=True)
-    language_list = list(set(chain(node_languages, file_languages)))
 
     for lang in language_list:
         if lang:
@@ -673,16 +1126,43 @@ def fill_published_fields(channel, version_notes):
     channel.save()
 
 
-def publish_channel(user_id, channel, version_notes='', force=False, force_exercises=False, send_email=False, task_object=None):
+def accepts_keyword(func, name):
+    """
+    Returns whether `func` can be called with the keyword argument `name`.
+    """
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        parameter.name == name or parameter.kind == parameter.VAR_KEYWORD
+        for parameter in parameters
+    )
+
+
+def publish_channel(user_id, channel, version_notes='', force=False, force_exercises=False, send_email=False, task_object=None,
+                    instrumentation=None, checkpoint_dir=None):
     kolibri_temp_db = None
+    source_writeback = SourceWriteBack()
+    if checkpoint_dir is None:
+        checkpoint_dir = getattr(settings, "PUBLISH_CHECKPOINT_DIR", None)
+    published = False
 
     try:
         set_channel_icon_encoding(channel)
-        kolibri_temp_db = create_content_database(channel, force, user_id, force_exercises, task_object)
+        kolibri_temp_db, stats = create_content_database(
+            channel, force, user_id, force_exercises, task_object,
+            instrumentation=instrumentation, source_writeback=source_writeback, checkpoint_dir=checkpoint_dir)
+        # mark_all_nodes_as_published(channel, source_writeback)
+        source_writeback.flush()
         channel.increment_version()
-        # mark_all_nodes_as_published(channel)
         # add_tokens_to_channel(channel)
-        channel.fill_published_fields(version_notes)
+        if accepts_keyword(channel.fill_published_fields, "stats"):
+            channel.fill_published_fields(version_notes, stats=stats)
+        else:
+            # Channels from before PublishStats would query the source tree
+            # for the counts the publish has already gathered.
+            fill_published_fields(channel, version_notes, stats=stats)
 
         # Attributes not getting set for some reason, so just save it here
         channel.set_changed(False)
@@ -697,10 +1177,14 @@ def publish_channel(user_id, channel, version_notes='', force=False, force_exerc
 
         if task_object:
             task_object.update_state(state='STARTED', meta={'progress': 100.0})
+        published = True
 
     # No matter what, make sure publishing is set to False once the run is done
     finally:
-        if kolibri_temp_db and os.path.exists(kolibri_temp_db):
-            os.remove(kolibri_temp_db)
+        if kolibri_temp_db:
+            checkpoint = PublishCheckpoint(kolibri_temp_db)
+            # A failed checkpointed publish keeps its database to resume from.
+            if published or not checkpoint.exists():
+                checkpoint.remove()
         channel.set_publishing(False)
     return channel
@@ -0,0 +1,272 @@
+"""
+Reads Kolibri channel databases with the sqlite3 module, without Django.
+
+Tooling that scans many channel databases does not need the models, settings
+or `using_content_database` just to read their rows, so ChannelDatabaseReader
+opens a database file read-only and returns its rows as namedtuple records.
+Nodes are streamed in tree order from one cursor, children are read lazily,
+and nodes, files and tags can be looked up in bulk by id.
+
+Databases exported with older versions of the content schema lack some
+columns; their fields are None in the records. Booleans are the 0 or 1
+stored, and `options` is the JSON text stored.
+"""
+import collections
+import sqlite3
+import uuid
+from urllib.request import pathname2url
+
+# Kept below SQLite's default limit of 999 variables per query, as each chunk
+# of ids is passed as the parameters of an IN clause.
+BULK_CHUNK_SIZE = 500
+
+NODE_TABLE = "content_contentnode"
+FILE_TABLE = "content_file"
+LOCAL_FILE_TABLE = "content_localfile"
+TAG_TABLE = "content_contenttag"
+NODE_TAGS_TABLE = "content_contentnode_tags"
+CHANNEL_TABLE = "content_channelmetadata"
+
+ContentNodeRecord = collections.namedtuple(
+    "ContentNodeRecord",
+    [
+        "id",
+        "parent_id",
+        "lft",
+        "rght",
+        "level",
+        "tree_id",
+        "channel_id",
+        "content_id",
+        "kind",
+        "title",
+        "description",
+        "sort_order",
+        "author",
+        "license_owner",
+        "license_name",
+        "license_description",
+        "lang_id",
+        "available",
+        "coach_content",
+        "options",
+    ],
+)
+
+FileRecord = collections.namedtuple(
+    "FileRecord",
+    [
+        "id",
+        "contentnode_id",
+        "local_file_id",
+        "extension",
+        "file_size",
+        "preset",
+        "lang_id",
+        "supplementary",
+        "thumbnail",
+        "priority",
+        "available",
+    ],
+)
+
+TagRecord = collections.namedtuple("TagRecord", ["id", "tag_name"])
+
+ChannelRecord = collections.namedtuple(
+    "ChannelRecord",
+    [
+        "id",
+        "name",
+        "description",
+        "tagline",
+        "author",
+        "version",
+        "thumbnail",
+        "last_updated",
+        "min_schema_version",
+        "root_id",
+    ],
+)
+
+
+def to_id(value):
+    """
+    Ids are stored as 32 character hex strings.
+    """
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return value
+
+
+def chunks(values, size=BULK_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class ChannelDatabaseReader:
+    """
+    Reads the channel database at `path`. Close it when done, or use it as a
+    context manager.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(path)), uri=True)
+        self._selects = {}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_channel(self):
+        """
+        Returns the channel's ChannelRecord, or None for a database without one.
+        """
+        row = self.connection.execute(self._select(ChannelRecord, CHANNEL_TABLE)).fetchone()
+        return row and ChannelRecord._make(row)
+
+    def get_root(self):
+        """
+        Returns the channel's root node, or None if it has no channel or nodes.
+        Databases from before the channel's root_id was stored have the one
+        tree of their channel, so its root is the node without a parent.
+        """
+        channel = self.get_channel()
+        if channel is None:
+            return None
+        if channel.root_id is not None:
+            return self.get_node(channel.root_id)
+        return next(
+            self._query(ContentNodeRecord, NODE_TABLE, "WHERE parent_id IS NULL ORDER BY tree_id LIMIT 1"), None)
+
+    def get_node(self, node_id):
+        return self.get_nodes([node_id]).get(to_id(node_id))
+
+    def get_nodes(self, node_ids):
+        """
+        Returns a dict of the ContentNodeRecords of `node_ids` by id. Ids of
+        nodes that do not exist are left out.
+        """
+        nodes = {}
+        for chunk in chunks(to_id(node_id) for node_id in node_ids):
+            for node in self._query(
+                ContentNodeRecord,
+                NODE_TABLE,
+                "WHERE id IN ({})".format(", ".join("?" for _ in chunk)),
+                chunk,
+            ):
+                nodes[node.id] = node
+        return nodes
+
+    def iter_nodes(self, root=None):
+        """
+        Yields the nodes under `root`, a node or its id, and the root itself,
+        in tree order. By default yields every node of the database.
+        """
+        if root is None:
+            return self._query(ContentNodeRecord, NODE_TABLE, "ORDER BY tree_id, lft")
+        if not isinstance(root, ContentNodeRecord):
+            root = self.get_node(root)
+            if root is None:
+                return iter(())
+        return self._query(
+            ContentNodeRecord,
+            NODE_TABLE,
+            "WHERE tree_id = ? AND lft BETWEEN ? AND ? ORDER BY lft",
+            [root.tree_id, root.lft, root.rght],
+        )
+
+    def iter_node_values(self, fields):
+        """
+        Yields tuples of the values of the node columns `fields` of every node,
+        in tree order, without building records.
+        """
+        return self.connection.execute(
+            "SELECT {} FROM {} ORDER BY tree_id, lft".format(", ".join(fields), NODE_TABLE))
+
+    def get_file_sizes(self):
+        """
+        Returns a dict of the total size of each node's files by node id.
+        Nodes without files are left out.
+        """
+        return dict(self.connection.execute(
+            "SELECT contentnode_id, SUM(file_size) FROM {} GROUP BY contentnode_id".format(FILE_TABLE)))
+
+    def iter_node_local_files(self):
+        """
+        Yields (node id, local file id, local file size) for every file.
+        """
+        return self.connection.execute(
+            "SELECT f.contentnode_id, f.local_file_id, l.file_size FROM {} f JOIN {} l ON l.id = f.local_file_id".format(
+                FILE_TABLE, LOCAL_FILE_TABLE))
+
+    def get_local_file_ids(self, checksums):
+        """
+        Returns the subset of `checksums` that are ids of local files.
+        """
+        found = set()
+        for chunk in chunks(checksums):
+            found.update(row[0] for row in self.connection.execute(
+                "SELECT id FROM {} WHERE id IN ({})".format(LOCAL_FILE_TABLE, ", ".join("?" for _ in chunk)), chunk))
+        return found
+
+    def iter_children(self, parent):
+        """
+        Yields the children of `parent`, a node or its id, in order.
+        """
+        parent_id = parent.id if isinstance(parent, ContentNodeRecord) else to_id(parent)
+        return self._query(ContentNodeRecord, NODE_TABLE, "WHERE parent_id = ? ORDER BY lft", [parent_id])
+
+    def get_files(self, node_ids):
+        """
+        Returns a dict of lists of the FileRecords of each of `node_ids`, in
+        priority order. Nodes without files are left out.
+        """
+        files = collections.defaultdict(list)
+        for chunk in chunks(to_id(node_id) for node_id in node_ids):
+            for file in self._query(
+                FileRecord,
+                FILE_TABLE,
+                "WHERE contentnode_id IN ({}) ORDER BY priority, id".format(", ".join("?" for _ in chunk)),
+                chunk,
+            ):
+                files[file.contentnode_id].append(file)
+        return dict(files)
+
+    def get_tags(self, node_ids):
+        """
+        Returns a dict of lists of the TagRecords of each of `node_ids`.
+        Nodes without tags are left out.
+        """
+        tags = collections.defaultdict(list)
+        for chunk in chunks(to_id(node_id) for node_id in node_ids):
+            rows = self.connection.execute(
+                "SELECT n.contentnode_id, t.id, t.tag_name FROM {} n JOIN {} t ON t.id = n.contenttag_id "
+                "WHERE n.contentnode_id IN ({}) ORDER BY n.id".format(
+                    NODE_TAGS_TABLE, TAG_TABLE, ", ".join("?" for _ in chunk)),
+                chunk,
+            )
+            for node_id, tag_id, tag_name in rows:
+                tags[node_id].append(TagRecord(tag_id, tag_name))
+        return dict(tags)
+
+    def _query(self, record, table, clauses="", params=()):
+        cursor = self.connection.execute("{} {}".format(self._select(record, table), clauses), params)
+        return map(record._make, cursor)
+
+    def _select(self, record, table):
+        """
+        Selects the fields of `record` from `table`, with NULL for those the
+        database's schema does not have.
+        """
+        if record not in self._selects:
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info({})".format(table))}
+            self._selects[record] = "SELECT {} FROM {}".format(
+                ", ".join(field if field in columns else "NULL" for field in record._fields), table)
+        return self._selects[record]
@@ -0,0 +1,85 @@
+"""
+Statistics about a published channel, gathered while publish walks the source
+tree so they do not need to be queried again afterwards.
+"""
+import collections
+
+from le_utils.constants import content_kinds
+
+
+class PublishStats:
+    """
+    Accumulates the figures stored on a channel when it is published: the
+    resource count, node counts per kind, the size of its distinct files and
+    the languages of its nodes and files.
+
+    Like the queries in publish.fill_published_fields, the root node and its
+    files, such as the channel thumbnail, are not counted, and file sizes are
+    counted once per distinct checksum and size.
+    """
+
+    def __init__(self):
+        self.kind_counts = collections.Counter()
+        self.node_language_counts = collections.Counter()
+        self.file_language_counts = collections.Counter()
+        # Size of each distinct (checksum, size) pair.
+        self.file_sizes = {}
+
+    def add_node(self, ccnode):
+        if ccnode.parent is None:
+            return
+        self.kind_counts[ccnode.get_kind()] += 1
+        if ccnode.language_id:
+            self.node_language_counts[ccnode.language_id] += 1
+
+    def add_file(self, ccnode, ccfilemodel):
+        if ccnode.parent is None:
+            return
+        self.file_sizes[(ccfilemodel.checksum, ccfilemodel.file_size)] = ccfilemodel.file_size or 0
+        if ccfilemodel.language_id:
+            self.file_language_counts[ccfilemodel.language_id] += 1
+
+    def update(self, other):
+        """
+        Adds the nodes and files counted by another PublishStats, such as one
+        filled in by a publish worker process.
+        """
+        self.kind_counts.update(other.kind_counts)
+        self.node_language_counts.update(other.node_language_counts)
+        self.file_language_counts.update(other.file_language_counts)
+        self.file_sizes.update(other.file_sizes)
+
+    @property
+    def resource_count(self):
+        return sum(
+            count
+            for kind, count in self.kind_counts.items()
+            if kind != content_kinds.TOPIC
+        )
+
+    @property
+    def size(self):
+        return sum(self.file_sizes.values())
+
+    def get_kind_counts(self):
+        """
+        Returns the counts per kind in the shape of the kind count query:
+        [{"kind_id": kind, "count": count}], ordered by kind.
+        """
+        return [
+            {"kind_id": kind, "count": count}
+            for kind, count in sorted(self.kind_counts.items())
+        ]
+
+    def get_languages(self):
+        return sorted(set(self.node_language_counts) | set(self.file_language_counts))
+
+    def as_dict(self):
+        return {
+            "resource_count": self.resource_count,
+            "kind_count": self.get_kind_counts(),
+            "size": self.size,
+            "included_languages": self.get_languages(),
+            "node_language_counts": dict(self.node_language_counts),
+            "file_language_counts": dict(self.file_language_counts),
+        }
@@ -0,0 +1,165 @@
+"""
+Persistent cache of thumbnail encodings, and generation of missing encodings
+in a worker pool before a channel is mapped.
+
+Encodings are keyed by the checksum of the source image and the thumbnail
+dimension, so an image is only decoded and resized once however many nodes or
+publishes use it.
+"""
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from .tree import iter_source_nodes
+from .tree import should_export_node
+
+logger = logging.getLogger(__name__)
+
+# Image decoding and resizing release the GIL, so threads are enough.
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+CACHE_WRITE_BATCH_SIZE = 100
+
+
+class ThumbnailCache:
+    """
+    Stores base64 thumbnail encodings in an SQLite database at `path`, or in
+    memory for the lifetime of the cache if no path is given.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or ":memory:"
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnail_encoding ("
+            "checksum TEXT NOT NULL, "
+            "dimension INTEGER NOT NULL, "
+            "encoding TEXT NOT NULL, "
+            "PRIMARY KEY (checksum, dimension))"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, checksum, dimension):
+        row = self.connection.execute(
+            "SELECT encoding FROM thumbnail_encoding "
+            "WHERE checksum = ? AND dimension = ?",
+            (checksum, dimension),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def get_missing(self, checksums, dimension):
+        """
+        Returns the subset of `checksums` with no cached encoding.
+        """
+        missing = set(checksums)
+        found = set()
+        checksums = list(missing)
+        # Stay under SQLite's default limit of 999 query parameters.
+        for i in range(0, len(checksums), 500):
+            chunk = checksums[i:i + 500]
+            found.update(
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT checksum FROM thumbnail_encoding "
+                    "WHERE dimension = ? AND checksum IN ({})".format(
+                        ",".join("?" * len(chunk))
+                    ),
+                    [dimension] + chunk,
+                )
+            )
+        return missing - found
+
+    def put_many(self, checksum_encodings, dimension):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO thumbnail_encoding "
+            "(checksum, dimension, encoding) VALUES (?, ?, ?)",
+            [
+                (checksum, dimension, encoding)
+                for checksum, encoding in checksum_encodings
+            ],
+        )
+        self.connection.commit()
+
+    def put(self, checksum, dimension, encoding):
+        self.put_many([(checksum, encoding)], dimension)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_thumbnail_files(root_node):
+    """
+    Yields the thumbnail files of nodes under `root_node` that have no stored
+    thumbnail encoding, so would need one generated when published. Follows
+    the same nodes as publish.map_content_nodes.
+    """
+    for node in iter_source_nodes(root_node):
+        if not should_export_node(node) or node.thumbnail_encoding:
+            continue
+        for ccfilemodel in node.files:
+            if ccfilemodel.preset.thumbnail:
+                yield ccfilemodel
+
+
+def get_or_create_encoding(cache, encoder, ccfilemodel, dimension):
+    """
+    Returns the thumbnail encoding of `ccfilemodel`, from the cache if possible
+    and otherwise by calling encoder(filename, dimension) and caching it.
+    """
+    encoding = cache.get(ccfilemodel.checksum, dimension)
+    if encoding is None:
+        encoding = encoder(str(ccfilemodel), dimension)
+        cache.put(ccfilemodel.checksum, dimension, encoding)
+    return encoding
+
+
+def pregenerate_thumbnails(
+    root_node, cache, encoder, dimension, max_workers=DEFAULT_WORKERS
+):
+    """
+    Generates the encoding of every thumbnail under `root_node` that is not
+    cached yet, `max_workers` at a time, and stores them in `cache`. Returns
+    the number of encodings generated. Images that cannot be encoded are
+    skipped here and reported when the node is mapped.
+    """
+    filenames = {}
+    for ccfilemodel in iter_thumbnail_files(root_node):
+        filenames.setdefault(ccfilemodel.checksum, str(ccfilemodel))
+    missing = cache.get_missing(filenames, dimension)
+    if not missing:
+        return 0
+
+    logger.info("Generating {} thumbnails".format(len(missing)))
+
+    def encode(checksum):
+        try:
+            return checksum, encoder(filenames[checksum], dimension)
+        except IOError as e:
+            logger.debug("Unable to encode thumbnail {}: {}".format(checksum, e))
+            return checksum, None
+
+    generated = 0
+    batch = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for checksum, encoding in executor.map(encode, sorted(missing)):
+            if encoding:
+                batch.append((checksum, encoding))
+            # Saved as they come in, so an interrupted publish keeps its work.
+            if len(batch) >= CACHE_WRITE_BATCH_SIZE:
+                cache.put_many(batch, dimension)
+                generated += len(batch)
+                batch = []
+    cache.put_many(batch, dimension)
+    return generated + len(batch)
@@ -0,0 +1,80 @@
+"""
+Streaming traversal of a source (Studio) channel tree.
+
+Publishing visits every node of a channel, and used to queue each node's
+children as model instances, which for wide channels holds most of a level in
+memory at once. Here the tree is walked depth first with a stack of one frame
+per level: a frame keeps the id and last `lft` of the children it has read,
+and only the current chunk of them is loaded as model instances, so memory is
+bounded by the tree's depth times the chunk size whatever its width.
+"""
+import collections
+
+from .instrumentation import stage
+
+TREE_CHUNK_SIZE = 500
+
+
+def should_export_node(node):
+    """
+    Whether publish exports `node`, and so also visits its children.
+    """
+    return not node.is_empty_topic() and node.complete
+
+
+class ChildrenFrame:
+    """
+    Reads the children of `parent` in `lft` order, a chunk at a time: first
+    their ids and `lft` values, then the chunk's instances with in_bulk.
+    """
+
+    __slots__ = ("parent", "last_lft", "exhausted", "nodes")
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.last_lft = None
+        self.exhausted = False
+        self.nodes = collections.deque()
+
+    def next(self, chunk_size):
+        if not self.nodes and not self.exhausted:
+            with stage("children"):
+                self._read_chunk(chunk_size)
+        return self.nodes.popleft() if self.nodes else None
+
+    def _read_chunk(self, chunk_size):
+        manager = type(self.parent).objects
+        children = manager.filter(parent_id=self.parent.pk)
+        if self.last_lft is not None:
+            children = children.filter(lft__gt=self.last_lft)
+        rows = list(children.order_by("lft").values_list("pk", "lft")[:chunk_size])
+        self.exhausted = len(rows) < chunk_size
+        if not rows:
+            return
+        self.last_lft = rows[-1][1]
+        nodes = manager.in_bulk([pk for pk, _ in rows])
+        for pk, _ in rows:
+            node = nodes[pk]
+            # Saves a query for the parent when the node is exported.
+            node.parent = self.parent
+            self.nodes.append(node)
+
+
+def iter_source_nodes(root_node, should_descend=should_export_node, chunk_size=TREE_CHUNK_SIZE):
+    """
+    Yields `root_node` and its descendants depth first, in tree order, so
+    every node comes after its parent. The children of nodes for which
+    should_descend(node) is false are skipped.
+    """
+    yield root_node
+    if not should_descend(root_node):
+        return
+    stack = [ChildrenFrame(root_node)]
+    while stack:
+        node = stack[-1].next(chunk_size)
+        if node is None:
+            stack.pop()
+            continue
+        yield node
+        if should_descend(node):
+            stack.append(ChildrenFrame(node))
@@ -0,0 +1,111 @@
+"""
+Collects the changes publishing makes to the source (Studio) tree, so they can
+be written in a few batched UPDATE queries at the end of the publish instead of
+one save() per node.
+"""
+import collections
+import logging
+
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import Value
+from django.db.models import When
+
+logger = logging.getLogger(__name__)
+
+# Kept below SQLite's default limit of 999 variables per query, as each node
+# in a batch adds a parameter for its id and one for each of its values.
+WRITE_BACK_BATCH_SIZE = 300
+
+
+class SourceWriteBack:
+    """
+    Queues field updates for source nodes, and for whole families of nodes.
+    Node objects are updated in memory straight away; the database is only
+    written to by `flush`.
+
+    Updates are applied with queryset updates, like bulk_update, so the models'
+    save() methods and signals are not run for them.
+    """
+
+    def __init__(self, batch_size=WRITE_BACK_BATCH_SIZE):
+        self.batch_size = batch_size
+        # {model: {pk: {field: value}}}
+        self.node_updates = collections.defaultdict(collections.OrderedDict)
+        # {(model, pk): (root_node, {field: value})}
+        self.family_updates = collections.OrderedDict()
+
+    def __len__(self):
+        return sum(len(updates) for updates in self.node_updates.values()) + len(
+            self.family_updates
+        )
+
+    def update_node(self, node, **fields):
+        for name, value in fields.items():
+            setattr(node, name, value)
+        self.node_updates[type(node)].setdefault(node.pk, {}).update(fields)
+
+    def add_updates(self, node_updates):
+        """
+        Queues updates collected by another SourceWriteBack, as its
+        `node_updates`, such as one used in a publish worker process. The
+        node objects in this process are not updated.
+        """
+        for model, updates in node_updates.items():
+            for pk, fields in updates.items():
+                self.node_updates[model].setdefault(pk, {}).update(fields)
+
+    def update_family(self, root_node, **fields):
+        """
+        Queues an update of `fields` on `root_node` and all its descendants.
+        Updates queued for the same family are combined into one query.
+        """
+        key = (type(root_node), root_node.pk)
+        if key in self.family_updates:
+            self.family_updates[key][1].update(fields)
+        else:
+            self.family_updates[key] = (root_node, dict(fields))
+
+    def flush(self):
+        """
+        Writes all queued updates in one transaction and clears the queue.
+        Returns the number of queries run.
+        """
+        queries = 0
+        with transaction.atomic():
+            # Families first, so per-node values win where both set a field.
+            for root_node, fields in self.family_updates.values():
+                root_node.get_family().update(**fields)
+                queries += 1
+            for model, updates in self.node_updates.items():
+                queries += self._flush_model(model, updates)
+        logger.info("Wrote back {} source updates in {} queries".format(len(self), queries))
+        self.node_updates.clear()
+        self.family_updates.clear()
+        return queries
+
+    def _flush_model(self, model, updates):
+        # Nodes are grouped by which fields they change, so each query sets
+        # the same columns on every row it touches.
+        groups = collections.defaultdict(list)
+        for pk, fields in updates.items():
+            groups[tuple(sorted(fields))].append((pk, fields))
+
+        queries = 0
+        for names, rows in groups.items():
+            for i in range(0, len(rows), self.batch_size):
+                batch = rows[i:i + self.batch_size]
+                model.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+                    **{name: self._get_value(model, name, batch) for name in names}
+                )
+                queries += 1
+        return queries
+
+    def _get_value(self, model, name, batch):
+        values = [fields[name] for _, fields in batch]
+        if all(value == values[0] for value in values):
+            return values[0]
+        return Case(
+            *[When(pk=pk, then=Value(fields[name])) for pk, fields in batch],
+            output_field=model._meta.get_field(name)
+        )
@@ -0,0 +1,331 @@
+"""
+Writers of the rows publish exports into a content database.
+
+ORMExportWriter saves them through the kolibri_content models, into the active
+content database. SQLiteExportWriter inserts the same rows with the sqlite3
+module directly, in batches of prepared statements run with executemany, into
+the tables the content migrations created. It skips the model instances, the
+per-row queries of get_or_create and the MPTT updates of the ORM, and numbers
+the tree itself as the nodes are added in tree order.
+
+Both take the values of each row by field attname, as the ORM would be given
+them, and SQLiteExportWriter converts them as the fields' get_db_prep_save
+would, so both write the same values.
+"""
+import json
+import sqlite3
+import uuid
+
+from django.db import connections
+from jsonfield import JSONField
+
+from kolibri_content import models as kolibrimodels
+from kolibri_content.router import get_active_content_database
+
+ORM_WRITER = "orm"
+SQLITE_WRITER = "sqlite"
+WRITE_BATCH_SIZE = 1000
+
+
+class ORMExportWriter:
+    """
+    Writes export rows with the kolibri_content models. Nodes are returned
+    as the saved model instances.
+    """
+
+    def add_license(self, license_name, license_description):
+        return kolibrimodels.License.objects.get_or_create(
+            license_name=license_name,
+            license_description=license_description,
+        )[0].pk
+
+    def add_language(self, fields):
+        return kolibrimodels.Language.objects.get_or_create(**fields)[0].pk
+
+    def add_node(self, fields):
+        fields = dict(fields)
+        parent_id = fields.pop("parent_id")
+        kolibrinode, is_new = kolibrimodels.ContentNode.objects.update_or_create(pk=fields.pop("id"), defaults=fields)
+        if parent_id:
+            kolibrinode.parent = kolibrimodels.ContentNode.objects.get(pk=parent_id)
+        kolibrinode.save()
+        return kolibrinode
+
+    def add_assessment_metadata(self, node, fields):
+        kolibrimodels.AssessmentMetaData.objects.create(contentnode=node, **fields)
+
+    def add_file(self, node, local_file_fields, file_fields):
+        local_file_fields = dict(local_file_fields)
+        kolibrilocalfilemodel, new = kolibrimodels.LocalFile.objects.get_or_create(
+            pk=local_file_fields.pop("id"),
+            defaults=local_file_fields,
+        )
+        kolibrimodels.File.objects.create(contentnode=node, local_file=kolibrilocalfilemodel, **file_fields)
+
+    def set_tags(self, node, tags):
+        tags_to_add = []
+        for tag_id, tag_name in tags:
+            t, _new = kolibrimodels.ContentTag.objects.get_or_create(
+                tag_name=tag_name,
+                defaults={'id': tag_id},
+            )
+            tags_to_add.append(t)
+        node.tags = tags_to_add
+        node.save()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def convert_uuid(value):
+    if value is None or isinstance(value, uuid.UUID):
+        return value and value.hex
+    return uuid.UUID(value).hex
+
+
+def get_converter(field):
+    """
+    Returns a function converting values of `field` to what the ORM would
+    store for them, or None to store them as they are.
+    """
+    target = getattr(field, "target_field", field)
+    if target.get_internal_type() == "UUIDField":
+        return convert_uuid
+    if isinstance(field, JSONField):
+        dump_kwargs = field.dump_kwargs
+
+        def convert_json(value):
+            # The ORM parses JSON given as a string before it is saved.
+            if isinstance(value, str):
+                value = json.loads(value)
+            return json.dumps(value, **dump_kwargs)
+        return convert_json
+    internal_type = target.get_internal_type()
+    if internal_type == "FloatField":
+        return lambda value: value if value is None else float(value)
+    if internal_type in ("IntegerField", "PositiveIntegerField", "SmallIntegerField", "AutoField"):
+        return lambda value: value if value is None else int(value)
+    return None
+
+
+class Table:
+    """
+    The rows waiting to be inserted into the table of `model`, and the
+    prepared statement inserting them.
+    """
+
+    def __init__(self, model, insert="INSERT"):
+        # Autoincrement ids are left to SQLite.
+        fields = [
+            field for field in model._meta.concrete_fields
+            if not (field.primary_key and field.get_internal_type() == "AutoField")
+        ]
+        self.fields = [(field.attname, field.get_default(), get_converter(field)) for field in fields]
+        self.sql = "{} INTO {} ({}) VALUES ({})".format(
+            insert,
+            model._meta.db_table,
+            ", ".join(field.column for field in fields),
+            ", ".join("?" for _ in fields),
+        )
+        self.rows = []
+
+    def add(self, fields):
+        row = []
+        for attname, default, converter in self.fields:
+            value = fields.get(attname, default)
+            row.append(value if converter is None else converter(value))
+        self.rows.append(row)
+
+    def flush(self, cursor):
+        if self.rows:
+            cursor.executemany(self.sql, self.rows)
+            self.rows = []
+
+
+class SQLiteExportWriter:
+    """
+    Writes export rows with executemany on its own sqlite3 connection to the
+    content database at `path`, by default the active one, in a transaction
+    committed by `close`. Nodes are returned as their ids.
+
+    Nodes must be added in tree order, each after its parent. A node's row is
+    only inserted once all its descendants have been added, when its `rght`
+    is known. The first node may be a root, or the child of a node already in
+    the database, in which case the new subtree is numbered as its last. Only
+    the ranges of that node and its ancestors are widened, so no node of its
+    tree may come after it in tree order, as with the root of a shard's
+    template database; a ValueError is raised otherwise.
+
+    The database is locked for writing until the writer is closed, so the
+    ORM must not write to it meanwhile.
+    """
+
+    def __init__(self, path=None, batch_size=WRITE_BATCH_SIZE):
+        if path is None:
+            path = connections[get_active_content_database()].settings_dict["NAME"]
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("BEGIN")
+
+        self.nodes = Table(kolibrimodels.ContentNode)
+        self.tables = [
+            Table(kolibrimodels.Language, "INSERT OR IGNORE"),
+            Table(kolibrimodels.LocalFile, "INSERT OR IGNORE"),
+            Table(kolibrimodels.ContentTag, "INSERT OR IGNORE"),
+            self.nodes,
+            Table(kolibrimodels.File),
+            Table(kolibrimodels.AssessmentMetaData),
+        ]
+        self.languages, self.local_files, self.tags, _, self.files, self.assessment_metadata = self.tables
+        self.node_tags = Table(kolibrimodels.ContentNode.tags.through)
+        self.tables.append(self.node_tags)
+
+        self.licenses = {}
+        self.added_languages = set()
+        self.added_tags = set()
+        # The nodes whose descendants are still being added, from the root.
+        self.open_nodes = []
+        self.next_lft = None
+        # The node already in the database that new nodes are added under.
+        self.attached = None
+
+    def add_license(self, license_name, license_description):
+        key = (license_name, license_description)
+        if key not in self.licenses:
+            table = kolibrimodels.License._meta.db_table
+            row = self.cursor.execute(
+                "SELECT id FROM {} WHERE license_name = ? AND license_description IS ?".format(table), key,
+            ).fetchone()
+            if row is None:
+                self.cursor.execute(
+                    "INSERT INTO {} (license_name, license_description) VALUES (?, ?)".format(table), key)
+                self.licenses[key] = self.cursor.lastrowid
+            else:
+                self.licenses[key] = row[0]
+        return self.licenses[key]
+
+    def add_language(self, fields):
+        if fields["id"] not in self.added_languages:
+            self.added_languages.add(fields["id"])
+            self._add(self.languages, fields)
+        return fields["id"]
+
+    def add_node(self, fields):
+        parent_id = fields["parent_id"]
+        while self.open_nodes and self.open_nodes[-1]["id"] != parent_id:
+            self._close_node()
+        fields = dict(fields)
+        if self.open_nodes:
+            parent = self.open_nodes[-1]
+            fields.update(tree_id=parent["tree_id"], level=parent["level"] + 1)
+        else:
+            self._finish_attached()
+            fields.update(self._start_tree(parent_id))
+        fields["lft"] = self.next_lft
+        self.next_lft += 1
+        self.open_nodes.append(fields)
+        return fields["id"]
+
+    def add_assessment_metadata(self, node, fields):
+        self._add(self.assessment_metadata, dict(fields, contentnode_id=node))
+
+    def add_file(self, node, local_file_fields, file_fields):
+        self._add(self.local_files, local_file_fields)
+        self._add(self.files, dict(file_fields, contentnode_id=node, local_file_id=local_file_fields["id"]))
+
+    def set_tags(self, node, tags):
+        tag_ids = []
+        for tag_id, tag_name in tags:
+            if tag_name not in self.added_tags:
+                self.added_tags.add(tag_name)
+                self._add(self.tags, {"id": tag_id, "tag_name": tag_name})
+            if tag_id not in tag_ids:
+                tag_ids.append(tag_id)
+        for tag_id in tag_ids:
+            self._add(self.node_tags, {"contentnode_id": node, "contenttag_id": tag_id})
+
+    def close(self):
+        """
+        Inserts the remaining rows and commits them, or rolls everything back
+        if that fails.
+        """
+        try:
+            while self.open_nodes:
+                self._close_node()
+            self._finish_attached()
+            self.flush()
+            self.cursor.execute("COMMIT")
+        finally:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Closing the connection rolls back everything written.
+            self.connection.close()
+
+    def flush(self):
+        for table in self.tables:
+            table.flush(self.cursor)
+
+    def _add(self, table, fields):
+        table.add(fields)
+        if len(table.rows) >= self.batch_size:
+            table.flush(self.cursor)
+
+    def _close_node(self):
+        fields = self.open_nodes.pop()
+        fields["rght"] = self.next_lft
+        self.next_lft += 1
+        self._add(self.nodes, fields)
+
+    def _start_tree(self, parent_id):
+        table = kolibrimodels.ContentNode._meta.db_table
+        if parent_id is None:
+            self.next_lft = 1
+            tree_id = self.cursor.execute("SELECT COALESCE(MAX(tree_id), 0) FROM {}".format(table)).fetchone()[0]
+            return {"tree_id": tree_id + 1, "level": 0}
+        self.flush()
+        row = self.cursor.execute(
+            "SELECT lft, rght, tree_id, level FROM {} WHERE id = ?".format(table), [convert_uuid(parent_id)],
+        ).fetchone()
+        if row is None:
+            raise ValueError("The parent {} of the first node is not in the database".format(parent_id))
+        lft, rght, tree_id, level = row
+        following = self.cursor.execute(
+            "SELECT COUNT(*) FROM {} WHERE tree_id = ? AND lft > ?".format(table), [tree_id, rght],
+        ).fetchone()[0]
+        if following:
+            raise ValueError(
+                "Nodes can only be added under {} if no node of its tree comes after it, "
+                "but {} nodes do".format(parent_id, following))
+        self.attached = (lft, rght, tree_id)
+        self.next_lft = rght
+        return {"tree_id": tree_id, "level": level + 1}
+
+    def _finish_attached(self):
+        """
+        Widens the ranges of the node the added subtree is under and of its
+        ancestors to cover it. As no node follows them, nothing else moves.
+        """
+        if self.attached is None:
+            return
+        lft, rght, tree_id = self.attached
+        self.attached = None
+        self.cursor.execute(
+            "UPDATE {} SET rght = rght + ? WHERE tree_id = ? AND lft <= ? AND rght >= ?".format(
+                kolibrimodels.ContentNode._meta.db_table),
+            [self.next_lft - rght, tree_id, lft, rght],
+        )
@@ -0,0 +1,94 @@
+import collections
+import copy
+import threading
+import time
+
+
+def normalize_query(query):
+    """
+    Collapses whitespace so trivially different spellings of a query share a
+    cache entry. Case is kept, as the query parser treats AND/OR/NOT specially.
+    """
+    return " ".join(query.split())
+
+
+def freeze(value):
+    """
+    Turns filter dicts and lists into hashable tuples for use in cache keys.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(freeze(item) for item in value))
+    return value
+
+
+class ResultCache:
+    """
+    LRU cache of search results. Each entry remembers the versions of the
+    indexes it was computed from (see searchers.get_index_version) and is only
+    returned while those versions are unchanged, so results are invalidated as
+    soon as any involved index is committed to. Entries older than `ttl`
+    seconds, if given, are also dropped.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    def get(self, key, versions):
+        """
+        Returns a copy of the cached value for `key`, or None if there is no
+        entry computed from these index `versions`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, stored_versions, value = entry
+                if stored_versions != versions:
+                    del self._entries[key]
+                    self.invalidations += 1
+                elif self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    # Callers get their own copy, so changes to it cannot leak
+                    # into later hits.
+                    return copy.deepcopy(value)
+            self.misses += 1
+            return None
+
+    def put(self, key, versions, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), versions, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "expirations": self.expirations,
+            }
@@ -1,8 +1,42 @@
+import codecs
+import logging
 import os
+import posixpath
 import zipfile
+from html.parser import HTMLParser
+from urllib.parse import unquote
+from xml.etree import ElementTree
 
 import PyPDF2
-from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+logger = logging.getLogger(__name__)
+
+HTML_EXTENSIONS = (".htm", ".html", ".xhtml")
+SKIPPED_HTML_TAGS = frozenset(["script", "style", "noscript", "template"])
+# Elements that break the flow of text, so words either side of their tags
+# are separate. Text split by any other tag, or by a read boundary, is joined
+# as it is, so that `Hel<b>lo</b>` stays one word.
+BLOCK_HTML_TAGS = frozenset([
+    "address", "article", "aside", "blockquote", "body", "br", "caption", "dd",
+    "details", "dialog", "div", "dl", "dt", "fieldset", "figcaption", "figure",
+    "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "head", "header", "hr",
+    "html", "img", "li", "main", "nav", "ol", "option", "p", "pre", "section",
+    "summary", "table", "tbody", "td", "tfoot", "th", "thead", "title", "tr", "ul",
+])
+# Members larger than this are almost always bundled data or media
+# mislabelled as HTML, and parsing them costs far more than they give back.
+MAX_HTML_MEMBER_SIZE = 5 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+EPUB_CONTAINER_PATH = "META-INF/container.xml"
+EPUB_CONTAINER_NS = "urn:oasis:names:tc:opendocument:xmlns:container"
+EPUB_OPF_NS = "http://www.idpf.org/2007/opf"
+EPUB_DOCUMENT_TYPES = ("application/xhtml+xml", "text/html")
 
 
 def get_pdf_text(filename):
@@ -18,28 +52,225 @@ def get_pdf_text(filename):
     return text
 
 
+class _TextCollector:
+    """
+    Parser target that gathers character data, skipping anything inside
+    script, style and similar non-visible elements.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.skip_depth = 0
+
+    def start(self, tag, attrib=None):
+        name = _local_name(tag)
+        if name in SKIPPED_HTML_TAGS:
+            self.skip_depth += 1
+        elif name in BLOCK_HTML_TAGS:
+            self.parts.append(" ")
+
+    def end(self, tag):
+        name = _local_name(tag)
+        if self.skip_depth and name in SKIPPED_HTML_TAGS:
+            self.skip_depth -= 1
+        elif name in BLOCK_HTML_TAGS:
+            self.parts.append(" ")
+
+    def data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return " ".join("".join(self.parts).split())
+
+
+class _StdlibHTMLParser(HTMLParser):
+    """
+    Adapts the stdlib streaming HTMLParser to the lxml parser target interface,
+    used when lxml is not installed.
+    """
+
+    def __init__(self, target):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.target = target
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+        HTMLParser.feed(self, data)
+
+    def close(self):
+        HTMLParser.feed(self, self.decoder.decode(b"", final=True))
+        HTMLParser.close(self)
+        return self.target.close()
+
+
+def _local_name(tag):
+    if not isinstance(tag, str):
+        return ""
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def _create_parser(xhtml=False):
+    """
+    Returns a streaming parser, and the _TextCollector it sends the text to.
+    """
+    target = _TextCollector()
+    if etree is None:
+        return _StdlibHTMLParser(target), target
+    if xhtml:
+        return etree.XMLParser(target=target, recover=True, resolve_entities=False), target
+    return etree.HTMLParser(target=target), target
+
+
+def _close_parser(parser, target, name):
+    try:
+        return parser.close() or ""
+    except Exception as e:
+        # lxml raises on documents it could not make sense of, such as
+        # truncated ones; keep the text gathered before that.
+        logger.debug("Unable to parse {}: {}".format(name, e))
+        return target.close()
+
+
+def _looks_binary(chunk):
+    return b"\x00" in chunk[:1024]
+
+
+def get_text_from_html(content, xhtml=False):
+    """
+    Returns the visible text of an HTML document, given as bytes or a string.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if not content.strip() or _looks_binary(content):
+        return ""
+    parser, target = _create_parser(xhtml=xhtml)
+    parser.feed(content)
+    return _close_parser(parser, target, "HTML document")
+
+
+def _get_member_text(zf, info, xhtml=False):
+    if info.file_size > MAX_HTML_MEMBER_SIZE:
+        logger.debug(
+            "Skipping {}, {} bytes is over the size limit".format(
+                info.filename, info.file_size
+            )
+        )
+        return ""
+
+    parser = None
+    with zf.open(info) as member:
+        for chunk in iter(lambda: member.read(READ_CHUNK_SIZE), b""):
+            if parser is None:
+                if _looks_binary(chunk):
+                    logger.debug("Skipping binary member {}".format(info.filename))
+                    return ""
+                parser, target = _create_parser(xhtml=xhtml)
+            parser.feed(chunk)
+
+    if parser is None:
+        return ""
+    return _close_parser(parser, target, info.filename)
+
+
+def _join_text(texts):
+    return " ".join(text for text in texts if text)
+
+
 def get_text_from_zip(filename):
-    text = ""
-    zip = zipfile.ZipFile(filename)
-    files = zip.namelist()
-    for afile in files:
-        name_parts = os.path.splitext(afile)
-        if len(name_parts) > 1 and name_parts[1].startswith(".htm"):
-            content = zip.read(afile)
-            text += BeautifulSoup(content).get_text()
+    with zipfile.ZipFile(filename) as zf:
+        texts = []
+        for info in zf.infolist():
+            ext = os.path.splitext(info.filename)[1].lower()
+            if ext in HTML_EXTENSIONS:
+                texts.append(_get_member_text(zf, info, xhtml=ext == ".xhtml"))
 
-    return text
+    return _join_text(texts)
 
 
-def get_text_for_files(node):
+def get_epub_spine(zf):
+    """
+    Returns the ZipInfo of each document in the EPUB's reading order, following
+    the spine of the package document. Returns None if the zip has no usable
+    package document.
+    """
+    try:
+        container = ElementTree.fromstring(zf.read(EPUB_CONTAINER_PATH))
+        rootfile = container.find(
+            ".//{{{ns}}}rootfile".format(ns=EPUB_CONTAINER_NS)
+        )
+        opf_path = rootfile.get("full-path")
+        package = ElementTree.fromstring(zf.read(opf_path))
+    except (KeyError, AttributeError, ElementTree.ParseError):
+        return None
+
+    opf_dir = posixpath.dirname(opf_path)
+    manifest = {}
+    for item in package.iterfind(".//{{{ns}}}manifest/{{{ns}}}item".format(ns=EPUB_OPF_NS)):
+        manifest[item.get("id")] = (item.get("href"), item.get("media-type"))
+
+    spine = []
+    seen = set()
+    for itemref in package.iterfind(".//{{{ns}}}spine/{{{ns}}}itemref".format(ns=EPUB_OPF_NS)):
+        href, media_type = manifest.get(itemref.get("idref"), (None, None))
+        if not href or media_type not in EPUB_DOCUMENT_TYPES:
+            continue
+        path = posixpath.normpath(posixpath.join(opf_dir, unquote(href.split("#")[0])))
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            spine.append((zf.getinfo(path), media_type))
+        except KeyError:
+            logger.debug("Spine item {} missing from {}".format(path, zf.filename))
+
+    return spine
+
+
+def get_text_from_epub(filename):
+    with zipfile.ZipFile(filename) as zf:
+        spine = get_epub_spine(zf)
+        if spine is None:
+            logger.warning("No EPUB package document in {}".format(filename))
+            return get_text_from_zip(filename)
+        texts = [
+            _get_member_text(zf, info, xhtml=media_type == "application/xhtml+xml")
+            for info, media_type in spine
+        ]
+
+    return _join_text(texts)
+
+
+def get_text_for_filenames(filenames):
     text = ""
-    for afile in node.files.all():
-        filename = afile.local_file.get_file_on_disk()
+    for filename in filenames:
         if not os.path.exists(filename):
             continue
         ext = os.path.splitext(filename)[1]
         if ext == ".pdf":
             text += get_pdf_text(filename)
-        elif ext in [".zip", ".epub"]:
+        elif ext == ".zip":
             text += get_text_from_zip(filename)
+        elif ext == ".epub":
+            text += get_text_from_epub(filename)
     return text
+
+
+def get_text_for_files(node):
+    return get_text_for_filenames(
+        afile.local_file.get_file_on_disk() for afile in node.files.all()
+    )
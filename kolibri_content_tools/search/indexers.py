@@ -1,3 +1,4 @@
+import collections
 import logging
 
 import whoosh.fields as fields
@@ -8,30 +9,150 @@ from . import converters
 
 logger = logging.getLogger(__name__)
 
+# Kept below SQLite's default limit of 999 variables per query, as each chunk
+# of node ids is passed as the parameters of an IN clause.
+BULK_CHUNK_SIZE = 500
+CONTENT_KINDS = [content_kinds.DOCUMENT, content_kinds.HTML5]
+# Name of the single index holding every channel, in shared index mode.
+SHARED_INDEX_NAME = "all_channels"
+# Word prefixes of titles and tags between these lengths are indexed for
+# type-ahead suggestions.
+COMPLETION_MIN_SIZE = 2
+COMPLETION_MAX_SIZE = 15
+
 node_schema = fields.Schema(
     node_id=fields.ID(stored=True, field_boost=5.0),
     content_id=fields.ID(stored=True, field_boost=5.0),
-    channel_id=fields.STORED(),
+    channel_id=fields.ID(stored=True),
     parent_id=fields.STORED(),
-    languages=fields.KEYWORD(lowercase=True, scorable=True, stored=True),
+    kind=fields.ID(stored=True),
+    coach_content=fields.BOOLEAN(stored=True),
+    languages=fields.KEYWORD(lowercase=True, commas=True, scorable=True, stored=True),
     title=fields.TEXT(stored=True, field_boost=1.5),
     description=fields.TEXT(stored=True),
     thumbnail=fields.STORED(),
-    tags=fields.KEYWORD(lowercase=True, scorable=True, field_boost=1.5),
+    tags=fields.KEYWORD(lowercase=True, commas=True, scorable=True, field_boost=1.5),
     content=fields.TEXT(stored=False),
+    completion=fields.NGRAMWORDS(
+        minsize=COMPLETION_MIN_SIZE, maxsize=COMPLETION_MAX_SIZE, at="start"
+    ),
+)
+
+# Lightweight stand-in for a ContentNode, with only the fields the indexer reads.
+IndexNode = collections.namedtuple(
+    "IndexNode",
+    [
+        "id",
+        "tree_id",
+        "lft",
+        "parent_id",
+        "content_id",
+        "kind",
+        "title",
+        "description",
+        "lang_id",
+        "coach_content",
+    ],
 )
 
 
+def iter_channel_nodes(channel_id, include_files=True, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Yields (node, tag_names, filenames) for every node in the channel, in tree
+    order, using a handful of bulk queries per chunk of nodes rather than several
+    queries per node. Must be called within `using_content_database`.
+    """
+    # Imported here so the search tools can be used without configuring Django.
+    from django.db.models import Q
+    from kolibri_content import models as kolibrimodels
+
+    tag_model = kolibrimodels.ContentNode.tags.through
+    after = Q()
+    while True:
+        nodes = [
+            IndexNode._make(row)
+            for row in kolibrimodels.ContentNode.objects.filter(after, channel_id=channel_id)
+            .order_by("tree_id", "lft")
+            .values_list(*IndexNode._fields)[:chunk_size]
+        ]
+        if not nodes:
+            break
+        # Pages on (tree_id, lft), as a database may hold more than one tree.
+        last = nodes[-1]
+        after = Q(tree_id__gt=last.tree_id) | Q(tree_id=last.tree_id, lft__gt=last.lft)
+
+        tags = collections.defaultdict(list)
+        for node_id, tag_name in tag_model.objects.filter(
+            contentnode_id__in=[node.id for node in nodes]
+        ).values_list("contentnode_id", "contenttag__tag_name"):
+            tags[node_id].append(tag_name)
+
+        filenames = collections.defaultdict(list)
+        content_node_ids = [node.id for node in nodes if node.kind in CONTENT_KINDS]
+        if include_files and content_node_ids:
+            for node_id, checksum, extension in kolibrimodels.File.objects.filter(
+                contentnode_id__in=content_node_ids
+            ).values_list("contentnode_id", "local_file_id", "local_file__extension"):
+                filenames[node_id].append(
+                    kolibrimodels.get_content_storage_file_path(
+                        "{}.{}".format(checksum, extension)
+                    )
+                )
+
+        for node in nodes:
+            yield node, tags[node.id], filenames[node.id]
+
+
+def open_shared_index(index_root):
+    if whoosh.index.exists_in(index_root, indexname=SHARED_INDEX_NAME):
+        return whoosh.index.open_dir(index_root, indexname=SHARED_INDEX_NAME)
+    return whoosh.index.create_in(
+        index_root, node_schema, indexname=SHARED_INDEX_NAME
+    )
+
+
+def remove_channel_from_shared_index(index_root, channel_id):
+    """
+    Deletes every document of the channel from the shared index, returning the
+    number of documents removed.
+    """
+    if not whoosh.index.exists_in(index_root, indexname=SHARED_INDEX_NAME):
+        return 0
+    writer = open_shared_index(index_root).writer()
+    removed = writer.delete_by_term("channel_id", channel_id)
+    writer.commit()
+    logger.info("Removed {} documents of {}".format(removed, channel_id))
+    return removed
+
+
 class ChannelIndexer:
-    def __init__(self, channel, index_root):
-        index_name = "channel_{}".format(channel.id)
+    """
+    Writes a channel's nodes to its own `channel_{id}` index, or with
+    shared=True to the single index shared by all channels, where indexing a
+    channel replaces any documents it already had there.
+    """
+
+    def __init__(self, channel, index_root, shared=False):
         self.channel = channel
-        self.channel_index = whoosh.index.create_in(
-            index_root, node_schema, indexname=index_name
-        )
+        self.shared = shared
+        if shared:
+            self.channel_index = open_shared_index(index_root)
+        else:
+            index_name = "channel_{}".format(channel.id)
+            self.channel_index = whoosh.index.create_in(
+                index_root, node_schema, indexname=index_name
+            )
+
+    def _get_writer(self):
+        writer = self.channel_index.writer()
+        if self.shared:
+            # Deleted in the same commit as the new documents are added, so
+            # searches never see the channel missing or duplicated.
+            writer.delete_by_term("channel_id", self.channel.id)
+        return writer
 
     def index_nodes(self, nodes):
-        self.writer = self.channel_index.writer()
+        self.writer = self._get_writer()
         logger.info("Indexing {}".format(self.channel.name))
         node_count = self.channel.root.get_descendant_count()
         counter = 0
@@ -42,11 +163,54 @@ class ChannelIndexer:
 
         self.writer.commit()
 
-    def index_node(self, node):
+    def index_channel(self, alias, include_content=True, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Indexes every node of the channel stored in the content database `alias`,
+        loading nodes, tags and files in bulk. Pass include_content=False to only
+        index the metadata fields, skipping text extraction from files.
+        """
+        from kolibri_content.router import using_content_database
+
+        with using_content_database(alias):
+            return self.index_rows(
+                iter_channel_nodes(
+                    self.channel.id,
+                    include_files=include_content,
+                    chunk_size=chunk_size,
+                ),
+                include_content=include_content,
+                log_every=chunk_size,
+            )
+
+    def index_rows(self, rows, include_content=True, log_every=BULK_CHUNK_SIZE):
+        """
+        Indexes (node, tag_names, filenames) rows, as yielded by
+        `iter_channel_nodes`, in a single commit. Returns the number of nodes
+        indexed.
+        """
+        logger.info("Indexing {}".format(self.channel.name))
+        self.writer = self._get_writer()
+        counter = 0
+        for node, tags, filenames in rows:
+            self.index_node(
+                node, tags=tags, filenames=filenames, include_content=include_content
+            )
+            counter += 1
+            if counter % log_every == 0:
+                logger.info("Indexed {} nodes.".format(counter))
+
+        logger.info("Committing {} nodes.".format(counter))
+        self.writer.commit()
+        return counter
+
+    def index_node(self, node, tags=None, filenames=None, include_content=True):
         content = ""
-        if node.kind != content_kinds.TOPIC:
-            if node.kind in [content_kinds.DOCUMENT, content_kinds.HTML5]:
-                content = converters.get_text_for_files(node)
+        if include_content and node.kind != content_kinds.TOPIC:
+            if node.kind in CONTENT_KINDS:
+                if filenames is None:
+                    content = converters.get_text_for_files(node)
+                else:
+                    content = converters.get_text_for_filenames(filenames)
                 if len(content) == 0:
                     logger.warning(
                         "No content for {}, {}".format(node.title, node.kind)
@@ -56,14 +220,21 @@ class ChannelIndexer:
                         "Content added for {}, {}".format(node.title, node.kind)
                     )
 
+        if tags is None:
+            tags = node.tags.values_list("tag_name", flat=True)
+        tags = list(tags)
+
         self.writer.add_document(
             node_id=node.id,
             channel_id=self.channel.id,
             content_id=node.content_id,
             parent_id=node.parent_id,
+            kind=node.kind,
+            coach_content=node.coach_content,
             title=node.title,
             description=node.description,
-            tags=",".join(node.tags.values_list("tag_name", flat=True)),
-            languages=",".join([node.lang_id]),
+            tags=",".join(tags),
+            languages=node.lang_id or "",
             content=content,
+            completion=" ".join([node.title] + tags),
         )
@@ -1,88 +1,718 @@
-import glob
+import collections
+import contextlib
+import heapq
+import itertools
 import logging
 import os
+import re
+import threading
 import time
 
 import whoosh
+import whoosh.index
 from concurrent import futures
+from whoosh import sorting
+from whoosh.analysis import LowercaseFilter
+from whoosh.analysis import RegexTokenizer
+from whoosh.fields import BOOLEAN
 from whoosh.qparser import MultifieldParser
 from whoosh.qparser import QueryParser
+from whoosh.query import And
+from whoosh.query import Or
+from whoosh.query import Query
+from whoosh.query import Term
+
+from .cache import freeze
+from .cache import normalize_query
+from .cache import ResultCache
+from .indexers import COMPLETION_MAX_SIZE
+from .indexers import COMPLETION_MIN_SIZE
+from .indexers import SHARED_INDEX_NAME
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SEARCH_FIELDS = [
+    "node_id",
+    "content_id",
+    "title",
+    "description",
+    "tags",
+    "content",
+]
+# Fields that searches can be filtered and faceted on.
+FILTER_FIELDS = ["kind", "languages", "channel_id", "coach_content"]
+MAX_OPEN_INDEXES = 64
+SEARCH_WORKERS = 5
+SUGGESTION_LIMIT = 10
+
+# Splits a suggestion prefix into words the same way titles are indexed.
+suggestion_analyzer = RegexTokenizer() | LowercaseFilter()
+
+INDEX_TOC_RE = re.compile(r"^_(?P<name>.+)_(?P<generation>\d+)\.toc$")
+
+# IndexSearcher for the current worker process, when searching with processes.
+_worker_searcher = None
+
+
+def get_index_version(index):
+    """
+    Returns a value that changes whenever the index is committed to. The TOC
+    modification time is included because re-creating an index with
+    `create_in` starts its generation count from zero again.
+    """
+    return index.latest_generation(), index.last_modified()
+
+
+class _OpenIndex:
+    """
+    An open index, together with the searcher and query parsers built for it,
+    kept around so they can be reused across queries. Whoosh searchers are not
+    safe to use from several threads at once, so access goes through `lock`.
+    Freshness is checked against a version read by the caller, so a query
+    scans the index directory once rather than once per index.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.version = get_index_version(index)
+        self.searcher = index.searcher()
+        self.parsers = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def is_current(self, version):
+        return version == self.version
+
+    def get_parser(self, field=None):
+        parser = self.parsers.get(field)
+        if parser is None:
+            if field:
+                parser = QueryParser(field, self.searcher.schema)
+            else:
+                parser = MultifieldParser(DEFAULT_SEARCH_FIELDS, self.searcher.schema)
+            self.parsers[field] = parser
+        return parser
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.searcher.close()
+
+
+def build_filter_query(filters):
+    """
+    Builds a whoosh query from a dict mapping fields in FILTER_FIELDS to a value
+    or list of values. Hits must match one of the values of every field given.
+    """
+    subqueries = []
+    for field, values in sorted((filters or {}).items()):
+        if field not in FILTER_FIELDS:
+            raise ValueError("Cannot filter search results on {}".format(field))
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        subqueries.append(Or([Term(field, value) for value in values]))
+    if not subqueries:
+        return None
+    return And(subqueries)
+
+
+def _combine_filter_queries(*filter_queries):
+    filter_queries = [q for q in filter_queries if q is not None]
+    if not filter_queries:
+        return None
+    if len(filter_queries) == 1:
+        return filter_queries[0]
+    return And(filter_queries)
+
+
+def _facet_key(key, field):
+    if isinstance(key, bytes):
+        key = key.decode("utf-8")
+    if isinstance(field, BOOLEAN):
+        # Boolean facets are keyed on the indexed "t"/"f" terms.
+        return key in ("t", True)
+    return key
+
+
+def _get_location(result):
+    return {"channel_id": result.get("channel_id"), "node_id": result.get("node_id")}
+
+
+def merge_results(result_lists, offset=0, limit=None, dedup_by="node_id"):
+    """
+    Merges per-index result lists, each sorted best first, into one page of
+    results. Duplicates are detected with a dict keyed on `dedup_by`, and each
+    kept hit collects the locations of the copies collapsed into it. Hits past
+    the end of the page are still scanned, so the kept hits list the locations
+    of all of their copies in `result_lists`.
+    """
+    stop = None if limit is None else offset + limit
+    kept = {}
+    unkeyed = 0
+    for result in heapq.merge(*result_lists, key=lambda x: -x["score"]):
+        key = result.get(dedup_by) if dedup_by else None
+        if key is not None:
+            hit = kept.get(key)
+            if hit is not None:
+                hit["locations"].append(_get_location(result))
+                continue
+        if stop is not None and len(kept) >= stop:
+            continue
+        if key is None:
+            # Nothing to dedupe on, so give the hit a key no other can share.
+            key = (None, unkeyed)
+            unkeyed += 1
+        result["locations"] = [_get_location(result)]
+        kept[key] = result
+
+    return list(itertools.islice(kept.values(), offset, stop))
+
+
+def get_lists_to_deepen(result_lists, limits, stop, dedup_by):
+    """
+    Returns the positions of the result lists that were cut off at their limit
+    and may still hold hits belonging among the first `stop` merged hits once
+    duplicates are collapsed: those whose last hit scores at least as well as
+    the stop-th distinct hit of the merge, or all of them if there are fewer
+    distinct hits than that.
+    """
+    threshold = None
+    seen = set()
+    distinct = 0
+    for result in heapq.merge(*result_lists, key=lambda x: -x["score"]):
+        key = result.get(dedup_by)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        distinct += 1
+        if distinct == stop:
+            threshold = result["score"]
+            break
+    return [
+        position
+        for position, results in enumerate(result_lists)
+        if len(results) >= limits[position]
+        and (threshold is None or results[-1]["score"] >= threshold)
+    ]
+
+
+def _init_worker(index_root, max_open_indexes):
+    global _worker_searcher
+    _worker_searcher = IndexSearcher(index_root, max_open_indexes=max_open_indexes)
+
+
+def _search_index_in_worker(query, index_name, **kwargs):
+    return _worker_searcher._search_index(query, index_name, **kwargs)
+
 
 class IndexSearcher:
-    def __init__(self, index_root):
+    """
+    Searches the channel indexes in `index_root`. Instances are meant to be
+    long-lived: open searchers are cached between queries, and `search` runs
+    across channels on a worker pool that is created once and reused. Threads
+    are used by default; with use_processes=True each worker process keeps its
+    own warm searchers. Call `close` (or use as a context manager) to shut the
+    pool down and release open indexes.
+
+    With shared=True, searches go to the single index shared by all channels
+    (see ChannelIndexer), and searching one channel filters on channel_id.
+
+    Set cache_size to keep that many pages of results in a ResultCache, which
+    drops entries as soon as any index they came from changes, or after
+    cache_ttl seconds if given. See `cache_stats` for its hit rate.
+    """
+
+    def __init__(
+        self,
+        index_root,
+        max_open_indexes=MAX_OPEN_INDEXES,
+        max_workers=SEARCH_WORKERS,
+        use_processes=False,
+        shared=False,
+        cache_size=0,
+        cache_ttl=None,
+    ):
         self.index_root = index_root
+        self.max_open_indexes = max_open_indexes
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.shared = shared
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.result_cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+        self._open_indexes = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
 
-    def search_channel(self, query, channel_id):
-        return self.search_index(query, "channel_{}".format(channel_id))
-
-    def search_index(self, query, index_name, field=None):
-        root = self.index_root
-        logger.info("Root = {}".format(root))
-        index = whoosh.index.open_dir(root, indexname=index_name)
-
-        with index.searcher() as searcher:
-            default_fields = [
-                "node_id",
-                "content_id",
-                "title",
-                "description",
-                "tags",
-                "content",
-            ]
-            parser = MultifieldParser(default_fields, index.schema)
-            if field:
-                parser = QueryParser("content", index.schema)
-            whoosh_query = parser.parse(query)
+    def __getstate__(self):
+        # Open searchers, locks and the worker pool stay with this process.
+        return {
+            "index_root": self.index_root,
+            "max_open_indexes": self.max_open_indexes,
+            "max_workers": self.max_workers,
+            "use_processes": self.use_processes,
+            "shared": self.shared,
+            "cache_size": self.cache_size,
+            "cache_ttl": self.cache_ttl,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            open_indexes = list(self._open_indexes.values())
+            self._open_indexes.clear()
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for open_index in open_indexes:
+            open_index.close()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.use_processes:
+                    self._executor = futures.ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        initializer=_init_worker,
+                        initargs=(self.index_root, self.max_open_indexes),
+                    )
+                else:
+                    self._executor = futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers
+                    )
+            return self._executor
+
+    def _submit_search(self, query, index_name, **kwargs):
+        executor = self._get_executor()
+        if self.use_processes:
+            return executor.submit(_search_index_in_worker, query, index_name, **kwargs)
+        return executor.submit(self._search_index, query, index_name, **kwargs)
+
+    def get_index_versions(self):
+        """
+        Returns the version (see get_index_version) of every index in
+        `index_root`, keyed by index name, from a single directory scan.
+        """
+        versions = {}
+        for entry in os.scandir(self.index_root):
+            match = INDEX_TOC_RE.match(entry.name)
+            if not match:
+                continue
+            name = match.group("name")
+            generation = int(match.group("generation"))
+            if name not in versions or generation > versions[name][0]:
+                versions[name] = (generation, entry.stat().st_mtime)
+        return versions
+
+    def get_index_names(self, versions=None):
+        """
+        Returns the names of the per-channel indexes in `index_root`, or just the
+        shared index in shared mode.
+        """
+        if self.shared:
+            return [SHARED_INDEX_NAME]
+        if versions is None:
+            versions = self.get_index_versions()
+        return sorted(name for name in versions if name != SHARED_INDEX_NAME)
+
+    def _select_indexes(self, versions, filters):
+        """
+        Returns the names of the indexes to search given `filters`, and the
+        filters left to apply within them. Per-channel indexes are picked by
+        name rather than filtered, as indexes built before channel_id was
+        indexed cannot be filtered on it.
+        """
+        index_names = self.get_index_names(versions)
+        channel_ids = (filters or {}).get("channel_id")
+        if channel_ids is None or self.shared:
+            return index_names, filters
+        if not isinstance(channel_ids, (list, tuple, set, frozenset)):
+            channel_ids = [channel_ids]
+        wanted = set("channel_{}".format(channel_id) for channel_id in channel_ids)
+        index_names = [name for name in index_names if name in wanted]
+        filters = {k: v for k, v in filters.items() if k != "channel_id"}
+        return index_names, filters
+
+    def cache_stats(self):
+        if self.result_cache is None:
+            return None
+        return self.result_cache.stats()
+
+    def _cached(self, key, index_names, versions, compute):
+        """
+        Returns compute(), going through the result cache if there is one. The
+        entry is tied to the current versions of `index_names`.
+        """
+        if self.result_cache is None:
+            return compute()
+        index_versions = tuple((name, versions.get(name)) for name in index_names)
+        value = self.result_cache.get(key, index_versions)
+        if value is None:
+            value = compute()
+            self.result_cache.put(key, index_versions, value)
+        return value
+
+    def warm_up(self):
+        """
+        Opens every index in `index_root` ahead of the first query. Only warms
+        this process; with use_processes=True workers warm up on first use.
+        """
+        versions = self.get_index_versions()
+        for index_name in self.get_index_names(versions):
+            self._get_open_index(index_name, versions.get(index_name))
+
+    def _get_open_index(self, index_name, version=None):
+        """
+        Returns the cached open index for `index_name`, opening it, or reopening
+        it if its current `version` (see get_index_versions, which is read if
+        not given) is not the one it was opened at.
+        """
+        if version is None:
+            version = self.get_index_versions().get(index_name)
+        to_close = []
+        with self._lock:
+            open_index = self._open_indexes.pop(index_name, None)
+            if open_index is not None and not open_index.is_current(version):
+                logger.debug("Index {} has changed, reopening".format(index_name))
+                to_close.append(open_index)
+                open_index = None
+            if open_index is None:
+                index = whoosh.index.open_dir(self.index_root, indexname=index_name)
+                open_index = _OpenIndex(index)
+            self._open_indexes[index_name] = open_index
+            while len(self._open_indexes) > self.max_open_indexes:
+                to_close.append(self._open_indexes.popitem(last=False)[1])
+
+        for stale in to_close:
+            stale.close()
+        return open_index
+
+    @contextlib.contextmanager
+    def open_index(self, index_name, version=None):
+        """
+        Context manager giving exclusive use of the cached open index for
+        `index_name` for the duration of the block.
+        """
+        while True:
+            open_index = self._get_open_index(index_name, version)
+            with open_index.lock:
+                # Another thread may have evicted and closed it in the meantime.
+                if open_index.closed:
+                    continue
+                yield open_index
+                return
+
+    def search_channel(
+        self, query, channel_id, limit=None, offset=0, fields=None, filters=None
+    ):
+        if self.shared:
+            index_name = SHARED_INDEX_NAME
+            filters = dict(filters or {}, channel_id=channel_id)
+        else:
+            index_name = "channel_{}".format(channel_id)
+        versions = self.get_index_versions()
+
+        def compute():
+            results, _ = self._search_index(
+                query,
+                index_name,
+                limit=None if limit is None else offset + limit,
+                fields=fields,
+                filter_query=build_filter_query(filters),
+                version=versions.get(index_name),
+            )
+            return results[offset:]
+
+        if self.result_cache is None:
+            return compute()
+        key = (
+            "channel",
+            normalize_query(query),
+            (channel_id,),
+            freeze(filters),
+            offset,
+            limit,
+            freeze(fields),
+        )
+        return self._cached(key, [index_name], versions, compute)
+
+    def search_index(
+        self, query, index_name, field=None, limit=None, fields=None, filter_query=None
+    ):
+        """
+        Returns the top `limit` hits (all hits if limit is None) for `query` as
+        dicts of their stored fields plus a score, best first. Pass `fields` to
+        only copy those stored fields into each dict, and `filter_query` to only
+        return hits that also match that whoosh query.
+        """
+        results, _ = self._search_index(
+            query,
+            index_name,
+            field=field,
+            limit=limit,
+            fields=fields,
+            filter_query=filter_query,
+        )
+        return results
+
+    def _search_index(
+        self,
+        query,
+        index_name,
+        field=None,
+        limit=None,
+        fields=None,
+        filter_query=None,
+        facets=None,
+        version=None,
+    ):
+        """
+        Implements search_index, also returning a dict of value counts over all
+        matching documents for each field in `facets`. Fields that the index's
+        schema lacks, as in indexes built before they were added, get no counts.
+        `query` may also be an already built whoosh query. Pass the `version`
+        of the index when already known, to save reading it again.
+        """
+        logger.debug("Root = {}".format(self.index_root))
+
+        with self.open_index(index_name, version) as open_index:
+            searcher = open_index.searcher
+            facet_fields = [name for name in facets or [] if name in searcher.schema]
+            groupedby = None
+            if facet_fields:
+                groupedby = {
+                    name: sorting.FieldFacet(
+                        name, allow_overlap=name == "languages", maptype=sorting.Count
+                    )
+                    for name in facet_fields
+                }
+            if isinstance(query, Query):
+                whoosh_query = query
+            else:
+                whoosh_query = open_index.get_parser(field).parse(query)
             start = time.time()
-            results = searcher.search(whoosh_query, terms=True, limit=None)
+            results = searcher.search(
+                whoosh_query, limit=limit, filter=filter_query, groupedby=groupedby
+            )
             elapsed = time.time() - start
             logger.debug("Search took {} seconds".format(elapsed))
 
-            # What terms matched in each hit?
-            logger.debug("num matched terms: {}".format(len(results)))
+            logger.debug("num matched: {}".format(len(results)))
             results_list = []
             for result in results:
-                result_dict = {}
-                for key in result.keys():
-                    result_dict[key] = result[key]
+                stored = result.fields()
+                if fields is None:
+                    result_dict = dict(stored)
+                else:
+                    result_dict = {key: stored[key] for key in fields if key in stored}
 
                 result_dict["score"] = result.score
                 results_list.append(result_dict)
-            return results_list
 
-    def search(self, query):
-        index_dirs = glob.glob("{}/_*.toc".format(self.index_root))
+            facet_counts = {name: {} for name in facets or []}
+            for name in facet_fields:
+                facet_counts[name] = {
+                    _facet_key(key, searcher.schema[name]): count
+                    for key, count in results.groups(name).items()
+                    if key is not None
+                }
+            return results_list, facet_counts
 
-        ex = futures.ProcessPoolExecutor(max_workers=5)
+    def _search_indexes(
+        self,
+        query,
+        limit=None,
+        offset=0,
+        fields=None,
+        dedup_by="node_id",
+        filters=None,
+        facets=None,
+    ):
+        versions = self.get_index_versions()
+        index_names, filters = self._select_indexes(versions, filters)
 
-        wait_for = []
-        for index_dir in index_dirs:
-            index_name = os.path.splitext(os.path.basename(index_dir))[0][1:-2]
-            logger.info("Adding {} to search indexes".format(index_name))
+        def compute():
+            return self._search_and_merge(
+                query,
+                index_names,
+                versions,
+                limit=limit,
+                offset=offset,
+                fields=fields,
+                dedup_by=dedup_by,
+                filters=filters,
+                facets=facets,
+            )
 
-            wait_for.append(ex.submit(self.search_index, query, index_name))
+        if self.result_cache is None:
+            return compute()
+        key = (
+            "search",
+            normalize_query(query),
+            tuple(index_names),
+            freeze(filters),
+            offset,
+            limit,
+            freeze(fields),
+            dedup_by,
+            freeze(facets),
+        )
+        return self._cached(key, index_names, versions, compute)
 
-        all_results = []
-        all_nodes = []
-        all_titles = []
-        for f in futures.as_completed(wait_for):
-            results = f.result()
-            logger.info("Num results = {}".format(len(results)))
-            for result in results:
-                logger.debug("Result keys = {}".format(result.keys()))
-                if "title" in result:
-                    if result["title"] in all_titles:
-                        logger.info("Found duplicate!")
-                        assert not result["node_id"]
+    def _search_and_merge(
+        self,
+        query,
+        index_names,
+        versions,
+        limit,
+        offset,
+        fields,
+        dedup_by,
+        filters,
+        facets,
+    ):
+        if fields is not None:
+            fields = list(fields)
+            for key in ("node_id", "channel_id", dedup_by):
+                if key and key not in fields:
+                    fields.append(key)
+        stop = None if limit is None else offset + limit
+        limits = [stop] * len(index_names)
+        filter_query = build_filter_query(filters)
+
+        # Kept in index order so ties between indexes break the same way every
+        # time.
+        result_lists = [None] * len(index_names)
+        facet_counts = {name: collections.Counter() for name in facets or []}
+        positions = range(len(index_names))
+        while positions:
+            wait_for = []
+            for position in positions:
+                logger.debug("Adding {} to search indexes".format(index_names[position]))
+                wait_for.append(
+                    self._submit_search(
+                        query,
+                        index_names[position],
+                        limit=limits[position],
+                        fields=fields,
+                        filter_query=filter_query,
+                        # Facets count every match, so the first search has them all.
+                        facets=facets if result_lists[position] is None else None,
+                        version=versions.get(index_names[position]),
+                    )
+                )
+            for position, f in zip(positions, wait_for):
+                results, counts = f.result()
+                logger.info("Num results = {}".format(len(results)))
+                result_lists[position] = results
+                for name, values in counts.items():
+                    facet_counts[name].update(values)
+
+            if not stop or not dedup_by:
+                # Each index's top offset + limit hits hold any of its hits that
+                # can be on the page.
+                break
+            # Copies take up places in the top hits of their indexes, so search
+            # deeper in those that may be hiding hits that belong on the page.
+            positions = get_lists_to_deepen(result_lists, limits, stop, dedup_by)
+            for position in positions:
+                limits[position] *= 2
+
+        results = merge_results(
+            result_lists, offset=offset, limit=limit, dedup_by=dedup_by
+        )
+        return results, {name: dict(counts) for name, counts in facet_counts.items()}
+
+    def search(
+        self, query, limit=None, offset=0, fields=None, dedup_by="node_id", filters=None
+    ):
+        """
+        Searches every index in `index_root` and returns one page of the merged
+        results, best first. Each index returns its own top offset + limit hits,
+        which are merged by score. Hits sharing the same `dedup_by` value
+        ("node_id", "content_id", or None to keep every hit) are collapsed into
+        the best scoring one, and indexes are searched deeper while collapsed
+        copies may be keeping hits off the page. The "locations" of each hit
+        list the channels and nodes of the copies found among the hits
+        searched, which is every copy when `limit` is None. In shared mode
+        this is a single query.
+
+        `filters` maps fields in FILTER_FIELDS to the value, or list of values,
+        that hits must have, and is applied inside the index.
+        """
+        results, _ = self._search_indexes(
+            query,
+            limit=limit,
+            offset=offset,
+            fields=fields,
+            dedup_by=dedup_by,
+            filters=filters,
+        )
+        return results
+
+    def suggest(self, prefix, limit=SUGGESTION_LIMIT, filters=None):
+        """
+        Returns up to `limit` titles for type-ahead, best first, of nodes whose
+        title or tags have words starting with each word typed in `prefix`.
+        Uses the completion field, so indexes built without it give nothing.
+        """
+        words = [
+            token.text[:COMPLETION_MAX_SIZE]
+            for token in suggestion_analyzer(prefix)
+            if len(token.text) >= COMPLETION_MIN_SIZE
+        ]
+        if not words:
+            return []
 
-                if "node_id" in result:
-                    if result["node_id"] in all_nodes:
-                        continue
-                    all_nodes.append(result["node_id"])
+        versions = self.get_index_versions()
+        index_names, filters = self._select_indexes(versions, filters)
 
-                all_results.append(result)
+        results, _ = self._search_and_merge(
+            And([Term("completion", word) for word in words]),
+            index_names,
+            versions,
+            limit=limit,
+            offset=0,
+            fields=["title"],
+            dedup_by="title",
+            filters=filters,
+            facets=None,
+        )
+        return [result["title"] for result in results]
 
-        return sorted(all_results, key=lambda x: -x["score"])
+    def faceted_search(
+        self,
+        query,
+        limit=None,
+        offset=0,
+        fields=None,
+        dedup_by="node_id",
+        filters=None,
+        facets=FILTER_FIELDS,
+    ):
+        """
+        Like `search`, but returns a dict with the page of "results" and the
+        "facets": for each field in `facets`, the number of matching documents
+        with each value, counted over all matches rather than just the page.
+        Counts are of documents, before copies are collapsed by `dedup_by`.
+        """
+        results, facet_counts = self._search_indexes(
+            query,
+            limit=limit,
+            offset=offset,
+            fields=fields,
+            dedup_by=dedup_by,
+            filters=filters,
+            facets=facets,
+        )
+        return {"results": results, "facets": facet_counts}
@@ -0,0 +1,156 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import uuid
+
+from le_utils.constants import content_kinds
+from le_utils.constants import format_presets
+
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content.router import using_content_database  # noqa: E402
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+from kolibri_content_tools.kolibri_db.availability import stamp_availability  # noqa: E402
+from kolibri_content_tools.kolibri_db.availability import StorageStatCache  # noqa: E402
+from kolibri_content_tools.kolibri_db.writers import SQLiteExportWriter  # noqa: E402
+
+
+def make_id(name):
+    return uuid.uuid5(uuid.NAMESPACE_URL, name).hex
+
+
+# (title, parent title, kind, [(checksum name, supplementary)])
+NODES = [
+    ("root", None, content_kinds.TOPIC, []),
+    ("t1", "root", content_kinds.TOPIC, []),
+    ("t1a", "t1", content_kinds.TOPIC, []),
+    ("v1", "t1a", content_kinds.VIDEO, [("present", False)]),
+    ("v2", "t1a", content_kinds.VIDEO, [("missing", False)]),
+    ("t1b", "t1", content_kinds.TOPIC, []),
+    # Only its subtitles are in storage.
+    ("v3", "t1b", content_kinds.VIDEO, [("missing", False), ("subtitles", True)]),
+    ("t2", "root", content_kinds.TOPIC, []),
+    ("v4", "t2", content_kinds.VIDEO, [("other", False)]),
+    ("t3", "root", content_kinds.TOPIC, []),
+]
+AVAILABLE = {"root", "t1", "t1a", "v1"}
+
+
+class StampAvailabilityTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.storage_dir = os.path.join(self.tempdir, "storage")
+        self.path = os.path.join(self.tempdir, "channel.sqlite3")
+        open(self.path, "w").close()
+        with using_content_database(self.path), contextlib.redirect_stdout(io.StringIO()):
+            publish.prepare_export_database(self.path)
+        with SQLiteExportWriter(self.path) as writer:
+            for title, parent, kind, files in NODES:
+                node = writer.add_node({
+                    "id": make_id(title),
+                    "parent_id": parent and make_id(parent),
+                    "content_id": make_id("content/" + title),
+                    "channel_id": make_id("channel"),
+                    "title": title,
+                    "kind": kind,
+                    "available": True,
+                })
+                for name, supplementary in files:
+                    writer.add_file(
+                        node,
+                        {"id": make_id(name), "extension": "mp4", "file_size": 1},
+                        {
+                            "id": make_id(title + "/" + name),
+                            "checksum": make_id(name),
+                            "extension": "mp4",
+                            "file_size": 1,
+                            "preset": format_presets.VIDEO_SUBTITLE if supplementary else format_presets.VIDEO_HIGH_RES,
+                            "supplementary": supplementary,
+                            "available": True,
+                        },
+                    )
+        for name in ("present", "subtitles"):
+            self.add_to_storage(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def add_to_storage(self, name):
+        filename = "{}.mp4".format(make_id(name))
+        directory = os.path.join(self.storage_dir, filename[0], filename[1])
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, filename), "w").close()
+
+    def stamp(self, cache=None):
+        with using_content_database(self.path):
+            return stamp_availability(self.storage_dir, cache=cache, max_workers=2)
+
+    def get_available(self, table, column):
+        connection = sqlite3.connect(self.path)
+        try:
+            return {row[0] for row in connection.execute(
+                "SELECT {} FROM {} WHERE available = 1".format(column, table))}
+        finally:
+            connection.close()
+
+    def test_nested_topics(self):
+        counts = self.stamp()
+        self.assertEqual(counts, {
+            "local_files_available": 2,
+            "local_files_missing": 2,
+            "nodes_available": len(AVAILABLE),
+            "nodes_unavailable": len(NODES) - len(AVAILABLE),
+        })
+        self.assertEqual(self.get_available("content_contentnode", "title"), AVAILABLE)
+        self.assertEqual(
+            self.get_available("content_localfile", "id"), {make_id("present"), make_id("subtitles")})
+        self.assertEqual(
+            self.get_available("content_file", "id"), {make_id("v1/present"), make_id("v3/subtitles")})
+
+    def test_cache(self):
+        cache = StorageStatCache()
+        self.stamp(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+        # Files added since are not seen until the cache is dropped.
+        self.add_to_storage("other")
+        self.stamp(cache)
+        self.assertEqual((cache.hits, cache.misses), (4, 4))
+        self.assertEqual(self.get_available("content_contentnode", "title"), AVAILABLE)
+        self.stamp(StorageStatCache())
+        self.assertEqual(self.get_available("content_contentnode", "title"), AVAILABLE | {"t2", "v4"})
+
+    def test_expired_entries(self):
+        cache = StorageStatCache(max_age=0)
+        self.stamp(cache)
+        self.add_to_storage("other")
+        self.stamp(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 8))
+        self.assertEqual(self.get_available("content_contentnode", "title"), AVAILABLE | {"t2", "v4"})
+
+
+class PublishAvailabilityTestCase(unittest.TestCase):
+    def publish(self, **kwargs):
+        channel = source_tree.generate_source_channel(num_nodes=60, num_exercises=5, seed=17)
+        with contextlib.redirect_stdout(io.StringIO()):
+            path, _ = publish.create_content_database(channel, True, None, False, **kwargs)
+        self.addCleanup(os.remove, path)
+        connection = sqlite3.connect(path)
+        try:
+            return dict(connection.execute(
+                "SELECT available, COUNT(*) FROM content_file GROUP BY available").fetchall())
+        finally:
+            connection.close()
+
+    def test_stamped_on_publish(self):
+        # The synthetic channel's files are not in storage.
+        unstamped = self.publish()
+        self.assertEqual(list(unstamped), [1])
+        self.assertEqual(self.publish(stamp_available=True), {0: unstamped[1]})
@@ -0,0 +1,124 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from le_utils.constants import content_kinds
+
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import channel_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+from kolibri_content_tools.kolibri_db.channel_tree import ChannelTree  # noqa: E402
+
+
+def get_topic_stats_by_query(path):
+    """
+    Returns what ChannelTree.get_topic_stats should, from range queries on
+    each topic's subtree.
+    """
+    connection = sqlite3.connect(path)
+    stats = {}
+    try:
+        topics = connection.execute(
+            "SELECT id, tree_id, lft, rght FROM content_contentnode WHERE kind = ?", [content_kinds.TOPIC]).fetchall()
+        for topic_id, tree_id, lft, rght in topics:
+            subtree = "FROM content_contentnode n WHERE n.tree_id = ? AND n.lft BETWEEN ? AND ?"
+            size = connection.execute(
+                "SELECT COALESCE(SUM(f.file_size), 0) FROM content_file f "
+                "WHERE f.contentnode_id IN (SELECT n.id {})".format(subtree),
+                [tree_id, lft, rght],
+            ).fetchone()[0]
+            kind_counts = dict(connection.execute(
+                "SELECT n.kind, COUNT(*) {} AND n.kind != ? GROUP BY n.kind".format(subtree),
+                [tree_id, lft, rght, content_kinds.TOPIC],
+            ))
+            stats[topic_id] = {
+                "size": size,
+                "resource_count": sum(kind_counts.values()),
+                "kind_counts": kind_counts,
+            }
+    finally:
+        connection.close()
+    return stats
+
+
+class TopicStatsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        channel = source_tree.generate_source_channel(num_nodes=150, num_exercises=10, branching=4, seed=13)
+        with contextlib.redirect_stdout(io.StringIO()):
+            path, _ = publish.create_content_database(channel, True, None, False)
+        cls.path = os.path.join(cls.tempdir, "channel.sqlite3")
+        shutil.move(path, cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    def copy_database(self, update):
+        path = os.path.join(self.tempdir, "copy.sqlite3")
+        shutil.copyfile(self.path, path)
+        self.addCleanup(os.remove, path)
+        connection = sqlite3.connect(path)
+        with connection:
+            update(connection)
+        connection.close()
+        return path
+
+    def assert_topic_stats(self, path):
+        expected = get_topic_stats_by_query(path)
+        self.assertGreater(len(expected), 10)
+        modes = [False, True] if channel_tree.numpy is not None else [False]
+        for use_numpy in modes:
+            stats = ChannelTree.from_database(path, use_numpy=use_numpy).get_topic_stats()
+            self.assertEqual(stats, expected, use_numpy)
+
+    def test_topic_stats(self):
+        self.assert_topic_stats(self.path)
+
+    def test_numbering_with_gaps(self):
+        self.assert_topic_stats(self.copy_database(lambda connection: connection.execute(
+            "UPDATE content_contentnode SET lft = 3 * lft, rght = 3 * rght + 1")))
+
+    def test_several_trees(self):
+        def add_tree(connection):
+            # A copy of the subtree of a child of the root as a second tree,
+            # numbered from 1, so the numbers of the two trees overlap.
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(content_contentnode)")]
+            tree_id, lft, rght = connection.execute(
+                "SELECT tree_id, lft, rght FROM content_contentnode WHERE level = 1 AND kind = ? "
+                "ORDER BY rght - lft DESC LIMIT 1",
+                [content_kinds.TOPIC],
+            ).fetchone()
+            rows = connection.execute(
+                "SELECT {} FROM content_contentnode WHERE tree_id = ? AND lft BETWEEN ? AND ?".format(
+                    ", ".join(columns)),
+                [tree_id, lft, rght],
+            ).fetchall()
+            copies = []
+            for row in rows:
+                node = dict(zip(columns, row))
+                node.update(
+                    id=node["id"][:-1] + "x",
+                    parent_id=None if node["lft"] == lft else node["parent_id"][:-1] + "x",
+                    tree_id=tree_id + 1,
+                    level=node["level"] - 1,
+                    lft=node["lft"] - lft + 1,
+                    rght=node["rght"] - lft + 1,
+                )
+                copies.append([node[column] for column in columns])
+            connection.executemany(
+                "INSERT INTO content_contentnode ({}) VALUES ({})".format(
+                    ", ".join(columns), ", ".join("?" for _ in columns)),
+                copies,
+            )
+
+        self.assert_topic_stats(self.copy_database(add_tree))
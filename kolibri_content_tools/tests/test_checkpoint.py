@@ -0,0 +1,126 @@
+import contextlib
+import functools
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from le_utils.constants import format_presets
+
+from kolibri_content_tools.tests.utils import dump_content_database
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+from kolibri_content_tools.kolibri_db.checkpoint import get_checkpoint_database_path  # noqa: E402
+from kolibri_content_tools.kolibri_db.checkpoint import PublishCheckpoint  # noqa: E402
+from kolibri_content_tools.kolibri_db.writeback import SourceWriteBack  # noqa: E402
+
+BATCH_SIZE = 50
+
+
+def iter_nodes(node):
+    yield node
+    for child in node.children:
+        yield from iter_nodes(child)
+
+
+def generate_channel():
+    """
+    Returns a synthetic channel where every node with files also has a
+    thumbnail, so exporting it queues source updates of the encodings.
+    """
+    channel = source_tree.generate_source_channel(num_nodes=300, num_exercises=10, seed=5)
+    for number, node in enumerate(iter_nodes(channel.root)):
+        if node.files:
+            node.files.append(source_tree.SourceFile(
+                id="{:032x}".format(number),
+                checksum="{:032x}".format(number + 10 ** 6),
+                file_size=10,
+                preset_id=format_presets.VIDEO_THUMBNAIL,
+                extension="png",
+            ))
+    return channel
+
+
+def get_updates(source_writeback):
+    return {pk: fields for updates in source_writeback.node_updates.values() for pk, fields in updates.items()}
+
+
+class ResumeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        for patcher in [
+            mock.patch.object(publish, "get_thumbnail_encoding", lambda filename, dimension=None: "data:" + filename),
+            # Comes from the Studio tree that publish runs in.
+            mock.patch.object(publish, "create_thumbnail_from_base64", lambda encoding, **kwargs: None, create=True),
+            mock.patch.object(publish, "PublishCheckpoint", functools.partial(PublishCheckpoint, batch_size=BATCH_SIZE)),
+            # The migrate command prints its progress.
+            contextlib.redirect_stdout(io.StringIO()),
+        ]:
+            patcher.__enter__()
+            self.addCleanup(patcher.__exit__, None, None, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def publish(self, source_writeback, **kwargs):
+        return publish.create_content_database(
+            generate_channel(), True, None, False, source_writeback=source_writeback, **kwargs)
+
+    def test_resume_after_failure(self):
+        expected_writeback = SourceWriteBack()
+        expected_db, expected_stats = self.publish(expected_writeback)
+        self.addCleanup(os.remove, expected_db)
+        expected = dump_content_database(expected_db)
+        exported = len(expected["content_contentnode"])
+
+        map_content_node = publish.map_content_node
+        mapped = []
+
+        def map_or_fail(node, *args, **kwargs):
+            if len(mapped) == 3 * BATCH_SIZE + 10:
+                raise IOError("Storage unavailable")
+            mapped.append(node.node_id)
+            return map_content_node(node, *args, **kwargs)
+
+        with mock.patch.object(publish, "map_content_node", map_or_fail):
+            with self.assertRaisesRegex(IOError, "Storage unavailable"):
+                self.publish(SourceWriteBack(), checkpoint_dir=self.checkpoint_dir)
+
+        channel = generate_channel()
+        export_db = get_checkpoint_database_path(self.checkpoint_dir, channel.id, channel.version + 1)
+        checkpoint = PublishCheckpoint(export_db)
+        self.assertTrue(os.path.exists(export_db))
+        self.assertTrue(checkpoint.exists())
+        # Only the full batches were kept, and the export database has
+        # exactly the nodes the checkpoint lists.
+        self.assertEqual(checkpoint.load(), 3 * BATCH_SIZE)
+        self.assertEqual(checkpoint.done, set(mapped[:3 * BATCH_SIZE]))
+        rows = dump_content_database(export_db)["content_contentnode"]
+        self.assertEqual(len(rows), 3 * BATCH_SIZE)
+
+        mapped = []
+        resumed_writeback = SourceWriteBack()
+        with mock.patch.object(publish, "map_content_node", map_or_fail):
+            resumed_db, resumed_stats = self.publish(resumed_writeback, checkpoint_dir=self.checkpoint_dir)
+        self.addCleanup(checkpoint.remove)
+        self.assertEqual(resumed_db, export_db)
+        self.assertEqual(len(mapped), exported - 3 * BATCH_SIZE)
+        self.assertFalse(checkpoint.done & set(mapped))
+
+        # The tree was rebuilt along with the last batch, so the MPTT fields
+        # match those of the uninterrupted export too.
+        self.assertEqual(dump_content_database(resumed_db), expected)
+        self.assertEqual(resumed_stats.as_dict(), expected_stats.as_dict())
+
+        # The thumbnail encodings of the nodes exported before the failure
+        # are written back along with the rest.
+        updates = get_updates(resumed_writeback)
+        self.assertEqual(updates, get_updates(expected_writeback))
+        checkpointed_pks = {node.pk for node in iter_nodes(channel.root) if node.node_id in checkpoint.done}
+        self.assertTrue(checkpointed_pks & set(updates))
@@ -0,0 +1,190 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content import models as kolibrimodels  # noqa: E402
+from kolibri_content.router import using_content_database  # noqa: E402
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import cleanup  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+from kolibri_content_tools.kolibri_db.cleanup import sweep_orphan_files  # noqa: E402
+
+DAY = 24 * 60 * 60
+
+
+def make_checksum(name):
+    return uuid.uuid5(uuid.NAMESPACE_URL, name).hex
+
+
+class SweepTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.storage_dir = os.path.join(self.tempdir, "storage")
+        os.makedirs(self.storage_dir)
+        self.databases = [
+            self.create_database("a", ["shared", "a1", "a2"]),
+            self.create_database("b", ["shared", "b1"]),
+        ]
+        self.kept = [self.add_file(name) for name in ("shared", "a1", "a2", "b1")]
+        self.orphans = [self.add_file(name) for name in ("orphan1", "orphan2", "orphan3")]
+        self.recent = [self.add_file("recent", age=60)]
+        # Not named or placed like local files.
+        self.others = [os.path.join(self.storage_dir, "notes.txt")]
+        misplaced = "{}.mp4".format(make_checksum("misplaced"))
+        self.others.append(os.path.join(self.storage_dir, "0", "0", misplaced))
+        for path in self.others:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("other")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_database(self, name, file_names):
+        path = os.path.join(self.tempdir, name + ".sqlite3")
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute("CREATE TABLE content_localfile (id TEXT PRIMARY KEY)")
+            connection.executemany(
+                "INSERT INTO content_localfile (id) VALUES (?)", [(make_checksum(name),) for name in file_names])
+        connection.close()
+        return path
+
+    def add_file(self, name, age=2 * DAY):
+        filename = "{}.mp4".format(make_checksum(name))
+        directory = os.path.join(self.storage_dir, filename[0], filename[1])
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename)
+        with open(path, "w") as f:
+            f.write(name)
+        modified = time.time() - age
+        os.utime(path, (modified, modified))
+        return path
+
+    def assert_exist(self, paths, exist=True):
+        for path in paths:
+            self.assertEqual(os.path.exists(path), exist, path)
+
+    def test_sweep(self):
+        self.assertEqual(sweep_orphan_files(self.storage_dir, self.databases), (3, len("orphan1") * 3))
+        self.assert_exist(self.orphans, False)
+        self.assert_exist(self.kept + self.recent + self.others)
+        self.assertEqual(sweep_orphan_files(self.storage_dir, self.databases), (0, 0))
+
+    def test_dry_run(self):
+        self.assertEqual(sweep_orphan_files(self.storage_dir, self.databases, dry_run=True), (3, len("orphan1") * 3))
+        self.assert_exist(self.kept + self.orphans + self.recent + self.others)
+
+    def test_grace_period(self):
+        self.assertEqual(sweep_orphan_files(self.storage_dir, self.databases, grace_period=0)[0], 4)
+        self.assert_exist(self.recent, False)
+        self.assert_exist(self.kept + self.others)
+
+    def test_databases_opened_once_per_batch(self):
+        with mock.patch.object(cleanup, "ChannelDatabaseReader", wraps=cleanup.ChannelDatabaseReader) as reader:
+            sweep_orphan_files(self.storage_dir, self.databases, dry_run=True)
+            self.assertEqual(reader.call_count, len(self.databases))
+            reader.reset_mock()
+            # Seven old files, in batches of two.
+            self.assertEqual(sweep_orphan_files(self.storage_dir, self.databases, batch_size=2)[0], 3)
+            self.assertLessEqual(reader.call_count, 4 * len(self.databases))
+        self.assert_exist(self.orphans, False)
+        self.assert_exist(self.kept)
+
+    def test_needs_databases(self):
+        with self.assertRaises(ValueError):
+            sweep_orphan_files(self.storage_dir, [])
+
+
+# Tables of the rows that refer to nodes, and their node column.
+REFERENCES = [
+    ("content_file", "contentnode_id"),
+    ("content_assessmentmetadata", "contentnode_id"),
+    ("content_topicaggregate", "contentnode_id"),
+    ("content_contentnode_tags", "contentnode_id"),
+    ("content_contentnode_has_prerequisite", "from_contentnode_id"),
+    ("content_contentnode_has_prerequisite", "to_contentnode_id"),
+    ("content_contentnode_related", "from_contentnode_id"),
+    ("content_contentnode_related", "to_contentnode_id"),
+]
+
+
+class DeleteContentTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        channel = source_tree.generate_source_channel(num_nodes=300, num_exercises=10, seed=19)
+        with contextlib.redirect_stdout(io.StringIO()):
+            path, _ = publish.create_content_database(channel, True, None, False)
+        self.path = os.path.join(self.tempdir, "channel.sqlite3")
+        shutil.move(path, self.path)
+        with using_content_database(self.path):
+            nodes = list(kolibrimodels.ContentNode.objects.exclude(kind="topic").order_by("lft"))
+            for node, other in zip(nodes, nodes[1:]):
+                node.has_prerequisite.add(other)
+                node.related.add(other)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def count(self, table, where=""):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute("SELECT COUNT(*) FROM {} {}".format(table, where)).fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_delete_in_chunks(self):
+        for table, _ in REFERENCES:
+            self.assertGreater(self.count(table), 0, table)
+        local_files = self.count("content_localfile")
+        nodes = self.count("content_contentnode")
+        # Where the last two chunks of 100 lft values start.
+        boundary = list(range(1, 2 * nodes + 1, 100))[-2]
+        kept = self.count("content_contentnode", "WHERE lft < {}".format(boundary))
+        self.assertLess(kept, nodes)
+
+        atomic = kolibrimodels.transaction.atomic
+        chunks = []
+
+        def fail_third_chunk(*args, **kwargs):
+            chunks.append(kwargs)
+            if len(chunks) == 3:
+                raise RuntimeError("Interrupted")
+            return atomic(*args, **kwargs)
+
+        with using_content_database(self.path):
+            channel = kolibrimodels.ChannelMetadata.objects.get()
+            with mock.patch.object(kolibrimodels.transaction, "atomic", fail_third_chunk):
+                with self.assertRaisesRegex(RuntimeError, "Interrupted"):
+                    channel.delete_content_tree_and_files(chunk_size=100)
+
+        # The two chunks at the end of the tree went, with the rows referring
+        # to their nodes; the nodes before them, their ancestors among them,
+        # and the channel are left for deleting again.
+        self.assertEqual(self.count("content_contentnode"), kept)
+        self.assertEqual(self.count("content_contentnode", "WHERE lft >= {}".format(boundary)), 0)
+        self.assertEqual(self.count("content_channelmetadata"), 1)
+        for table, column in REFERENCES:
+            self.assertEqual(
+                self.count(table, "WHERE {} NOT IN (SELECT id FROM content_contentnode)".format(column)), 0, table)
+        self.assertGreater(self.count("content_file"), 0)
+
+        with using_content_database(self.path):
+            channel.delete_content_tree_and_files(chunk_size=100)
+            for table in ["content_contentnode", "content_channelmetadata"] + [table for table, _ in REFERENCES]:
+                self.assertEqual(self.count(table), 0, table)
+            self.assertEqual(self.count("content_localfile"), local_files)
+            self.assertEqual(kolibrimodels.LocalFile.objects.delete_orphan_file_objects()[0], local_files)
+        self.assertEqual(self.count("content_localfile"), 0)
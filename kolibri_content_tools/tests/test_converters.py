@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from kolibri_content_tools.search import converters
+
+
+class HTMLTextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_zip(self, members):
+        path = os.path.join(self.tempdir, "app.zip")
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, content in members:
+                zf.writestr(name, content)
+        return path
+
+    def assert_for_both_parsers(self, get_text, expected):
+        self.assertEqual(get_text(), expected)
+        with mock.patch.object(converters, "etree", None):
+            self.assertEqual(get_text(), expected)
+
+    def test_inline_tags_do_not_split_words(self):
+        self.assert_for_both_parsers(
+            lambda: converters.get_text_from_html("<p>Hel<b>lo</b> w<i>or</i>ld</p>"),
+            "Hello world",
+        )
+
+    def test_block_tags_separate_words(self):
+        self.assert_for_both_parsers(
+            lambda: converters.get_text_from_html("<div>one</div><div>two</div><p>three<br>four</p><ul><li>a</li><li>b</li></ul>"),
+            "one two three four a b",
+        )
+
+    def test_read_boundaries_do_not_split_words(self):
+        path = self.make_zip([("index.html", "<html><body><p>Photosynthesis makes sugar</p></body></html>")])
+        with mock.patch.object(converters, "READ_CHUNK_SIZE", 5):
+            self.assert_for_both_parsers(
+                lambda: converters.get_text_from_zip(path),
+                "Photosynthesis makes sugar",
+            )
+
+    def test_archive_members_are_separated(self):
+        path = self.make_zip([
+            ("a.html", "<span>first</span>"),
+            ("b.html", "<span>second</span>"),
+        ])
+        self.assert_for_both_parsers(lambda: converters.get_text_from_zip(path), "first second")
+
+    def test_skipped_tags(self):
+        self.assert_for_both_parsers(
+            lambda: converters.get_text_from_html("<p>vis<script>var x;</script>ible</p><style>p {}</style>"),
+            "visible",
+        )
+
+    def test_parse_failures_keep_text_gathered(self):
+        create_parser = converters._create_parser
+
+        class FailingParser:
+            def __init__(self, parser):
+                self.parser = parser
+
+            def feed(self, data):
+                self.parser.feed(data)
+
+            def close(self):
+                raise ValueError("Document is truncated")
+
+        def create_failing_parser(xhtml=False):
+            parser, target = create_parser(xhtml=xhtml)
+            return FailingParser(parser), target
+
+        path = self.make_zip([("index.html", "<p>kept text</p>")])
+        with mock.patch.object(converters, "_create_parser", create_failing_parser):
+            self.assert_for_both_parsers(lambda: converters.get_text_from_html("<p>kept text</p>"), "kept text")
+            self.assert_for_both_parsers(lambda: converters.get_text_from_zip(path), "kept text")
@@ -0,0 +1,43 @@
+import unittest
+
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from django.db import connections  # noqa: E402
+
+from kolibri_content_tools.kolibri_db import instrumentation  # noqa: E402
+from kolibri_content_tools.kolibri_db.instrumentation import PublishInstrumentation  # noqa: E402
+
+
+def run_queries(count):
+    with connections["default"].cursor() as cursor:
+        for _ in range(count):
+            cursor.execute("SELECT 1")
+
+
+class QueryCountTestCase(unittest.TestCase):
+    def test_stage_queries(self):
+        with PublishInstrumentation() as publish:
+            run_queries(2)
+            with instrumentation.stage("outer"):
+                run_queries(3)
+                with instrumentation.stage("inner"):
+                    run_queries(4)
+        self.assertEqual(publish.queries, 9)
+        self.assertEqual(publish.stages["outer"].queries, 7)
+        self.assertEqual(publish.stages["inner"].queries, 4)
+
+    def test_nested_instrumentation(self):
+        connection = connections["default"]
+        with PublishInstrumentation() as outer:
+            run_queries(1)
+            with PublishInstrumentation() as inner:
+                run_queries(2)
+            run_queries(3)
+        self.assertEqual(inner.queries, 2)
+        self.assertEqual(outer.queries, 6)
+        self.assertNotIn("make_cursor", vars(connection))
+        self.assertNotIn("make_debug_cursor", vars(connection))
+        run_queries(1)
+        self.assertEqual(outer.queries, 6)
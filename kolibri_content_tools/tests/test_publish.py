@@ -0,0 +1,65 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from kolibri_content_tools.tests.utils import dump_content_database
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+
+
+def generate_channel():
+    return source_tree.generate_source_channel(num_nodes=300, num_exercises=10, seed=3)
+
+
+def create_content_database(channel, **kwargs):
+    # The migrate command prints its progress.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return publish.create_content_database(channel, True, None, False, **kwargs)
+
+
+class ShardedPublishTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        patcher = mock.patch.object(tempfile, "tempdir", self.tempdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_shards_export_the_same_database(self):
+        serial_db, serial_stats = create_content_database(generate_channel(), workers=1)
+        sharded_db, sharded_stats = create_content_database(generate_channel(), workers=3)
+        serial = dump_content_database(serial_db)
+        sharded = dump_content_database(sharded_db)
+        self.assertGreater(len(serial["content_contentnode"]), 250)
+        self.assertEqual(sorted(serial), sorted(sharded))
+        for table in serial:
+            self.assertEqual(serial[table], sharded[table], table)
+        self.assertEqual(serial_stats.as_dict(), sharded_stats.as_dict())
+
+    def test_failing_shard_leaves_no_files(self):
+        channel = generate_channel()
+        failing_node_id = channel.root.get_children()[1].node_id
+        map_content_nodes = publish.map_content_nodes
+
+        def map_or_fail(node, *args, **kwargs):
+            if node.node_id == failing_node_id:
+                raise RuntimeError("Shard failed")
+            return map_content_nodes(node, *args, **kwargs)
+
+        with mock.patch.object(publish, "map_content_nodes", map_or_fail), mock.patch.object(
+            publish, "prepare_export_database", wraps=publish.prepare_export_database
+        ) as prepare_export_database:
+            with self.assertRaisesRegex(RuntimeError, "Shard failed"):
+                create_content_database(channel, workers=3)
+        export_db = prepare_export_database.call_args[0][0]
+        self.assertEqual(os.listdir(self.tempdir), [os.path.basename(export_db)])
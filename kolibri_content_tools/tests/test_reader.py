@@ -0,0 +1,108 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content import models as kolibrimodels  # noqa: E402
+from kolibri_content.router import using_content_database  # noqa: E402
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+from kolibri_content_tools.kolibri_db import reader  # noqa: E402
+from kolibri_content_tools.kolibri_db.reader import ChannelDatabaseReader  # noqa: E402
+
+MISSING_ID = "f" * 32
+
+
+class ChannelDatabaseReaderTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        channel = source_tree.generate_source_channel(num_nodes=120, num_exercises=5, seed=11)
+        with contextlib.redirect_stdout(io.StringIO()):
+            path, _ = publish.create_content_database(channel, True, None, False)
+        cls.path = os.path.join(cls.tempdir, "channel.sqlite3")
+        shutil.move(path, cls.path)
+
+        with using_content_database(cls.path):
+            cls.channel = kolibrimodels.ChannelMetadata.objects.get()
+            cls.node_ids = list(kolibrimodels.ContentNode.objects.order_by("tree_id", "lft").values_list("id", flat=True))
+            cls.files = {}
+            for file in kolibrimodels.File.objects.order_by("priority", "id"):
+                cls.files.setdefault(file.contentnode_id, []).append(file.id)
+            cls.tags = {}
+            for node in kolibrimodels.ContentNode.objects.prefetch_related("tags"):
+                tag_names = sorted(tag.tag_name for tag in node.tags.all())
+                if tag_names:
+                    cls.tags[node.id] = tag_names
+            cls.checksums = set(kolibrimodels.LocalFile.objects.values_list("id", flat=True))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    def setUp(self):
+        self.reader = ChannelDatabaseReader(self.path)
+        self.addCleanup(self.reader.close)
+        # Small chunks, so lookups take several queries.
+        patcher = mock.patch.object(reader.chunks, "__defaults__", (7,))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_root(self):
+        root = self.reader.get_root()
+        self.assertEqual(root.id, self.channel.root_id)
+        self.assertIsNone(root.parent_id)
+
+    def test_get_root_without_root_id(self):
+        # Databases exported before ChannelMetadata.root was added.
+        path = os.path.join(self.tempdir, "old.sqlite3")
+        shutil.copyfile(self.path, path)
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.executescript(
+                "CREATE TABLE old_channel AS SELECT id, name, description, author, version, thumbnail, "
+                "last_updated, min_schema_version, root_pk FROM content_channelmetadata; "
+                "DROP TABLE content_channelmetadata; "
+                "ALTER TABLE old_channel RENAME TO content_channelmetadata;"
+            )
+        connection.close()
+        with ChannelDatabaseReader(path) as old_reader:
+            self.assertIsNone(old_reader.get_channel().root_id)
+            self.assertEqual(old_reader.get_root().id, self.channel.root_id)
+
+    def test_get_nodes(self):
+        nodes = self.reader.get_nodes(self.node_ids + [MISSING_ID])
+        self.assertEqual(sorted(nodes), sorted(self.node_ids))
+        for node_id, node in nodes.items():
+            self.assertEqual(node.id, node_id)
+        self.assertEqual([node.id for node in self.reader.iter_nodes()], self.node_ids)
+        self.assertIsNone(self.reader.get_node(MISSING_ID))
+
+    def test_get_files(self):
+        files = self.reader.get_files(self.node_ids + [MISSING_ID])
+        self.assertGreater(len(files), 0)
+        self.assertEqual({node_id: [file.id for file in node_files] for node_id, node_files in files.items()},
+                         self.files)
+        for node_id, node_files in files.items():
+            self.assertTrue(all(file.contentnode_id == node_id for file in node_files))
+
+    def test_get_tags(self):
+        tags = self.reader.get_tags(self.node_ids + [MISSING_ID])
+        self.assertGreater(len(tags), 0)
+        self.assertEqual({node_id: sorted(tag.tag_name for tag in node_tags) for node_id, node_tags in tags.items()},
+                         self.tags)
+
+    def test_get_local_file_ids(self):
+        missing = {"{:032x}".format(number) for number in range(20)}
+        self.assertGreater(len(self.checksums), 7)
+        self.assertEqual(self.reader.get_local_file_ids(self.checksums | missing), self.checksums)
+        self.assertEqual(self.reader.get_local_file_ids(missing), set())
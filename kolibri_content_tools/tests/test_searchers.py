@@ -0,0 +1,213 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+import whoosh.fields as fields
+import whoosh.index
+from le_utils.constants import content_kinds
+
+from kolibri_content_tools.search.indexers import ChannelIndexer
+from kolibri_content_tools.search.indexers import IndexNode
+from kolibri_content_tools.search.searchers import IndexSearcher
+
+Channel = collections.namedtuple("Channel", ["id", "name"])
+
+WORDS = ["leaf", "root", "stem", "seed", "flower", "bark", "soil", "water"]
+
+
+def make_id(*parts):
+    return uuid.uuid5(uuid.NAMESPACE_URL, "/".join(str(part) for part in parts)).hex
+
+
+def make_rows(channel_id, content_numbers):
+    """
+    Returns index rows for a node of each of `content_numbers` in the channel.
+    Nodes of the same number share a content_id and title, within a channel
+    and across channels.
+    Titles repeat "plant" a varying number of times, so the nodes score apart.
+    """
+    rows = []
+    for lft, number in enumerate(content_numbers, start=1):
+        node = IndexNode(
+            id=make_id(channel_id, lft),
+            tree_id=1,
+            lft=lft,
+            parent_id=None,
+            content_id=make_id("content", number),
+            kind=content_kinds.VIDEO if number % 2 else content_kinds.DOCUMENT,
+            title=" ".join(["plant"] * (number % 5 + 1) + [WORDS[number % len(WORDS)], str(number)]),
+            description="",
+            lang_id="en",
+            coach_content=False,
+        )
+        rows.append((node, [], []))
+    return rows
+
+
+class SearchTestCase(unittest.TestCase):
+    # Content numbers of the nodes of each channel.
+    channels = {}
+
+    def setUp(self):
+        self.index_root = tempfile.mkdtemp()
+        for channel_id, content_numbers in sorted(self.channels.items()):
+            indexer = ChannelIndexer(Channel(channel_id, channel_id), self.index_root)
+            indexer.index_rows(make_rows(channel_id, content_numbers), include_content=False)
+        self.searcher = IndexSearcher(self.index_root)
+
+    def tearDown(self):
+        self.searcher.close()
+        shutil.rmtree(self.index_root)
+
+    def page_through(self, search, page_size, key):
+        keys = []
+        offset = 0
+        while True:
+            page = search(limit=page_size, offset=offset)
+            self.assertLessEqual(len(page), page_size)
+            keys.extend(result[key] for result in page)
+            if len(page) < page_size:
+                return keys
+            offset += page_size
+
+
+class OffsetPaginationTestCase(SearchTestCase):
+    channels = {
+        "a" * 32: range(0, 23),
+        "b" * 32: range(10, 30),
+        "c" * 32: range(25, 31),
+    }
+
+    def test_pages_have_no_gaps_or_repeats(self):
+        expected = [result["node_id"] for result in self.searcher.search("plant")]
+        self.assertEqual(len(expected), 49)
+        for page_size in (1, 4, 7, 50):
+            keys = self.page_through(
+                lambda **kwargs: self.searcher.search("plant", **kwargs), page_size, "node_id"
+            )
+            self.assertEqual(keys, expected)
+
+    def test_channel_pages_have_no_gaps_or_repeats(self):
+        channel_id = "b" * 32
+        expected = [result["node_id"] for result in self.searcher.search_channel("plant", channel_id)]
+        self.assertEqual(len(expected), 20)
+        for page_size in (1, 3, 20):
+            keys = self.page_through(
+                lambda **kwargs: self.searcher.search_channel("plant", channel_id, **kwargs), page_size, "node_id"
+            )
+            self.assertEqual(keys, expected)
+
+
+class DedupPaginationTestCase(SearchTestCase):
+    # 21 distinct pieces of content, each several times in most channels, so
+    # the top hits of each index are mostly copies of the same content.
+    channels = {
+        "a" * 32: list(range(0, 21)) * 3,
+        "b" * 32: list(range(0, 20)) * 4,
+        "c" * 32: list(range(0, 21, 2)),
+        "d" * 32: list(range(5, 21)) * 2,
+    }
+
+    def test_pages_are_full(self):
+        expected = [result["content_id"] for result in self.searcher.search("plant", dedup_by="content_id")]
+        self.assertEqual(len(expected), 21)
+        self.assertEqual(len(set(expected)), 21)
+        for page_size in (1, 5, 8, 21):
+            keys = self.page_through(
+                lambda **kwargs: self.searcher.search("plant", dedup_by="content_id", **kwargs),
+                page_size,
+                "content_id",
+            )
+            self.assertEqual(keys, expected)
+
+    def test_page_locations(self):
+        results = self.searcher.search("plant", dedup_by="content_id")
+        copies = collections.Counter()
+        for content_numbers in self.channels.values():
+            copies.update(make_id("content", number) for number in content_numbers)
+        for result in results:
+            self.assertEqual(len(result["locations"]), copies[result["content_id"]])
+
+    def test_suggestions_are_distinct(self):
+        suggestions = self.searcher.suggest("pla", limit=10)
+        self.assertEqual(len(suggestions), 10)
+        self.assertEqual(len(set(suggestions)), 10)
+
+
+class IndexFreshnessTestCase(SearchTestCase):
+    channels = {
+        "a" * 32: range(0, 5),
+        "b" * 32: range(5, 10),
+        "c" * 32: range(10, 15),
+    }
+
+    def test_one_directory_scan_per_query(self):
+        self.searcher.warm_up()
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir, mock.patch(
+            "os.listdir", wraps=os.listdir
+        ) as listdir:
+            self.assertEqual(len(self.searcher.search("plant", limit=2, dedup_by="content_id")), 2)
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(listdir.call_count, 0)
+
+    def test_commits_are_picked_up(self):
+        channel_id = "b" * 32
+        self.assertEqual(len(self.searcher.search_channel("plant", channel_id)), 5)
+        indexer = ChannelIndexer(Channel(channel_id, channel_id), self.index_root)
+        indexer.index_rows(make_rows(channel_id, range(5, 8)), include_content=False)
+        self.assertEqual(len(self.searcher.search_channel("plant", channel_id)), 3)
+        self.assertEqual(len(self.searcher.search("plant")), 13)
+
+
+# The node schema before kind and coach_content were indexed.
+old_node_schema = fields.Schema(
+    node_id=fields.ID(stored=True, field_boost=5.0),
+    content_id=fields.ID(stored=True, field_boost=5.0),
+    channel_id=fields.ID(stored=True),
+    parent_id=fields.STORED(),
+    languages=fields.KEYWORD(lowercase=True, scorable=True, stored=True),
+    title=fields.TEXT(stored=True, field_boost=1.5),
+    description=fields.TEXT(stored=True),
+    thumbnail=fields.STORED(),
+    tags=fields.KEYWORD(lowercase=True, scorable=True, field_boost=1.5),
+    content=fields.TEXT(stored=False),
+)
+
+
+class OldSchemaFacetTestCase(SearchTestCase):
+    channels = {"a" * 32: range(0, 6)}
+
+    def setUp(self):
+        super(OldSchemaFacetTestCase, self).setUp()
+        self.old_channel_id = "e" * 32
+        index = whoosh.index.create_in(
+            self.index_root, old_node_schema, indexname="channel_{}".format(self.old_channel_id)
+        )
+        writer = index.writer()
+        for node, _, _ in make_rows(self.old_channel_id, range(0, 4)):
+            writer.add_document(
+                node_id=node.id,
+                channel_id=self.old_channel_id,
+                content_id=node.content_id,
+                title=node.title,
+                languages=node.lang_id,
+            )
+        writer.commit()
+
+    def test_missing_facet_fields_have_no_counts(self):
+        response = self.searcher.faceted_search("plant", filters={"channel_id": self.old_channel_id})
+        self.assertEqual(len(response["results"]), 4)
+        self.assertEqual(response["facets"]["kind"], {})
+        self.assertEqual(response["facets"]["coach_content"], {})
+        self.assertEqual(response["facets"]["languages"], {"en": 4})
+
+    def test_facets_across_old_and_new_indexes(self):
+        response = self.searcher.faceted_search("plant")
+        self.assertEqual(len(response["results"]), 10)
+        self.assertEqual(response["facets"]["kind"], {content_kinds.VIDEO: 3, content_kinds.DOCUMENT: 3})
+        self.assertEqual(response["facets"]["coach_content"], {False: 6})
+        self.assertEqual(response["facets"]["languages"], {"en": 10})
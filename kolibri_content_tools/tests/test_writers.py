@@ -0,0 +1,120 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from kolibri_content_tools.tests.utils import dump_content_database
+from kolibri_content_tools.tests.utils import setup_django
+
+setup_django()
+
+from kolibri_content import models as kolibrimodels  # noqa: E402
+from kolibri_content.router import using_content_database  # noqa: E402
+
+from kolibri_content_tools.benchmarks import source_tree  # noqa: E402
+from kolibri_content_tools.kolibri_db import publish  # noqa: E402
+from kolibri_content_tools.kolibri_db.writers import ORM_WRITER  # noqa: E402
+from kolibri_content_tools.kolibri_db.writers import ORMExportWriter  # noqa: E402
+from kolibri_content_tools.kolibri_db.writers import SQLITE_WRITER  # noqa: E402
+from kolibri_content_tools.kolibri_db.writers import SQLiteExportWriter  # noqa: E402
+
+CHANNEL_ID = uuid.uuid5(uuid.NAMESPACE_URL, "channel").hex
+
+
+def make_node(name, parent=None):
+    return {
+        "id": uuid.uuid5(uuid.NAMESPACE_URL, name).hex,
+        "parent_id": parent and parent["id"],
+        "content_id": uuid.uuid5(uuid.NAMESPACE_URL, "content/" + name).hex,
+        "channel_id": CHANNEL_ID,
+        "title": name,
+        "kind": "topic",
+    }
+
+
+def get_tree(path):
+    with using_content_database(path):
+        return sorted(kolibrimodels.ContentNode.objects.values_list("title", "lft", "rght", "tree_id", "level"))
+
+
+class WriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_database(self, name):
+        path = os.path.join(self.tempdir, name + ".sqlite3")
+        open(path, "w").close()
+        # The migrate command prints its progress.
+        with using_content_database(path), contextlib.redirect_stdout(io.StringIO()):
+            publish.prepare_export_database(path)
+        return path
+
+
+class ExportEquivalenceTestCase(WriterTestCase):
+    def publish(self, **kwargs):
+        channel = source_tree.generate_source_channel(num_nodes=300, num_exercises=10, seed=7)
+        with contextlib.redirect_stdout(io.StringIO()):
+            path, stats = publish.create_content_database(channel, True, None, False, **kwargs)
+        self.addCleanup(os.remove, path)
+        return dump_content_database(path), stats.as_dict()
+
+    def test_writers_export_the_same_database(self):
+        expected, expected_stats = self.publish(writer=ORM_WRITER, workers=1)
+        self.assertGreater(len(expected["content_contenttag"]), 0)
+        self.assertGreater(len(expected["content_assessmentmetadata"]), 0)
+        # Sharded, each shard's subtree is numbered under the root already
+        # in its database.
+        for workers in (1, 3):
+            rows, stats = self.publish(writer=SQLITE_WRITER, workers=workers)
+            self.assertEqual(sorted(rows), sorted(expected))
+            for table in expected:
+                self.assertEqual(rows[table], expected[table], (workers, table))
+            self.assertEqual(stats, expected_stats)
+
+
+class SQLiteWriterTreeTestCase(WriterTestCase):
+    def setUp(self):
+        super(SQLiteWriterTreeTestCase, self).setUp()
+        self.root = make_node("root")
+        self.a = make_node("a", self.root)
+        self.a1 = make_node("a1", self.a)
+        self.b = make_node("b", self.root)
+        self.b1 = make_node("b1", self.b)
+
+    def test_numbering_matches_the_orm(self):
+        nodes = [self.root, self.a, self.a1, self.b, self.b1]
+        expected_db = self.create_database("orm")
+        with using_content_database(expected_db), ORMExportWriter() as writer:
+            for node in nodes:
+                writer.add_node(node)
+
+        path = self.create_database("sqlite")
+        with SQLiteExportWriter(path) as writer:
+            for node in nodes[:3]:
+                writer.add_node(node)
+        # Attached under the root, after the nodes already there.
+        with SQLiteExportWriter(path) as writer:
+            for node in nodes[3:]:
+                writer.add_node(node)
+        self.assertEqual(get_tree(path), get_tree(expected_db))
+
+    def test_attach_restrictions(self):
+        path = self.create_database("sqlite")
+        with SQLiteExportWriter(path) as writer:
+            for node in [self.root, self.a, self.b]:
+                writer.add_node(node)
+        tree = get_tree(path)
+
+        with self.assertRaisesRegex(ValueError, "no node of its tree comes after it"):
+            with SQLiteExportWriter(path) as writer:
+                writer.add_node(make_node("a2", self.a))
+        with self.assertRaisesRegex(ValueError, "is not in the database"):
+            with SQLiteExportWriter(path) as writer:
+                writer.add_node(make_node("c1", make_node("c", self.root)))
+        self.assertEqual(get_tree(path), tree)
@@ -0,0 +1,65 @@
+"""
+Django setup shared by the tests that use the content models.
+"""
+import atexit
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.conf import settings
+
+from kolibri_content_tools.benchmarks.publish_suite import configure_django
+
+# Columns of generated ids, which differ between otherwise identical exports,
+# or their expressions that do not.
+GENERATED_COLUMNS = {
+    "content_assessmentmetadata": {"id": None},
+    "content_contentnode": {
+        "license_id": "(SELECT license_name FROM content_license WHERE id = license_id)",
+    },
+    "content_contentnode_tags": {"id": None},
+    "content_license": {"id": None},
+}
+
+
+def setup_django():
+    """
+    Configures Django for publishing, once per test run, with its databases
+    and storage in a temporary directory that is removed on exit. Call it
+    before importing anything that loads the content models.
+    """
+    if not settings.configured:
+        root = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, root, True)
+        configure_django(root)
+    for name in ("CONTENT_DATABASE_DIR", "STORAGE_ROOT", "DB_ROOT"):
+        os.makedirs(getattr(settings, name), exist_ok=True)
+
+
+def dump_content_database(path):
+    """
+    Returns the rows of each content table of the database at `path`, with
+    the SQLite type of each value, sorted, for comparing databases.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        tables = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'content_%'"
+        ).fetchall()
+        rows = {}
+        for (table,) in tables:
+            generated = GENERATED_COLUMNS.get(table, {})
+            columns = []
+            for column in connection.execute("PRAGMA table_info({})".format(table)):
+                name = column[1]
+                expression = generated.get(name, name)
+                if expression is not None:
+                    columns.extend([expression, "typeof({})".format(expression)])
+            rows[table] = sorted(
+                connection.execute("SELECT {} FROM {}".format(", ".join(columns), table)),
+                key=repr,
+            )
+        return rows
+    finally:
+        connection.close()
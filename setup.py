@@ -2,7 +2,6 @@ import io
 from setuptools import find_packages, setup
 
 requirements = [
-    "beautifulsoup4",
     "django>=1.11",
     "django-mptt==0.11.0",
     "jsonfield==2.0.2",
@@ -18,6 +17,14 @@ setup(
     version="0.1.0",
     description="LE-Content contains common functions for working with content across LE products.",
     install_requires=requirements,
+    extras_require={
+        # Faster HTML text extraction when indexing HTML5 apps and EPUBs
+        "lxml": ["lxml"],
+        # Generating thumbnail encodings when publishing
+        "thumbnails": ["Pillow"],
+        # Vectorized statistics of kolibri_db.channel_tree
+        "numpy": ["numpy"],
+    },
     license="MIT",
     url="https://github.com/learningequality/kolibri-content-tools",
     download_url="https://github.com/learningequality/kolibri-content-tools/releases",